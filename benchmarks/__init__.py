@@ -0,0 +1,30 @@
+"""
+Micro- and end-to-end benchmarks for the SAML hot path.
+
+Run them from the top of the source tree, where the test settings and keys
+live:
+
+    python -m benchmarks run --output before.json
+    # ... change things ...
+    python -m benchmarks run --output after.json
+    python -m benchmarks compare before.json after.json --threshold 0.10
+
+'run' writes machine-readable JSON: per benchmark the median, min, mean and
+standard deviation of the seconds per call, plus a digest of its output.
+IDs and timestamps are made deterministic (see runner.deterministic), so
+the digests only change when the generated XML does. 'compare' exits with
+status 1 if any benchmark got slower by more than the threshold, or if its
+output changed.
+
+With --memory, 'run' also records the peak bytes allocated by one call.
+Benchmarks with 'before' in their name run the code a change replaced,
+so that both sides can be compared in the same tree, with equal digests:
+
+    python -m benchmarks run parse_request render.signable --memory
+
+    python -m benchmarks scaling --output scaling.json
+
+sweeps routing over 1 to 10,000 remotes and attribute rendering over 0 to
+200 attributes (see benchmarks.scaling), recording throughput and peak
+memory too. Its results are compared the same way.
+"""
@@ -0,0 +1,120 @@
+"""
+Command line interface; see the benchmarks package docstring.
+"""
+import argparse
+import os
+import sys
+
+
+def run_command(args):
+    from . import cases  # noqa: registers the benchmarks
+    from .runner import BENCHMARKS
+    return _run(args, BENCHMARKS, memory=args.memory)
+
+
+def scaling_command(args):
+    from .scaling import SCALING
+    return _run(args, SCALING, memory=True)
+
+
+def compare_command(args):
+    from . import compare, runner
+
+    thresholds = {}
+    for option in args.prefix_threshold:
+        prefix, _, value = option.rpartition('=')
+        thresholds[prefix] = float(value)
+
+    rows = compare.compare(runner.load(args.base), runner.load(args.new),
+                           args.threshold, thresholds)
+    print(compare.format_rows(rows))
+    return 1 if compare.is_regression(rows) else 0
+
+
+def main(argv=None):
+    from .compare import DEFAULT_THRESHOLD
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    _add_run_arguments(run_parser)
+    run_parser.add_argument(
+        '--memory', action='store_true',
+        help='also record the peak memory of one call')
+    run_parser.set_defaults(func=run_command)
+
+    scaling_parser = commands.add_parser(
+        'scaling', help='run the routing and attribute scaling sweeps')
+    _add_run_arguments(scaling_parser)
+    scaling_parser.set_defaults(func=scaling_command)
+
+    compare_parser = commands.add_parser(
+        'compare', help='compare two JSON result files')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='allowed relative slowdown (default %s)' % DEFAULT_THRESHOLD)
+    compare_parser.add_argument(
+        '--prefix-threshold', action='append', default=[],
+        metavar='PREFIX=THRESHOLD',
+        help='threshold for the benchmarks starting with PREFIX')
+    compare_parser.set_defaults(func=compare_command)
+
+    args = parser.parse_args(argv)
+    if args.func is not compare_command:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+        import django
+        django.setup()
+    return args.func(args)
+
+
+def _add_run_arguments(parser):
+    parser.add_argument(
+        'benchmarks', nargs='*',
+        help='only run the benchmarks starting with these names')
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed rounds per benchmark (default 5)')
+    parser.add_argument(
+        '--min-time', type=float, default=0.1,
+        help='minimum seconds per round (default 0.1)')
+    parser.add_argument(
+        '--no-deterministic', action='store_true',
+        help='use real random IDs and the real clock')
+
+
+def _run(args, registry, memory=False):
+    from django.test.runner import DiscoverRunner
+
+    from . import runner
+
+    def report(name, result):
+        line = '%-40s %10.2f us %12.0f/s  (x%d)' % (
+            name, result['median'] * 1e6, result['ops_per_sec'],
+            result['number'])
+        if memory:
+            line += '  peak %.1f KiB' % (result['peak_bytes'] / 1024)
+        sys.stderr.write(line + '\n')
+
+    test_runner = DiscoverRunner(verbosity=0)
+    test_runner.setup_test_environment()
+    old_config = test_runner.setup_databases()
+    try:
+        data = runner.run(
+            args.benchmarks, repeat=args.repeat, min_time=args.min_time,
+            deterministic_mode=not args.no_deterministic, report=report,
+            registry=registry, memory=memory)
+    finally:
+        test_runner.teardown_databases(old_config)
+        test_runner.teardown_test_environment()
+
+    if args.output:
+        runner.save(data, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,348 @@
+"""
+The benchmarks: request decoding and parsing, XML rendering, signing and
+the end-to-end login views.
+"""
+import logging
+import os
+import string
+import warnings
+from unittest import mock
+
+from bs4 import BeautifulStoneSoup
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import Client, override_settings
+
+from saml2idp import (
+    azure, codex, google_apps, salesforce, saml2idp_metadata, xml_render,
+    xml_signing, xml_templates, zendesk)
+from saml2idp.tests import config_with_file, config_with_str
+from saml2idp.tests import test_azure, test_google_apps, test_salesforce
+from saml2idp.tests.test_signing import (
+    ASSERTION_SALESFORCE_PARAMS, IDP_PARAMS, REQUEST_PARAMS, RESPONSE_PARAMS)
+
+from .runner import benchmark
+
+KEYS_DIR = os.path.join(settings.PROJECT_ROOT, 'tests', 'keys')
+
+USERNAME = 'fred'
+PASSWORD = 'secret'
+
+ASSERTIONS = {
+    'azure': xml_render.get_assertion_azure_xml,
+    'google_apps': xml_render.get_assertion_googleapps_xml,
+    'salesforce': xml_render.get_assertion_salesforce_xml,
+    'zendesk': xml_render.get_assertion_zendesk_xml,
+}
+
+# name: (processor class, REQUEST_DATA). Zendesk is sent the Google Apps
+# request, as both use the deflate codec.
+PROCESSORS = {
+    'azure': (azure.Processor, test_azure.REQUEST_DATA),
+    'google_apps': (google_apps.Processor, test_google_apps.REQUEST_DATA),
+    'salesforce': (salesforce.Processor, test_salesforce.REQUEST_DATA),
+    'zendesk': (zendesk.Processor, test_google_apps.REQUEST_DATA),
+}
+
+SIGNING_KEYS = {
+    'rsa-2048': ('private-key', 'certificate'),
+    'rsa-4096': ('private-key-4096', 'certificate-4096'),
+}
+
+
+class _Request(object):
+    """
+    Stands in for the Django request that authn_request memoizes on.
+    """
+
+
+def _assertion_params():
+    params = {}
+    params.update(IDP_PARAMS)
+    params.update(REQUEST_PARAMS)
+    params.update(ASSERTION_SALESFORCE_PARAMS)
+    params['ATTRIBUTES'] = {'attr%d' % i: 'value %d' % i for i in range(5)}
+    return params
+
+
+# codex
+
+def _codec_benchmarks():
+    xml = codex.decode_base64(test_salesforce.SAML_REQUEST)
+
+    @benchmark('codex.base64_decode')
+    def base64_decode(stack):
+        return lambda: codex.decode_base64(test_salesforce.SAML_REQUEST)
+
+    @benchmark('codex.deflate_encode')
+    def deflate_encode(stack):
+        return lambda: codex.deflate_and_base64_encode(xml)
+
+    @benchmark('codex.inflate_decode')
+    def inflate_decode(stack):
+        return lambda: codex.decode_base64_and_inflate(
+            test_google_apps.SAML_REQUEST)
+
+    @benchmark('codex.nice64')
+    def nice64(stack):
+        return lambda: codex.nice64(xml)
+
+
+# Processor._parse_request
+
+def _parse_benchmark(name, processor_class, request_data):
+    @benchmark('parse_request.%s' % name)
+    def setup(stack):
+        processor = processor_class()
+        processor._request_xml = codex.DECODERS[processor.request_codec](
+            request_data['SAMLRequest'])
+
+        def parse():
+            # A fresh request each time, or the parse would be memoized.
+            processor._django_request = _Request()
+            processor._parse_request()
+            return sorted(processor._request_params.items())
+        return parse
+
+
+def _parse_bs4_benchmark(name, processor_class, request_data):
+    """
+    The BeautifulStoneSoup parsing _parse_request did before
+    authn_request, for comparison with parse_request.<name>: the same
+    params, and so the same digest.
+    """
+    @benchmark('parse_request.before.%s' % name)
+    def setup(stack):
+        stack.enter_context(warnings.catch_warnings())
+        warnings.simplefilter('ignore')
+        request_xml = codex.DECODERS[processor_class.request_codec](
+            request_data['SAMLRequest'])
+        is_azure = issubclass(processor_class, azure.Processor)
+
+        def parse():
+            request = BeautifulStoneSoup(request_xml).findAll()[0]
+            params = {
+                'ACS_URL': request.get('AssertionConsumerServiceURL'),
+                'REQUEST_ID': request.get('id', request.get('ID')),
+                'DESTINATION': request.get('Destination', ''),
+                'PROVIDER_NAME': request.get('ProviderName', ''),
+            }
+            if is_azure:
+                params['ACS_URL'] = azure.AZURE_ACS_URL
+                issuers = [child.getText() for child in request.contents
+                           if child.name and 'issuer' in child.name.lower()]
+                params['REQUEST_ISSUER'] = issuers[0] if issuers else None
+            return sorted(params.items())
+        return parse
+
+
+# xml_render
+
+def _render_benchmark(name, render, signed):
+    kind = 'signed' if signed else 'unsigned'
+
+    @benchmark('render.%s.%s' % (name, kind))
+    def setup(stack):
+        return lambda: render(config_with_str, _assertion_params(), signed)
+
+
+def _response_benchmark(signed):
+    kind = 'signed' if signed else 'unsigned'
+
+    @benchmark('render.response.%s' % kind)
+    def setup(stack):
+        assertion = xml_render.get_assertion_salesforce_xml(
+            config_with_str, _assertion_params(), signed)
+
+        def render():
+            params = {}
+            params.update(IDP_PARAMS)
+            params.update(REQUEST_PARAMS)
+            params.update(RESPONSE_PARAMS)
+            params['ASSERTION'] = assertion
+            return xml_render.get_response_xml(config_with_str, params,
+                                               signed)
+        return render
+
+
+def _signable_benchmarks(attributes):
+    """
+    A signed SalesForce assertion with the signature stubbed, so only the
+    string building is timed: 'after' splices the signature between the
+    head and tail rendered once (xml_render._render_signable); 'before'
+    substitutes the whole string.Template twice, as xml_render did until
+    then. Both give the same XML, and so the same digest.
+    """
+    template = xml_templates.ASSERTION_SALESFORCE
+    signature = xml_signing.get_signature_xml(
+        config_with_str, '<a/>', ASSERTION_SALESFORCE_PARAMS['ASSERTION_ID'])
+
+    def get_params(stack):
+        # Not a Mock, which would keep the unsigned XML in call_args.
+        stack.enter_context(mock.patch.object(
+            xml_render, 'get_signature_xml',
+            lambda config, xml, reference_uri: signature))
+        params = _assertion_params()
+        params['ATTRIBUTES'] = {
+            'attr%d' % i: 'value %d' % i for i in range(attributes)}
+        params['ASSERTION_SIGNATURE'] = ''
+        xml_render._get_in_response_to(params)
+        xml_render._get_subject(params)
+        xml_render._get_attribute_statement(params)
+        return params
+
+    @benchmark('render.signable.after.attributes=%d' % attributes)
+    def after(stack):
+        params = get_params(stack)
+        return lambda: xml_render._render_signable(
+            config_with_str, template, params, 'ASSERTION_SIGNATURE',
+            params['ASSERTION_ID'], True)
+
+    @benchmark('render.signable.before.attributes=%d' % attributes)
+    def before(stack):
+        params = get_params(stack)
+        compiled = string.Template(template)
+
+        def render():
+            params['ASSERTION_SIGNATURE'] = ''
+            unsigned = compiled.substitute(params)
+            params['ASSERTION_SIGNATURE'] = xml_render.get_signature_xml(
+                config_with_str, unsigned, params['ASSERTION_ID'])
+            return compiled.substitute(params)
+        return render
+
+
+# xml_signing
+
+def _sign_benchmark(name, private_key, certificate):
+    @benchmark('sign.%s' % name)
+    def setup(stack):
+        config = dict(config_with_file)
+        config['private_key_file'] = os.path.join(
+            KEYS_DIR, private_key + '.pem')
+        config['certificate_file'] = os.path.join(
+            KEYS_DIR, certificate + '.pem')
+        subject = xml_render.get_assertion_salesforce_xml(
+            config, _assertion_params())
+        reference_uri = ASSERTION_SALESFORCE_PARAMS['ASSERTION_ID']
+        return lambda: xml_signing.get_signature_xml(
+            config, subject, reference_uri)
+
+
+class _SignOncePool(object):
+    """
+    Stands in for the signing pool, signing only the first data it is
+    given and returning that signature from then on.
+    """
+    signature = None
+
+    def sign(self, signer, private_key, data):
+        if self.signature is None:
+            self.signature = signer.sign(private_key, data)
+        return self.signature
+
+
+class _EagerLogger(object):
+    """
+    Builds every debug message before the level check, as the root
+    logging.debug('...{}'.format(...)) calls in xml_signing did.
+    """
+    def isEnabledFor(self, level):
+        return True
+
+    def debug(self, msg, *args):
+        logging.debug(msg % args)
+
+    def dump(self, label, xml):
+        logging.debug('{}: {}'.format(label, xml))
+
+
+def _sign_logging_benchmarks(attributes):
+    """
+    A signed SalesForce assertion with DEBUG off and the RSA signature
+    stubbed, so the logging is not lost in the signing time: 'after' is
+    get_signature_xml as it is; 'before' formats the subject, SignedInfo
+    and Signature documents for logging.debug() first, as it did until
+    the dumps went through xml_dump. Both give the same XML.
+    """
+    reference_uri = ASSERTION_SALESFORCE_PARAMS['ASSERTION_ID']
+
+    def get_subject(stack):
+        params = _assertion_params()
+        params['ATTRIBUTES'] = {
+            'attr%d' % i: 'value %d' % i for i in range(attributes)}
+        subject = xml_render.get_assertion_salesforce_xml(config_with_str,
+                                                          params)
+        pool = _SignOncePool()
+        stack.enter_context(mock.patch.object(xml_signing, 'get_pool',
+                                              lambda: pool))
+        return subject
+
+    @benchmark('sign.logging.after.attributes=%d' % attributes)
+    def after(stack):
+        subject = get_subject(stack)
+        return lambda: xml_signing.get_signature_xml(
+            config_with_str, subject, reference_uri)
+
+    @benchmark('sign.logging.before.attributes=%d' % attributes)
+    def before(stack):
+        eager = _EagerLogger()
+        stack.enter_context(mock.patch.object(xml_signing, 'logger', eager))
+        stack.enter_context(mock.patch.object(xml_signing, 'xml_dump',
+                                              eager))
+        subject = get_subject(stack)
+        return lambda: xml_signing.get_signature_xml(
+            config_with_str, subject, reference_uri)
+
+
+# Views
+
+def _login_benchmark(name, express):
+    @benchmark('e2e.%s' % name, digest=False)
+    def setup(stack):
+        stack.enter_context(override_settings(
+            SAML2IDP_CONFIG=config_with_file,
+            SAML2IDP_EXPRESS_LOGIN=express,
+            SAML2IDP_REMOTES={
+                'salesforce': {
+                    'acs_url': test_salesforce.SALESFORCE_ACS,
+                    'processor': 'saml2idp.salesforce.Processor',
+                },
+            }))
+        saml2idp_metadata.invalidate_config_cache()
+        stack.callback(saml2idp_metadata.invalidate_config_cache)
+
+        if not User.objects.filter(username=USERNAME).exists():
+            User.objects.create_user(USERNAME, 'fred@example.com', PASSWORD)
+        client = Client()
+        client.login(username=USERNAME, password=PASSWORD)
+        login_begin = reverse('idp_login_begin')
+
+        def login():
+            response = client.get(login_begin, test_salesforce.REQUEST_DATA)
+            if not express:
+                response = client.get(response['Location'])
+            if b'SAMLResponse' not in response.content:
+                raise AssertionError('No SAMLResponse in the login response.')
+            return response.content
+        return login
+
+
+_codec_benchmarks()
+for _name, (_processor_class, _data) in sorted(PROCESSORS.items()):
+    _parse_benchmark(_name, _processor_class, _data)
+    _parse_bs4_benchmark(_name, _processor_class, _data)
+for _signed in (False, True):
+    for _name, _render in sorted(ASSERTIONS.items()):
+        _render_benchmark(_name, _render, _signed)
+    _response_benchmark(_signed)
+for _attributes in (0, 100):
+    _signable_benchmarks(_attributes)
+for _name, (_key, _certificate) in sorted(SIGNING_KEYS.items()):
+    _sign_benchmark(_name, _key, _certificate)
+for _attributes in (0, 100):
+    _sign_logging_benchmarks(_attributes)
+_login_benchmark('express', True)
+_login_benchmark('two_hop', False)
@@ -0,0 +1,74 @@
+"""
+Comparison of two benchmark result files.
+"""
+
+DEFAULT_THRESHOLD = 0.10
+
+
+def compare(base, new, threshold=DEFAULT_THRESHOLD, thresholds=None):
+    """
+    Returns a list of (name, base_median, new_median, ratio, status) rows,
+    status being 'ok', 'faster', 'SLOWER', 'CHANGED' (different output
+    digest), 'new' or 'missing'.
+
+    thresholds maps benchmark name prefixes to thresholds overriding the
+    default one, e.g. {'e2e.': 0.25} for the noisier end-to-end runs.
+    """
+    base_results = base['results']
+    new_results = new['results']
+
+    rows = []
+    for name in sorted(set(base_results) | set(new_results)):
+        if name not in new_results:
+            rows.append((name, base_results[name]['median'], None, None,
+                         'missing'))
+            continue
+        if name not in base_results:
+            rows.append((name, None, new_results[name]['median'], None,
+                         'new'))
+            continue
+
+        old, cur = base_results[name], new_results[name]
+        ratio = cur['median'] / old['median']
+        limit = _threshold(name, threshold, thresholds or {})
+
+        if old.get('digest') != cur.get('digest'):
+            status = 'CHANGED'
+        elif ratio > 1 + limit:
+            status = 'SLOWER'
+        elif ratio < 1 - limit:
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((name, old['median'], cur['median'], ratio, status))
+    return rows
+
+
+def format_rows(rows):
+    lines = ['%-40s %12s %12s %8s  %s' % (
+        'benchmark', 'base', 'new', 'ratio', 'status')]
+    for name, old, cur, ratio, status in rows:
+        lines.append('%-40s %12s %12s %8s  %s' % (
+            name, _format_seconds(old), _format_seconds(cur),
+            '-' if ratio is None else '%.3f' % ratio, status))
+    return '\n'.join(lines)
+
+
+def is_regression(rows):
+    return any(status in ('SLOWER', 'CHANGED') for row in rows
+               for status in row[4:])
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds >= 1e-3:
+        return '%.3f ms' % (seconds * 1e3)
+    return '%.2f us' % (seconds * 1e6)
+
+
+def _threshold(name, default, thresholds):
+    matches = [prefix for prefix in thresholds if name.startswith(prefix)]
+    if not matches:
+        return default
+    return thresholds[max(matches, key=len)]
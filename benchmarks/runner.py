@@ -0,0 +1,153 @@
+"""
+Benchmark registry, timing loop and result files.
+"""
+import collections
+import contextlib
+import hashlib
+import itertools
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from unittest import mock
+
+import django
+
+# name: (setup, digest). setup(stack) returns the callable to time and may
+# register cleanups on the contextlib.ExitStack it is given.
+BENCHMARKS = collections.OrderedDict()
+
+# Seconds since the epoch used as "now" in deterministic mode.
+FIXED_TIME = 1300000000
+
+
+def benchmark(name, digest=True, registry=BENCHMARKS):
+    """
+    Registers setup as benchmark name in registry. If digest is true, the
+    output of the timed callable is hashed into the results.
+    """
+    def decorator(setup):
+        registry[name] = (setup, digest)
+        return setup
+    return decorator
+
+
+@contextlib.contextmanager
+def deterministic():
+    """
+    Makes the IDs and timestamps of generated XML reproducible.
+    """
+    counter = itertools.count()
+
+    def get_random_id():
+        return '_%040x' % next(counter)
+
+    def get_time_string(delta=0):
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                             time.gmtime(FIXED_TIME + delta))
+
+    with mock.patch('saml2idp.base.get_random_id', get_random_id), \
+            mock.patch('saml2idp.base.get_time_string', get_time_string):
+        yield
+
+
+def measure(func, repeat=5, min_time=0.1):
+    """
+    Returns timing statistics, in seconds per call, for func.
+
+    The number of calls per round is doubled until a round takes at least
+    min_time; then repeat rounds of that many calls are timed.
+    """
+    number = 1
+    while True:
+        elapsed = _time(func, number)
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    rounds = [elapsed] + [_time(func, number) for i in range(repeat - 1)]
+    per_call = [seconds / number for seconds in rounds]
+    return {
+        'median': statistics.median(per_call),
+        'min': min(per_call),
+        'mean': statistics.mean(per_call),
+        'stdev': statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        'ops_per_sec': 1 / statistics.median(per_call),
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def peak_memory(func):
+    """
+    Returns the peak number of bytes allocated while calling func once.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(names=None, repeat=5, min_time=0.1, deterministic_mode=True,
+        report=None, registry=BENCHMARKS, memory=False):
+    """
+    Runs the selected benchmarks of registry (all by default) and returns
+    the results as a JSON-serializable dict. If memory is true, the peak
+    memory use of one call is recorded as well.
+    """
+    results = collections.OrderedDict()
+    for name, (setup, digest) in registry.items():
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+
+        with contextlib.ExitStack() as stack:
+            if deterministic_mode:
+                stack.enter_context(deterministic())
+            func = setup(stack)
+            output = func()
+            result = measure(func, repeat, min_time)
+            if memory:
+                result['peak_bytes'] = peak_memory(func)
+
+        if digest:
+            result['digest'] = _digest(output)
+        results[name] = result
+        if report is not None:
+            report(name, result)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'deterministic': deterministic_mode,
+        },
+        'results': results,
+    }
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(data, path):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def _digest(output):
+    if not isinstance(output, bytes):
+        output = repr(output).encode('utf-8')
+    return hashlib.sha1(output).hexdigest()
+
+
+def _time(func, number):
+    start = time.perf_counter()
+    for i in range(number):
+        func()
+    return time.perf_counter() - start
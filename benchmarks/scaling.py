@@ -0,0 +1,107 @@
+"""
+How routing and attribute rendering scale with the size of the
+configuration and of the assertion.
+
+routing.*: registry.find_processor() for an AuthnRequest whose remote is
+the last of SAML2IDP_REMOTES, for 1 to 10,000 remotes. The 'acs' variants
+are routed by ACS URL (SalesForce), the 'issuer' ones by Issuer (Azure).
+The 'cold' variants drop the remotes index before every call, like the
+first request after a configuration change.
+
+attributes.*: xml_render._get_attribute_statement() for 0 to 200
+attributes.
+
+Run with 'python -m benchmarks scaling'; the results, with throughput and
+the peak memory of one call, can be compared like those of 'run'.
+"""
+import collections
+
+from django.conf import settings
+
+from saml2idp import registry, xml_render
+from saml2idp.azure import AZURE_ACS_URL
+from saml2idp.tests import test_azure, test_salesforce
+
+from .runner import benchmark
+
+REMOTES = (1, 10, 100, 1000, 10000)
+
+ATTRIBUTES = (0, 1, 10, 50, 200)
+
+SCALING = collections.OrderedDict()
+
+# route: (remote config, REQUEST_DATA) of the remote being routed to.
+ROUTES = {
+    'acs': ({
+        'acs_url': test_salesforce.SALESFORCE_ACS,
+        'processor': 'saml2idp.salesforce.Processor',
+    }, test_salesforce.REQUEST_DATA),
+    'issuer': ({
+        'acs_url': AZURE_ACS_URL,
+        'processor': 'saml2idp.azure.Processor',
+    }, test_azure.REQUEST_DATA),
+}
+
+
+class _Request(object):
+    """
+    A Django request as find_processor() sees it after login_begin.
+    """
+    def __init__(self, config, remotes, request_data):
+        self._saml2idp_config = (config, remotes)
+        self._saml2idp_pending = (request_data['SAMLRequest'],
+                                  request_data['RelayState'])
+
+
+def get_remotes(count, sp_config):
+    """
+    Returns count remotes, the last of which is sp_config.
+    """
+    remotes = collections.OrderedDict()
+    for i in range(count - 1):
+        remotes['sp%d' % i] = {
+            'acs_url': 'https://sp%d.example.com/saml/acs' % i,
+            'processor': 'saml2idp.salesforce.Processor',
+        }
+    remotes['target'] = sp_config
+    return remotes
+
+
+def _routing_benchmark(route, count, cold):
+    name = 'routing.%s.%s.remotes=%d' % (
+        route, 'cold' if cold else 'warm', count)
+
+    @benchmark(name, registry=SCALING)
+    def setup(stack):
+        sp_config, request_data = ROUTES[route]
+        remotes = get_remotes(count, sp_config)
+        config = settings.SAML2IDP_CONFIG
+
+        def route_request():
+            if cold:
+                registry._indexes.clear()
+            processor = registry.find_processor(
+                _Request(config, remotes, request_data))
+            return processor._remote_name
+        return route_request
+
+
+def _attributes_benchmark(count):
+    @benchmark('attributes.count=%d' % count, registry=SCALING)
+    def setup(stack):
+        attributes = {'attribute%d' % i: 'value %d' % i
+                      for i in range(count)}
+
+        def render():
+            params = {'ATTRIBUTES': attributes}
+            xml_render._get_attribute_statement(params)
+            return params['ATTRIBUTE_STATEMENT']
+        return render
+
+
+for _route in sorted(ROUTES):
+    for _cold in (False, True):
+        for _count in REMOTES:
+            _routing_benchmark(_route, _count, _cold)
+for _count in ATTRIBUTES:
+    _attributes_benchmark(_count)
@@ -0,0 +1,18 @@
+"""
+Django settings for the benchmarks: the test settings, with a fast password
+hasher and an in-memory database.
+"""
+from tests.settings import *  # noqa
+
+SECRET_KEY = 'saml2idp-benchmarks'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+
+PASSWORD_HASHERS = (
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+)
@@ -3,6 +3,8 @@ import logging
 
 __VERSION__ = '0.2.3awingu1'
 
+default_app_config = 'saml2idp.apps.Saml2IdpConfig'
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logger.handlers = [logging.StreamHandler()]
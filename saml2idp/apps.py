@@ -0,0 +1,16 @@
+"""
+Django application configuration.
+"""
+from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_out
+
+
+class Saml2IdpConfig(AppConfig):
+    name = 'saml2idp'
+    verbose_name = 'SAML 2.0 Identity Provider'
+
+    def ready(self):
+        from . import resolver, result_cache
+        resolver.warm_up()
+        user_logged_out.connect(result_cache.user_logged_out,
+                                dispatch_uid='saml2idp.result_cache')
@@ -0,0 +1,178 @@
+"""
+Concurrent attribute sources.
+
+A remote whose attributes come from several backends can list them in its
+SP config instead of an attributes_function:
+
+    'attribute_sources': [
+        {
+            'function': 'myapp.ldap.get_attributes',
+            'attributes': ['givenName', 'sn', 'mail'],  # default: all
+            'timeout': 0.5,      # seconds
+            'required': True,    # default
+        },
+        {
+            'function': 'myapp.hr.get_attributes',
+            'attributes': ['department', 'employeeNumber'],
+            'timeout': 0.3,
+            'required': False,
+        },
+    ]
+
+Each function follows the attributes_function contract: it is called with
+the Django request and the names it is asked for, and returns a dict. The
+sources run at the same time on a process-wide thread pool, sized with
+
+    SAML2IDP_ATTRIBUTE_SOURCES = {
+        'workers': 8,
+    }
+
+A required source that fails or misses its timeout fails the login with
+CannotHandleAssertion. An optional one is logged and left out; it is
+waited for no longer than its timeout and, if there are required sources,
+no longer than they took, so optional sources never add to the latency.
+When several sources return the same attribute, the later one wins.
+"""
+import logging
+import threading
+import time
+from concurrent import futures
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import resolver
+from .exceptions import CannotHandleAssertion
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 5
+
+
+class AttributeSources(object):
+    """
+    An attributes_function querying the sources of a remote concurrently.
+    """
+    def __init__(self, sources):
+        self.sources = sources
+
+    def __call__(self, django_request, names):
+        jobs = []
+        try:
+            return self._get_attributes(django_request, names, jobs)
+        except CannotHandleAssertion:
+            # The login fails: don't leave the queued sources to take up
+            # the pool. Those already running cannot be stopped.
+            for source, future in jobs:
+                future.cancel()
+            raise
+
+    def _fail(self, source, reason):
+        msg = 'Attribute source %s %s.' % (source['function'], reason)
+        if source.get('required', True):
+            raise CannotHandleAssertion(msg)
+        logger.warning('%s Leaving its attributes out.', msg)
+
+    def _get_attributes(self, django_request, names, jobs):
+        """
+        Queries the sources, adding the (source, future) pairs to jobs.
+        """
+        start = time.monotonic()
+
+        for source in self.sources:
+            wanted = source.get('attributes')
+            if wanted is None:
+                wanted = names
+            else:
+                wanted = [name for name in names if name in wanted]
+                if not wanted:
+                    continue
+
+            function = resolver.resolve(source['function'])
+            if function is None:
+                self._fail(source, 'cannot import %s' % source['function'])
+                continue
+
+            jobs.append((source, submit(function, django_request, wanted)))
+
+        results = {}
+        required_done = None
+        # Required sources first, so that the time they took bounds the
+        # wait for the optional ones.
+        for required in (True, False):
+            for source, future in jobs:
+                if source.get('required', True) != required:
+                    continue
+
+                deadline = start + source.get('timeout', DEFAULT_TIMEOUT)
+                if not required and required_done is not None:
+                    deadline = min(deadline, required_done)
+                try:
+                    results[id(source)] = future.result(
+                        max(deadline - time.monotonic(), 0))
+                except futures.TimeoutError:
+                    future.cancel()
+                    self._fail(source, 'timed out after %.3fs' % (
+                        time.monotonic() - start))
+                except Exception as e:
+                    self._fail(source, '%s: %s' % (e.__class__.__name__, e))
+
+            if required and any(source.get('required', True)
+                                for source, future in jobs):
+                required_done = time.monotonic()
+
+        attributes = {}
+        for source, future in jobs:
+            attributes.update(results.get(id(source)) or {})
+        return attributes
+
+
+def submit(function, *args):
+    """
+    Returns a Future for function(*args), run on the pool.
+    """
+    return get_executor().submit(_call, function, *args)
+
+
+def _call(function, *args):
+    try:
+        return function(*args)
+    finally:
+        # Worker threads are not request threads: tidy up their database
+        # connections like the end of a request would.
+        close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the process-wide ThreadPoolExecutor running the sources (and
+    the circuit_breaker timeouts).
+    """
+    global _executor
+
+    if _executor is not None:
+        return _executor
+
+    options = getattr(settings, 'SAML2IDP_ATTRIBUTE_SOURCES', None) or {}
+    with _executor_lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(
+                max_workers=options.get('workers', DEFAULT_WORKERS))
+    return _executor
+
+
+def reset_executor():
+    """
+    Shuts down the current pool; the next get_executor() re-reads settings.
+    """
+    global _executor
+
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
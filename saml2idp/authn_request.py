@@ -0,0 +1,178 @@
+"""
+Minimal, bounded parser for SAML 2.0 AuthnRequests.
+
+Processors only need a few attributes of the root element and the text of
+its <Issuer>, so there is no point in building a document tree. This uses
+expat directly, feeds the document in chunks, and stops as soon as the
+Issuer (which the schema requires to be the first child) has been read.
+"""
+import collections
+from xml.parsers import expat
+
+from . import codex
+
+# Refuse to look at anything bigger than this many bytes.
+MAX_REQUEST_SIZE = 256 * 1024
+
+CHUNK_SIZE = 2048
+
+AuthnRequest = collections.namedtuple('AuthnRequest', [
+    'tag',
+    'acs_url',
+    'request_id',
+    'destination',
+    'provider_name',
+    'issuer',
+])
+AuthnRequest.__doc__ = """
+Parsed AuthnRequest. acs_url and request_id are None when the request
+does not carry them; destination and provider_name default to ''.
+"""
+
+
+class _Done(Exception):
+    """
+    Raised from the expat handlers to stop parsing early.
+    """
+
+
+class _Handler(object):
+
+    def __init__(self, parser):
+        self.depth = 0
+        self.root = None
+        self.in_issuer = False
+        self.issuer = None
+        self.issuer_text = []
+
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.character_data
+        parser.StartDoctypeDeclHandler = self.doctype
+        parser.EntityDeclHandler = self.doctype
+
+    def character_data(self, data):
+        if self.in_issuer:
+            self.issuer_text.append(data)
+
+    def doctype(self, *args):
+        raise ValueError('DTDs are not allowed in AuthnRequests.')
+
+    def end_element(self, name):
+        self.depth -= 1
+        if self.in_issuer and self.depth == 1:
+            self.issuer = ''.join(self.issuer_text)
+            raise _Done()
+
+    def start_element(self, name, attributes):
+        self.depth += 1
+        if self.depth == 1:
+            self.root = (name, attributes)
+        elif self.depth == 2:
+            local_name = name.rpartition(':')[2]
+            if local_name.lower() != 'issuer':
+                # Issuer comes first, if at all.
+                raise _Done()
+            self.in_issuer = True
+
+
+def parse(request_xml):
+    """
+    Returns an AuthnRequest for request_xml (str or bytes). The encoding an
+    XML declaration names is used for bytes only: str is already decoded.
+
+    Raises ValueError if request_xml does not look like XML, is too big or
+    contains a DTD, and expat.ExpatError if it is malformed.
+    """
+    encoding = None
+    if isinstance(request_xml, str):
+        request_xml = request_xml.encode('utf-8')
+        encoding = 'UTF-8'
+
+    # Expat refuses whitespace before an XML declaration.
+    request_xml = request_xml.lstrip()
+    if not request_xml.startswith(b'<'):
+        raise ValueError('RequestXML is not valid XML; '
+                         'it may need to be decoded or decompressed.')
+
+    if len(request_xml) > MAX_REQUEST_SIZE:
+        raise ValueError('RequestXML is larger than %d bytes.'
+                         % MAX_REQUEST_SIZE)
+
+    parser = expat.ParserCreate(encoding)
+    handler = _Handler(parser)
+    try:
+        for start in range(0, len(request_xml), CHUNK_SIZE):
+            parser.Parse(request_xml[start:start + CHUNK_SIZE], False)
+        parser.Parse(b'', True)
+    except _Done:
+        pass
+
+    if handler.root is None:
+        raise ValueError('RequestXML has no root element.')
+
+    tag, attributes = handler.root
+    return AuthnRequest(
+        tag=tag,
+        acs_url=attributes.get('AssertionConsumerServiceURL'),
+        request_id=attributes.get('id', attributes.get('ID')),
+        destination=attributes.get('Destination', ''),
+        provider_name=attributes.get('ProviderName', ''),
+        issuer=handler.issuer,
+    )
+
+
+def memoize(django_request, key, func, *args):
+    """
+    Returns func(*args), memoized on django_request under key.
+
+    Routing may try several processors on the same request; this lets them
+    share one decode and parse of the AuthnRequest. Exceptions are memoized
+    (and re-raised) as well.
+    """
+    try:
+        memo = django_request._saml2idp_memo
+    except AttributeError:
+        memo = django_request._saml2idp_memo = {}
+
+    try:
+        value, error = memo[key]
+    except KeyError:
+        try:
+            value, error = func(*args), None
+        except Exception as e:
+            value, error = None, e
+        memo[key] = (value, error)
+
+    if error is not None:
+        raise error
+    return value
+
+
+def decode(django_request, saml_request, codec):
+    """
+    Returns saml_request decoded with codex.DECODERS[codec], memoized.
+    """
+    return memoize(django_request, ('decode', codec, saml_request),
+                   codex.DECODERS[codec], saml_request)
+
+
+def parse_memoized(django_request, request_xml):
+    """
+    Returns parse(request_xml), memoized.
+    """
+    return memoize(django_request, ('parse', request_xml), parse, request_xml)
+
+
+def peek(django_request, saml_request):
+    """
+    Returns the AuthnRequest in saml_request, trying each codec in turn,
+    or None if it cannot be decoded and parsed at all.
+    """
+    for codec in sorted(codex.DECODERS):
+        try:
+            request_xml = decode(django_request, saml_request, codec)
+            return parse_memoized(django_request, request_xml)
+        except Exception:
+            continue
+    return None
@@ -1,6 +1,3 @@
-# Other library imports:
-from bs4 import BeautifulStoneSoup
-
 # local app imports:
 from . import base
 from . import xml_render
@@ -26,8 +23,10 @@ class Processor(base.Processor):
     Azure SP configuration should include 'subject_function' which is a
     function used by Azure processor to retrieve Subject NameID (ImmutableID).
 
-    Configuration can also include 'attribute_function' if django.user.email
-    is not the desired IDPEmail of the user.
+    Configuration can also include 'attributes_function' (or the older,
+    per-attribute 'attribute_function') if django.user.email is not the
+    desired IDPEmail of the user, and an 'attributes' list to send more
+    attributes than IDPEmail.
 
     You can use: from saml2idp.codex import convert_guid_to_immutable_id to
     convert from AD ObjectGUID to Azure ImmutableID.
@@ -58,6 +57,10 @@ class Processor(base.Processor):
         'azure': azure_config
     }
     """
+    # Lets find_processor() route Azure requests, which carry no ACS URL.
+    request_issuer = AZURE_REQUEST_ISSUER
+
+    attribute_names = ('IDPEmail',)
 
     def _parse_request(self):
         """
@@ -65,27 +68,22 @@ class Processor(base.Processor):
         We need to override parse here as Microsoft Azure doesn't send
         AssertionConsumerServiceURL (ACS_URL)
         """
-        # Minimal test to verify that it's not binarily encoded still:
-        if not self._request_xml.strip().startswith('<'):
-            raise Exception('RequestXML is not valid XML; '
-                            'it may need to be decoded or decompressed.')
-
-        soup = BeautifulStoneSoup(self._request_xml)
-        request = soup.findAll()[0]
+        request = self._parse_authn_request()
 
-        if request.get('AssertionConsumerServiceURL', None):
+        if request.acs_url:
             raise Exception(
                 'Invalid Azure request. AssertionConsumerServiceURL exists!')
 
         params = {}
         params['ACS_URL'] = AZURE_ACS_URL
-        params['REQUEST_ID'] = request.get('id', request.get('ID'))
+        params['REQUEST_ID'] = request.request_id
 
         params['REQUEST_ISSUER'] = self._get_request_issuer(request)
 
-        params['DESTINATION'] = request.get('Destination', '')
-        params['PROVIDER_NAME'] = request.get('ProviderName', '')
+        params['DESTINATION'] = request.destination
+        params['PROVIDER_NAME'] = request.provider_name
 
+        self._request = request
         self._request_params = params
 
         # Set subject format - overrides the value set in _reset()
@@ -95,15 +93,9 @@ class Processor(base.Processor):
         """
         Get Request issuer.
 
-        :params saml_request: SAML XML BeautifulSoup request object.
+        :params saml_request: authn_request.AuthnRequest instance.
         """
-        issuer = [i for i in saml_request.contents
-                  if 'issuer' in i.name.lower()]
-
-        if issuer:
-            return issuer[0].getText()
-
-        return None
+        return saml_request.issuer
 
     def _validate_request(self):
         """
@@ -136,7 +128,7 @@ class Processor(base.Processor):
                 % self._sp_config['subject_function'])
 
         if not self._django_request.user.email and \
-                not self._get_attribute_function():
+                not self._get_attributes_function():
             raise CannotHandleAssertion('Invalid user email.')
 
     def _determine_audience(self):
@@ -145,26 +137,31 @@ class Processor(base.Processor):
         """
         self._audience = AZURE_REQUEST_ISSUER
 
+    def _get_attribute_names(self):
+        """
+        Returns IDPEmail, followed by the extra names in
+        sp_config['attributes'].
+        """
+        names = list(self.attribute_names)
+        names.extend(name for name in self._sp_config.get('attributes', ())
+                     if name not in names)
+        return names
+
     def _get_attributes(self):
         """
         Returns a dict of attributes to be added in response assertion.
 
-        Mainly adding the IDPEmail attribute.
+        Mainly adding the IDPEmail attribute, which defaults to the email
+        address of the user.
         """
-        # Default value
-        idp_email = self._django_request.user.email
-
-        attribute_function = self._get_attribute_function()
-        if attribute_function:
-            idp_email = attribute_function(self._django_request, 'IDPEmail')
-
-        return {
-            'IDPEmail': idp_email
-        }
+        attributes = {'IDPEmail': self._django_request.user.email}
+        attributes.update(super(Processor, self)._get_attributes())
+        return attributes
 
     def _format_assertion(self):
         """
         Format SAML Response Assertion.
         """
         self._assertion_xml = xml_render.get_assertion_azure_xml(
-            self._saml2idp_config, self._assertion_params, signed=True)
+            self._get_signing_config(), self._assertion_params,
+            signed=self._should_sign_assertion())
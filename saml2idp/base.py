@@ -1,22 +1,41 @@
 # core python imports:
 import time
 import uuid
-import codecs
 
 # Django and other library imports:
-from bs4 import BeautifulStoneSoup
-from django.utils.importlib import import_module
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.log import logging
 
 
 # local app imports:
+from . import attribute_sources
+from . import authn_request
+from . import circuit_breaker
 from . import codex
 from . import exceptions
+from . import metrics
+from . import registry
+from . import request_token
+from . import resolver
+from . import result_cache
+from . import saml2idp_metadata
+from . import timing
 from . import xml_render
 
 MINUTES = 60
 HOURS = 60 * MINUTES
 
+# Values of sp_config['sign']: which elements of the Response get signed.
+SIGN_POLICIES = ('assertion', 'response', 'both', 'none')
+
+# SP config keys that override the IdP signing configuration, grouped by
+# the alternatives they replace.
+SIGNING_OVERRIDES = (
+    ('signing_algorithm',),
+    ('private_key_file', 'private_key_str'),
+    ('certificate_file', 'certificate_str'),
+)
+
 logger = logging.getLogger('saml2idp')
 
 
@@ -31,6 +50,17 @@ def get_time_string(delta=0):
                          time.gmtime(time.time() + delta))
 
 
+def bulk_attribute_function(attribute_function):
+    """
+    Adapts a per-attribute attribute_function(django_request, attribute) to
+    the attributes_function(django_request, names) -> dict contract.
+    """
+    def attributes_function(django_request, names):
+        return {name: attribute_function(django_request, name)
+                for name in names}
+    return attributes_function
+
+
 class Processor(object):
     """
     Base SAML 2.0 AuthnRequest to Response Processor.
@@ -41,6 +71,12 @@ class Processor(object):
     # so that your sub-classes have access to all information: use wisely.
     # Formatting note: These methods are alphabetized.
 
+    # Attributes sent when the SP config has no 'attributes' list.
+    attribute_names = ()
+
+    # Name of the codex.DECODERS entry used to decode the AuthnRequest.
+    request_codec = 'base64'
+
     def __init__(self):
         self._logger = logging.getLogger(self.__class__.__name__)
 
@@ -50,13 +86,13 @@ class Processor(object):
         """
         self._determine_assertion_id()
         self._determine_audience()
-        self._determine_subject()
+        self._timed('determine_subject', self._determine_subject)
         self._determine_session_index()
 
         self._assertion_params = {
             'ASSERTION_ID': self._assertion_id,
             'ASSERTION_SIGNATURE': '',  # it's unsigned
-            'ATTRIBUTES': self._get_attributes(),
+            'ATTRIBUTES': self._timed('get_attributes', self._get_attributes),
             'AUDIENCE': self._audience,
             'AUTH_INSTANT': get_time_string(),
             'ISSUE_INSTANT': get_time_string(),
@@ -87,10 +123,10 @@ class Processor(object):
 
     def _decode_request(self):
         """
-        Decodes _request_xml from _saml_request.
+        Decodes _request_xml from _saml_request, using request_codec.
         """
-        self._request_xml = codecs.decode(
-            self._saml_request.encode('utf-8'), 'base64').decode('utf-8')
+        self._request_xml = authn_request.decode(
+            self._django_request, self._saml_request, self.request_codec)
 
     def _determine_assertion_id(self):
         """
@@ -120,14 +156,25 @@ class Processor(object):
         Determines _subject for Assertion Subject.
 
         This method calls sp_config['subject_function'] if exists, otherwise
-        it will use self._django_request.user.email.
+        it will use self._django_request.user.email. When the function is
+        unavailable (see circuit_breaker), the user is not authorized unless
+        a cached subject is used; never the email.
         """
         # default value
         self._subject = self._django_request.user.email
 
         subject_function = self._get_subject_function()
         if subject_function:
-            self._subject = subject_function(self._django_request)
+            subject_function = self._guard(circuit_breaker.SUBJECT,
+                                           subject_function)
+            try:
+                self._subject = self._get_cached_result(
+                    result_cache.SUBJECT, subject_function,
+                    self._django_request)
+            except circuit_breaker.Unavailable:
+                self._subject = circuit_breaker.fallback(
+                    self._django_request, self._remote_name,
+                    self._sp_config, circuit_breaker.SUBJECT)
 
     def _encode_response(self):
         """
@@ -139,8 +186,18 @@ class Processor(object):
         """
         Retrieves the _saml_request AuthnRequest from the _django_request.
         """
-        self._saml_request = self._django_request.session['SAMLRequest']
-        self._relay_state = self._django_request.session['RelayState']
+        self._saml_request, self._relay_state = (
+            request_token.get_pending_request(self._django_request))
+
+    def _flush_timings(self):
+        """
+        Hands the recorded stage timings to the timing sink.
+        """
+        if self._timings:
+            timings, self._timings = self._timings, []
+            if self._timing_sink:
+                self._timing_sink(self._remote_name, timings)
+            metrics.observe_stages(self._remote_name, timings)
 
     def _format_assertion(self):
         """
@@ -152,18 +209,37 @@ class Processor(object):
         """
         Formats _response_params as _response_xml.
         """
-        sign_it = self._saml2idp_config['signing']
         self._response_xml = xml_render.get_response_xml(
-            self._saml2idp_config, self._response_params, signed=sign_it)
+            self._get_signing_config(), self._response_params,
+            signed=self._should_sign_response())
 
     def _get_attributes(self):
         """
         Returns a dict of attributes to be added in response assertion.
 
-        This method must be overridden in the sub-classes processors, as there
-        are no generic attributes and it depends on the Service provider.
+        The attributes named by _get_attribute_names() are fetched with a
+        single call of the attributes function; see
+        _get_attributes_function(). Names it returns no value for are left
+        out. When the function is unavailable (see circuit_breaker), the
+        fallback decides.
         """
-        return {}
+        names = self._get_attribute_names()
+        attributes_function = self._get_attributes_function()
+        if not names or not attributes_function:
+            return {}
+
+        attributes_function = self._guard(circuit_breaker.ATTRIBUTES,
+                                          attributes_function)
+        try:
+            attributes = result_cache.get_or_call_many(
+                self._django_request, self._remote_name, self._sp_config,
+                names, attributes_function)
+        except circuit_breaker.Unavailable:
+            attributes = circuit_breaker.fallback(
+                self._django_request, self._remote_name, self._sp_config,
+                circuit_breaker.ATTRIBUTES, {})
+        return {name: attributes[name] for name in names
+                if name in attributes}
 
     def _get_attribute_function(self):
         """
@@ -193,6 +269,61 @@ class Processor(object):
 
         return self._import_function_from_str(attribute_function)
 
+    def _get_attribute_names(self):
+        """
+        Returns the names of the attributes to send: sp_config['attributes'],
+        by default the attribute_names of the processor.
+        """
+        return list(self._sp_config.get('attributes', self.attribute_names))
+
+    def _get_attributes_function(self):
+        """
+        Returns the function fetching attributes in bulk.
+
+        sp_config['attributes_function'] can be a string or a function. It
+        should expect a Django request and a list of attribute names, and
+        return a dict of attribute values by name. Without one, the
+        per-attribute attribute_function is called for each name instead.
+        sp_config['attribute_sources'] takes precedence over both; see
+        attribute_sources.
+
+        Example:
+        def get_attributes_from_directory(django_request, names):
+            entry = directory.lookup(django_request.user.username)
+            return {name: entry[name] for name in names if name in entry}
+
+        google_apps_config = {
+            'acs_url': 'https://www.google.com/a/example.com/acs',
+            'processor': 'saml2idp.google_apps.Processor',
+            'attributes': ['givenName', 'sn', 'department'],
+            'attributes_function': get_attributes_from_directory
+            # or as a string
+            # 'attributes_function': 'pkg.mod.get_attributes_from_directory'
+        }
+        """
+        sources = self._sp_config.get('attribute_sources')
+        if sources:
+            return attribute_sources.AttributeSources(sources)
+
+        attributes_function = self._import_function_from_str(
+            self._sp_config.get('attributes_function', None))
+        if attributes_function:
+            return attributes_function
+
+        attribute_function = self._get_attribute_function()
+        if attribute_function:
+            return bulk_attribute_function(attribute_function)
+        return None
+
+    def _get_cached_result(self, name, func, *args):
+        """
+        Returns func(*args), through the per-user result cache (see
+        result_cache) if SAML2IDP_RESULT_CACHE is set.
+        """
+        return result_cache.get_or_call(
+            self._django_request, self._remote_name, self._sp_config, name,
+            func, *args)
+
     def _get_django_response_params(self):
         """
         Returns a dictionary of parameters for the response template.
@@ -205,6 +336,59 @@ class Processor(object):
         }
         return tv
 
+    def _get_sign_policy(self):
+        """
+        Returns which elements to sign, from sp_config['sign']:
+        'assertion', 'response', 'both' or 'none'.
+
+        Most SPs validate only one signature, so signing just the element
+        they check saves a private-key operation per login. Without a
+        'sign' key, the assertion is signed and the Response is signed too
+        if SAML2IDP_CONFIG['signing'] is set.
+        """
+        policy = (self._sp_config or {}).get('sign')
+        if policy is None:
+            if self._saml2idp_config.get('signing'):
+                return 'both'
+            return 'assertion'
+
+        if policy not in SIGN_POLICIES:
+            raise ImproperlyConfigured(
+                'Invalid "sign" value %r in SAML2IDP_REMOTES; expected one '
+                'of %s.' % (policy, ', '.join(SIGN_POLICIES)))
+        return policy
+
+    def _get_signing_config(self):
+        """
+        Returns the config used to sign XML for this SP.
+
+        This is SAML2IDP_CONFIG, with 'signing_algorithm' and key material
+        (private_key_file/_str, certificate_file/_str) taken from the SP
+        config when present there.
+
+        Example:
+        azure_config = {
+            'acs_url': 'https://login.microsoftonline.com/login.srf',
+            'processor': 'saml2idp.azure.Processor',
+            'signing_algorithm': 'rsa-sha256',
+        }
+        """
+        sp_config = self._sp_config or {}
+        config = self._saml2idp_config
+
+        for group in SIGNING_OVERRIDES:
+            overrides = [key for key in group if key in sp_config]
+            if not overrides:
+                continue
+            if config is self._saml2idp_config:
+                config = dict(config)
+            for key in group:
+                config.pop(key, None)
+            for key in overrides:
+                config[key] = sp_config[key]
+
+        return config
+
     def _get_subject_function(self):
         """
         Returns the subject_function from SP config.
@@ -233,43 +417,40 @@ class Processor(object):
 
         return self._import_function_from_str(subject_function)
 
+    def _guard(self, kind, func):
+        """
+        Returns func behind the timeout and circuit breaker of this remote,
+        if it has one; see circuit_breaker.
+        """
+        return circuit_breaker.guard(self._remote_name, self._sp_config,
+                                     kind, func)
+
     def _import_function_from_str(self, func):
         """
         Import function from string.
 
         :param func: Can be a string or a function
+        :return: The function, or None if the string cannot be imported.
         """
-        if isinstance(func, str):
-            # function supplied as a string
-            mod_str, _, func_str = func.rpartition('.')
-            try:
-                mod = import_module(mod_str)
-                return getattr(mod, func_str)
-            except:
-                return None
+        return resolver.resolve(func)
 
-        return func
+    def _parse_authn_request(self):
+        """
+        Returns the (memoized) authn_request.AuthnRequest for _request_xml.
+        """
+        return authn_request.parse_memoized(self._django_request,
+                                            self._request_xml)
 
     def _parse_request(self):
         """
         Parses various parameters from _request_xml into _request_params.
         """
-        # Minimal test to verify that it's not binarily encoded still:
-        if isinstance(self._request_xml, bytes):
-            request_xml = self._request_xml.decode('utf-8')
-        else:
-            request_xml = self._request_xml
-        if not request_xml.strip().startswith('<'):
-            raise Exception('RequestXML is not valid XML; '
-                            'it may need to be decoded or decompressed.')
-
-        soup = BeautifulStoneSoup(self._request_xml)
-        request = soup.findAll()[0]
+        self._request = self._parse_authn_request()
         params = {}
-        params['ACS_URL'] = request.get('AssertionConsumerServiceURL')
-        params['REQUEST_ID'] = request.get('id', request.get('ID'))
-        params['DESTINATION'] = request.get('Destination', '')
-        params['PROVIDER_NAME'] = request.get('ProviderName', '')
+        params['ACS_URL'] = self._request.acs_url
+        params['REQUEST_ID'] = self._request.request_id
+        params['DESTINATION'] = self._request.destination
+        params['PROVIDER_NAME'] = self._request.provider_name
         self._request_params = params
 
     def _reset(self, django_request, sp_config=None):
@@ -280,14 +461,18 @@ class Processor(object):
         _validate_request().
         """
         self._django_request = django_request
-        self._saml2idp_remotes = (
-            django_request.session['SAML2IDP']['SAML2IDP_REMOTES'])
-        self._saml2idp_config = (
-            django_request.session['SAML2IDP']['SAML2IDP_CONFIG'])
+        self._saml2idp_config, self._saml2idp_remotes = (
+            saml2idp_metadata.get_session_config(django_request))
 
         self._assertion_params = None
         self._assertion_xml = None
         self._relay_state = None
+        self._remote_name = None
+        self._timing_sink = timing.get_sink()
+        if self._timing_sink or metrics.is_enabled():
+            self._timings = []
+        else:
+            self._timings = None
         self._request = None
         self._request_id = None
         self._request_xml = None
@@ -303,6 +488,31 @@ class Processor(object):
         }
         self._sp_config = sp_config
 
+    def _should_sign_assertion(self):
+        """
+        Returns True if the sign policy includes the Assertion.
+        """
+        return self._get_sign_policy() in ('assertion', 'both')
+
+    def _should_sign_response(self):
+        """
+        Returns True if the sign policy includes the Response.
+        """
+        return self._get_sign_policy() in ('response', 'both')
+
+    def _timed(self, stage, func):
+        """
+        Returns func(), recording its duration as stage if timing is on.
+        """
+        if self._timings is None:
+            return func()
+
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self._timings.append((stage, time.perf_counter() - start))
+
     def _validate_request(self):
         """
         Validates the _saml_request.
@@ -312,10 +522,11 @@ class Processor(object):
         """
         acs_url = self._request_params['ACS_URL']
 
-        for name, sp_config in list(self._saml2idp_remotes.items()):
-            if acs_url == sp_config['acs_url']:
-                self._sp_config = sp_config
-                return
+        index = registry.get_remotes_index(self._saml2idp_remotes)
+        for name, sp_config in index.by_acs_url.get(acs_url, []):
+            self._remote_name = name
+            self._sp_config = sp_config
+            return
 
         msg = "Could not find ACS url '%s' in SAML2IDP_REMOTES setting." % (
             acs_url)
@@ -336,14 +547,20 @@ class Processor(object):
         # Read the request.
         try:
             self._extract_saml_request()
-            self._decode_request()
-            self._parse_request()
+            self._timed('decode_request', self._decode_request)
+            self._timed('parse_request', self._parse_request)
         except Exception as e:
             msg = 'Exception while reading request: %s' % e
             logger.exception(msg)
+            self._flush_timings()
             raise exceptions.CannotHandleAssertion(msg)
 
-        self._validate_request()
+        try:
+            self._timed('validate_request', self._validate_request)
+        except exceptions.CannotHandleAssertion:
+            self._flush_timings()
+            raise
+        # Successful timings are flushed with those of generate_response().
         return True
 
     def generate_response(self):
@@ -352,12 +569,21 @@ class Processor(object):
         response.
         """
         # Build the assertion and response.
-        self._validate_user()
-        self._build_assertion()
-        self._format_assertion()
-        self._build_response()
-        self._format_response()
-        self._encode_response()
+        try:
+            self._timed('validate_user', self._validate_user)
+            self._build_assertion()
+            self._timed('format_assertion', self._format_assertion)
+            self._build_response()
+            self._timed('format_response', self._format_response)
+            self._timed('encode_response', self._encode_response)
+        finally:
+            self._flush_timings()
+
+        signatures = (self._should_sign_assertion() +
+                      self._should_sign_response())
+        if signatures:
+            metrics.inc('saml2idp_signatures_total', signatures,
+                        remote=self._remote_name or '')
 
         # Return proper template params.
         return self._get_django_response_params()
@@ -369,6 +595,17 @@ class Processor(object):
         """
         self._reset(request, sp_config)
         acs_url = self._sp_config['acs_url']
+
+        # The remote name keys per-remote state (result_cache,
+        # circuit_breaker): never share the '' of an unknown remote.
+        index = registry.get_remotes_index(self._saml2idp_remotes)
+        for name, config in index.by_acs_url.get(acs_url, []):
+            if config == sp_config:
+                self._remote_name = name
+                break
+        else:
+            self._remote_name = acs_url
+
         # NOTE: The following request params are made up. Some are blank,
         # because they come over in the AuthnRequest, but we don't have an
         # AuthnRequest in this case:
@@ -0,0 +1,105 @@
+"""
+Small in-process caches used by the IdP hot paths.
+"""
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    Thread-safe, bounded LRU cache with optional per-entry TTL.
+
+    Keeps hit/miss/eviction counters, so callers can check that it is
+    doing its job (see stats()).
+    """
+    def __init__(self, max_entries=128, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        """
+        Drops all entries and resets the counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get(self, key, default=None, count=True):
+        """
+        Returns the value stored for key, or default if it is missing or
+        expired.
+        """
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                if count:
+                    self.misses += 1
+                return default
+
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                if count:
+                    self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return value
+
+    def pop(self, key, default=None):
+        """
+        Removes key from the cache and returns its value.
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+
+        if entry is None:
+            return default
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores value for key; ttl overrides the cache-wide TTL.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Returns a dict with the cache counters and current size.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'max_entries': self.max_entries,
+            }
+
+
+_MISSING = object()
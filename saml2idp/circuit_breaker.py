@@ -0,0 +1,343 @@
+"""
+Timeouts and circuit breakers around the subject and attribute functions.
+
+A directory that is down or slow behind a subject_function or attributes
+function otherwise holds up every login to the remotes using it. Breakers
+are off unless configured in settings, for all remotes:
+
+    SAML2IDP_CIRCUIT_BREAKER = {
+        'timeout': 2,          # seconds per call; None waits for ever
+        'failure_rate': 0.5,   # failed share of the window opening it
+        'min_calls': 10,       # calls in the window before it can open
+        'window': 20,          # number of recent calls looked at
+        'cooldown': 30,        # seconds open before a trial call
+        'fallback': 'omit',    # 'omit', 'cache' or 'deny'
+        'cache_ttl': 86400,    # seconds a value is kept for 'cache'
+    }
+
+or in the SP config of a remote, overriding those options; False turns
+the breaker off for the remote:
+
+    'circuit_breaker': {'timeout': 0.5, 'fallback': 'cache'},
+
+Each remote has a breaker for its subject function and one for its
+attributes function; with SAML2IDP_CONFIG_FUNCTION, one per configuration
+key (see saml2idp_metadata.get_config_key), as tenants may well use the
+same remote names. A call that raises or misses the timeout fails; when
+failure_rate of the last window calls failed, the breaker opens and the
+function is no longer called. After cooldown seconds it is half-open: one
+trial call goes through, and closes the breaker if it succeeds or opens it
+again if not.
+
+A function raising CannotHandleAssertion or UserNotAuthorized, as attribute
+sources do when a required source fails, counts as failed but still fails
+the login. Any other login whose function failed or was not called uses
+the fallback:
+
+    'omit'   attributes are left out;
+    'cache'  the last value the function returned for the user in this
+             process, within cache_ttl; without one, as 'omit';
+    'deny'   UserNotAuthorized: the user gets the invalid_user page.
+
+There is no subject to omit: the NameID may have to be an opaque ID, so a
+login is never given another one (such as the user's email). Without a
+cached subject, a login whose subject function is unavailable is denied
+whatever the fallback.
+
+Calls run on the attribute_sources pool to be timed out, and keep running
+there after their timeout. Attribute sources apply their own timeouts
+instead. Breaker states are exported as the saml2idp_breaker_state gauge
+and call outcomes as saml2idp_breaker_calls_total (see metrics), labelled
+with the tenant too if there is one.
+"""
+import collections
+import logging
+import threading
+import time
+from concurrent import futures
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from . import attribute_sources
+from . import metrics
+from . import saml2idp_metadata
+from .cache import LRUCache
+from .exceptions import CannotHandleAssertion, UserNotAuthorized
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'timeout': None,
+    'failure_rate': 0.5,
+    'min_calls': 10,
+    'window': 20,
+    'cooldown': 30,
+    'fallback': 'omit',
+    'cache_ttl': 86400,
+}
+
+FALLBACKS = ('omit', 'cache', 'deny')
+
+# The guarded functions.
+SUBJECT = 'subject'
+ATTRIBUTES = 'attributes'
+
+# States, as exported by the saml2idp_breaker_state gauge.
+CLOSED = 0
+HALF_OPEN = 1
+OPEN = 2
+
+STATE_NAMES = {CLOSED: 'closed', HALF_OPEN: 'half-open', OPEN: 'open'}
+
+# Users whose last good values are kept for the 'cache' fallback.
+LAST_VALUES_SIZE = 10000
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_last_values = LRUCache(max_entries=LAST_VALUES_SIZE)
+
+
+class Unavailable(Exception):
+    """
+    The guarded function failed, or its breaker is open.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Failure-rate circuit breaker of one function of a remote.
+    """
+    def __init__(self, remote_name, kind, options, tenant=''):
+        self.remote_name = remote_name
+        self.kind = kind
+        self.tenant = tenant
+        self.failure_rate = options['failure_rate']
+        self.min_calls = options['min_calls']
+        self.cooldown = options['cooldown']
+        self.state = CLOSED
+        self._calls = collections.deque(maxlen=options['window'])
+        self._opened = None
+        self._lock = threading.Lock()
+        self._export_state()
+
+    def allow(self):
+        """
+        Returns whether the function may be called now.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if time.monotonic() - self._opened < self.cooldown:
+                return False
+            # One trial call per cooldown, should a trial never report.
+            self._opened = time.monotonic()
+            self._set_state(HALF_OPEN)
+            return True
+
+    def record(self, outcome):
+        """
+        Records the outcome of a call: 'success', 'error', 'timeout' or
+        'rejected' (not called as the breaker is open).
+        """
+        metrics.inc('saml2idp_breaker_calls_total', outcome=outcome,
+                    **self._labels())
+        if outcome == 'rejected':
+            return
+
+        success = outcome == 'success'
+        with self._lock:
+            if self.state == OPEN:
+                # A call made before the breaker opened.
+                return
+            if self.state == HALF_OPEN:
+                self._calls.clear()
+                if success:
+                    self._set_state(CLOSED)
+                else:
+                    self._open()
+                return
+
+            self._calls.append(success)
+            calls = len(self._calls)
+            if calls >= self.min_calls and \
+                    self._calls.count(False) >= self.failure_rate * calls:
+                self._calls.clear()
+                self._open()
+
+    def _export_state(self):
+        metrics.set_gauge('saml2idp_breaker_state', self.state,
+                          **self._labels())
+
+    def _labels(self):
+        labels = {'remote': self.remote_name, 'function': self.kind}
+        if self.tenant:
+            labels['tenant'] = str(self.tenant)
+        return labels
+
+    def _open(self):
+        self._opened = time.monotonic()
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        logger.warning('Circuit breaker of the %s function of %s%s is %s.',
+                       self.kind, self.remote_name,
+                       ' (%s)' % self.tenant if self.tenant else '',
+                       STATE_NAMES[state])
+        self.state = state
+        self._export_state()
+
+
+def clear():
+    """
+    Forgets all breakers and last good values.
+    """
+    with _breakers_lock:
+        _breakers.clear()
+    _last_values.clear()
+
+
+def fallback(django_request, remote_name, sp_config, kind, default=None):
+    """
+    Returns the value to use when the kind function of the remote is
+    unavailable: the last good value with 'cache', else default. Raises
+    UserNotAuthorized with 'deny', and for the subject unless a last good
+    value is used.
+    """
+    mode = get_options(sp_config)['fallback']
+    if mode == 'cache':
+        value = _last_values.get(_value_key(django_request, remote_name,
+                                            kind))
+        if value is not None:
+            return value
+    if mode == 'deny' or kind == SUBJECT:
+        raise UserNotAuthorized(
+            'The %s function of %s is unavailable.' % (kind, remote_name))
+    return default
+
+
+def get_breaker(remote_name, kind, options, tenant=''):
+    """
+    Returns the breaker of the kind function of the remote of tenant.
+    """
+    key = (tenant, remote_name, kind, tuple(sorted(options.items())))
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(key)
+            if breaker is None:
+                breaker = _breakers[key] = CircuitBreaker(
+                    remote_name, kind, options, tenant)
+    return breaker
+
+
+def get_options(sp_config):
+    """
+    Returns the breaker options of a remote, or None if it has none.
+    """
+    remote_options = (sp_config or {}).get('circuit_breaker')
+    if remote_options is False:
+        return None
+    global_options = getattr(settings, 'SAML2IDP_CIRCUIT_BREAKER', None)
+    if not global_options and not remote_options:
+        return None
+
+    options = dict(DEFAULTS)
+    options.update(global_options or {})
+    options.update(remote_options or {})
+    if options['fallback'] not in FALLBACKS:
+        raise ImproperlyConfigured(
+            'Invalid circuit breaker fallback: %r' % options['fallback'])
+    return options
+
+
+def get_tenant(django_request):
+    """
+    Returns the configuration key of django_request if the configuration
+    comes from SAML2IDP_CONFIG_FUNCTION, or '' for the settings one.
+    """
+    if not hasattr(settings, 'SAML2IDP_CONFIG_FUNCTION'):
+        return ''
+    return saml2idp_metadata.get_config_key(django_request)
+
+
+def guard(remote_name, sp_config, kind, func):
+    """
+    Returns func behind the timeout and breaker of the remote; the result
+    raises Unavailable instead of calling func when the breaker is open,
+    and when func fails. Returns func itself if the remote has no breaker.
+    """
+    options = get_options(sp_config)
+    if options is None:
+        return func
+
+    remote_name = remote_name or ''
+    timeout = options['timeout']
+    if isinstance(func, attribute_sources.AttributeSources):
+        timeout = None
+    keep = options['fallback'] == 'cache'
+
+    def guarded(django_request, *args):
+        breaker = get_breaker(remote_name, kind, options,
+                              get_tenant(django_request))
+        if not breaker.allow():
+            breaker.record('rejected')
+            raise Unavailable('Circuit breaker open.')
+
+        try:
+            if timeout is None:
+                value = func(django_request, *args)
+            else:
+                future = attribute_sources.submit(func, django_request, *args)
+                try:
+                    value = future.result(timeout)
+                except futures.TimeoutError:
+                    future.cancel()
+                    raise
+        except (CannotHandleAssertion, UserNotAuthorized):
+            # A decision, such as a failed required attribute source (see
+            # attribute_sources), that no fallback may overrule.
+            breaker.record('error')
+            raise
+        except futures.TimeoutError:
+            breaker.record('timeout')
+            logger.warning('The %s function of %s timed out after %ss.',
+                           kind, remote_name, timeout)
+            raise Unavailable('Timed out.')
+        except Exception as e:
+            breaker.record('error')
+            logger.warning('The %s function of %s failed: %s: %s', kind,
+                           remote_name, e.__class__.__name__, e)
+            raise Unavailable(str(e))
+
+        breaker.record('success')
+        if keep:
+            _keep(django_request, remote_name, kind, value,
+                  options['cache_ttl'])
+        return value
+
+    return guarded
+
+
+def _keep(django_request, remote_name, kind, value, ttl):
+    """
+    Stores value as the last good one for the 'cache' fallback.
+    """
+    key = _value_key(django_request, remote_name, kind)
+    if key is None or value is None:
+        return
+    if kind == ATTRIBUTES:
+        # Attributes may be fetched a few names at a time; keep them all.
+        merged = dict(_last_values.get(key, count=False) or {})
+        merged.update(value)
+        value = merged
+    _last_values.set(key, value, ttl)
+
+
+def _value_key(django_request, remote_name, kind):
+    user = getattr(django_request, 'user', None)
+    if user is None or user.pk is None:
+        return None
+    return (get_tenant(django_request), remote_name or '', kind, user.pk)
@@ -5,6 +5,13 @@ import zlib
 import codecs
 
 
+def decode_base64(b64string):
+    """Decode a base64 encoded string."""
+    if not isinstance(b64string, bytes):
+        b64string = b64string.encode('utf-8')
+    return codecs.decode(b64string, 'base64')
+
+
 def decode_base64_and_inflate(b64string):
     """Decode and uncompress a base64 encoded string."""
     if not isinstance(b64string, bytes):
@@ -13,6 +20,13 @@ def decode_base64_and_inflate(b64string):
     return zlib.decompress(decoded_data, -15)
 
 
+# AuthnRequest decoders by name, as used by Processor.request_codec.
+DECODERS = {
+    'base64': decode_base64,
+    'deflate': decode_base64_and_inflate,
+}
+
+
 def deflate_and_base64_encode(string_val):
     """Base64 encode and compress a string."""
     if not isinstance(string_val, bytes):
@@ -9,4 +9,5 @@ class Processor(base.Processor):
     def _format_assertion(self):
         # NOTE: This uses the SalesForce assertion for the demo.
         self._assertion_xml = xml_render.get_assertion_salesforce_xml(
-            self._assertion_params, signed=True)
+            self._get_signing_config(), self._assertion_params,
+            signed=self._should_sign_assertion())
@@ -9,6 +9,13 @@ class CannotHandleAssertion(Exception):
         return repr(self.msg)
 
 
+class TemporarilyUnavailable(CannotHandleAssertion):
+    """
+    This assertion cannot be handled now, but may be later: a resource
+    such as the signing pool is overloaded or timed out.
+    """
+
+
 class UserNotAuthorized(Exception):
     """
     User not authorized for SAML 2.0 authentication.
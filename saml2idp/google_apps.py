@@ -1,5 +1,4 @@
 from . import base
-from . import codex
 from . import exceptions
 from . import xml_render
 
@@ -8,11 +7,8 @@ class Processor(base.Processor):
     """
     Google Apps specific SAML 2.0 AuthnRequest to Response Handler Processor.
     """
-    def _decode_request(self):
-        """
-        Decodes request using both Base64 and Zipping.
-        """
-        self._request_xml = codex.decode_base64_and_inflate(self._saml_request)
+    # Requests are both Base64-encoded and deflated.
+    request_codec = 'deflate'
 
     def _validate_request(self):
         """
@@ -26,4 +22,5 @@ class Processor(base.Processor):
 
     def _format_assertion(self):
         self._assertion_xml = xml_render.get_assertion_googleapps_xml(
-            self._saml2idp_config, self._assertion_params, signed=True)
+            self._get_signing_config(), self._assertion_params,
+            signed=self._should_sign_assertion())
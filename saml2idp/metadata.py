@@ -4,15 +4,20 @@ Query metadata from settings.
 # Django imports
 from django.core.exceptions import ImproperlyConfigured
 
+# Local imports
+from . import registry
+from . import saml2idp_metadata
+
 
 def get_config_for_acs(request, acs_url):
     """
     Return SP configuration instance that handles acs_url.
     """
-    saml2idp_remotes = request.session['SAML2IDP']['SAML2IDP_REMOTES']
-    for friendlyname, config in list(saml2idp_remotes.items()):
-        if config['acs_url'] == acs_url:
-            return config
+    saml2idp_config, saml2idp_remotes = (
+        saml2idp_metadata.get_session_config(request))
+    index = registry.get_remotes_index(saml2idp_remotes)
+    for friendlyname, config in index.by_acs_url.get(acs_url, []):
+        return config
 
     msg = 'SAML2IDP_REMOTES is not configured to handle the '
     'AssertionConsumerService at "%s"'
@@ -24,7 +29,8 @@ def get_config_for_resource(request, resource_name):
     """
     Return the SP configuration that handles a deep-link resource_name.
     """
-    saml2idp_remotes = request.session['SAML2IDP']['SAML2IDP_REMOTES']
+    saml2idp_config, saml2idp_remotes = (
+        saml2idp_metadata.get_session_config(request))
     for friendlyname, config in list(saml2idp_remotes.items()):
         links = get_links(config)
         for name, pattern in links:
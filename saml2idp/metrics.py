@@ -0,0 +1,353 @@
+"""
+Prometheus metrics for the IdP, aggregated across worker processes.
+
+Disabled unless configured in settings:
+
+    SAML2IDP_METRICS = {
+        'directory': '/var/run/saml2idp-metrics',  # shared by all workers
+        'flush_interval': 1.0,  # seconds between writes of a worker's file
+    }
+
+Every process keeps its counters, gauges and histograms in memory and
+writes them to <directory>/saml2idp-<pid>-<token>.json when they changed:
+at most every flush_interval seconds, from a timer thread if need be, and
+at exit, replacing the file atomically. The random token keeps a later
+process with the same pid from overwriting the file of an exited one.
+
+The metrics view (URL name 'idp_metrics') sums the counters and histograms
+in the files of all workers, including exited ones, so they never go
+backwards; gauges are the maximum over the workers still running. It
+serves them in the Prometheus text exposition format.
+Clear the directory when the server is restarted.
+
+The endpoint is not authenticated; restrict access to it in the front-end
+web server.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Upper bounds, in seconds, of the histogram buckets.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+# name: (type, help)
+METRICS = {
+    'saml2idp_attributes_seconds': (
+        'histogram', 'Time spent resolving assertion attributes.'),
+    'saml2idp_breaker_calls_total': (
+        'counter', 'Calls through circuit breakers, by remote, function '
+        'and outcome.'),
+    'saml2idp_breaker_state': (
+        'gauge', 'Circuit breaker state by remote and function: '
+        '0 closed, 1 half-open, 2 open.'),
+    'saml2idp_failures_total': (
+        'counter', 'Failed logins by remote and exception type.'),
+    'saml2idp_login_seconds': (
+        'histogram', 'End-to-end time of login_process, failed or not.'),
+    'saml2idp_logins_total': (
+        'counter', 'SAML responses sent, by remote.'),
+    'saml2idp_routing_attempts_total': (
+        'counter', 'Processors tried while routing, by remote.'),
+    'saml2idp_routing_seconds': (
+        'histogram', 'Time spent finding the processor for a request.'),
+    'saml2idp_signatures_total': (
+        'counter', 'XML signatures made, by remote.'),
+    'saml2idp_signing_seconds': (
+        'histogram', 'Time spent in private-key signing, by algorithm.'),
+}
+
+# Processor stages (see timing) recorded as histograms.
+STAGE_HISTOGRAMS = {
+    'get_attributes': 'saml2idp_attributes_seconds',
+}
+
+
+class Registry(object):
+    """
+    Counters, gauges and histograms of one process, periodically written to
+    its file in directory.
+    """
+    def __init__(self, directory, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, 'saml2idp-%d-%s.json' % (
+            self.pid, uuid.uuid4().hex))
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._flushed = 0
+        self._changed = False
+        self._timer = None
+
+    def flush(self, force=False):
+        """
+        Writes this process' file if anything changed since the last write,
+        now if flush_interval has passed and else from a timer; with force,
+        writes it now in any case.
+        """
+        if os.getpid() != self.pid:
+            # The registry of the parent of a forked worker.
+            return
+
+        now = time.time()
+        with self._lock:
+            if not force:
+                if not self._changed:
+                    return
+                wait = self._flushed + self.flush_interval - now
+                if wait > 0:
+                    if self._timer is None:
+                        self._timer = threading.Timer(wait, self._flush_late)
+                        self._timer.daemon = True
+                        self._timer.start()
+                    return
+            self._flushed = now
+            self._changed = False
+            data = {
+                'counters': [[name, list(labels), value] for
+                             (name, labels), value in self._counters.items()],
+                'gauges': [[name, list(labels), value] for
+                           (name, labels), value in self._gauges.items()],
+                'histograms': [[name, list(labels), buckets] for
+                               (name, labels), buckets in
+                               self._histograms.items()],
+            }
+
+        tmp_path = '%s.%d.tmp' % (self.path, threading.get_ident())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            logger.warning('Cannot write metrics to %s: %s', self.path, e)
+
+    def close(self):
+        """
+        Writes the changes not written yet, as at exit.
+        """
+        if self._changed:
+            self.flush(force=True)
+
+    def inc(self, name, labels, amount):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._changed = True
+        self.flush()
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self._gauges[(name, labels)] = value
+            self._changed = True
+        self.flush()
+
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        with self._lock:
+            buckets = self._histograms.get(key)
+            if buckets is None:
+                # One count per bucket, +Inf, then the sum.
+                buckets = self._histograms[key] = [0] * (len(BUCKETS) + 1)
+                buckets.append(0.0)
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                index = len(BUCKETS)
+            buckets[index] += 1
+            buckets[-1] += seconds
+            self._changed = True
+        self.flush()
+
+    def _flush_late(self):
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Returns the Registry of this process, or None if metrics are disabled.
+    """
+    global _registry
+
+    options = getattr(settings, 'SAML2IDP_METRICS', None)
+    if not options:
+        return None
+
+    registry = _registry
+    if (registry is not None and registry.pid == os.getpid() and
+            registry.directory == options['directory']):
+        return registry
+
+    with _registry_lock:
+        # New settings, or a forked worker: don't inherit the parent's data.
+        if (_registry is None or _registry.pid != os.getpid() or
+                _registry.directory != options['directory']):
+            _registry = Registry(
+                options['directory'],
+                options.get('flush_interval', DEFAULT_FLUSH_INTERVAL))
+            atexit.register(_registry.close)
+        return _registry
+
+
+def inc(name, amount=1, **labels):
+    """
+    Adds amount to counter name with labels.
+    """
+    registry = get_registry()
+    if registry is not None:
+        registry.inc(name, _labels(labels), amount)
+
+
+def is_enabled():
+    return get_registry() is not None
+
+
+def observe(name, seconds, **labels):
+    """
+    Records a duration in histogram name with labels.
+    """
+    registry = get_registry()
+    if registry is not None:
+        registry.observe(name, _labels(labels), seconds)
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets gauge name with labels to value.
+    """
+    registry = get_registry()
+    if registry is not None:
+        registry.set(name, _labels(labels), value)
+
+
+def observe_stages(remote_name, timings):
+    """
+    Records the processor stage timings that have a histogram.
+    """
+    for stage, seconds in timings:
+        name = STAGE_HISTOGRAMS.get(stage)
+        if name is not None:
+            observe(name, seconds, remote=remote_name or '')
+
+
+def collect():
+    """
+    Returns the metrics of all processes in the text exposition format.
+    """
+    registry = get_registry()
+    registry.flush(force=True)
+
+    counters = {}
+    gauges = {}
+    histograms = {}
+    for path in glob.glob(os.path.join(registry.directory,
+                                       'saml2idp-*.json')):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            logger.warning('Cannot read metrics from %s: %s', path, e)
+            continue
+
+        for name, labels, value in data['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        if _is_running(path):
+            for name, labels, value in data.get('gauges', ()):
+                key = (name, tuple(tuple(label) for label in labels))
+                gauges[key] = max(gauges.get(key, value), value)
+        for name, labels, buckets in data['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = list(buckets)
+            else:
+                histograms[key] = [a + b for a, b in zip(total, buckets)]
+
+    lines = []
+    for name in sorted(METRICS):
+        kind, help_text = METRICS[name]
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        if kind in ('counter', 'gauge'):
+            values = counters if kind == 'counter' else gauges
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append('%s%s %s' % (
+                        name, _format_labels(labels), _format_value(value)))
+        else:
+            for (metric, labels), buckets in sorted(histograms.items()):
+                if metric == name:
+                    lines.extend(_format_histogram(name, labels, buckets))
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('\n', '\\n')
+            .replace('"', '\\"'))
+
+
+def _format_histogram(name, labels, buckets):
+    lines = []
+    count = 0
+    bounds = [repr(bound) for bound in BUCKETS] + ['+Inf']
+    for bound, bucket in zip(bounds, buckets):
+        count += bucket
+        lines.append('%s_bucket%s %d' % (
+            name, _format_labels(labels + (('le', bound),)), count))
+    lines.append('%s_sum%s %s' % (
+        name, _format_labels(labels), _format_value(buckets[-1])))
+    lines.append('%s_count%s %d' % (name, _format_labels(labels), count))
+    return lines
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, _escape(value)) for key, value in labels)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _is_running(path):
+    """
+    Returns whether the process that wrote the file at path still runs.
+    """
+    try:
+        name = os.path.basename(path)[len('saml2idp-'):-len('.json')]
+        pid = int(name.split('-')[0])
+        os.kill(pid, 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
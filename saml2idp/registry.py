@@ -9,19 +9,97 @@ from django.utils.importlib import import_module
 from django.core.exceptions import ImproperlyConfigured
 
 # Local imports
+from . import authn_request
 from . import exceptions
+from . import metrics
+from . import request_token
+from . import saml2idp_metadata
+from .cache import LRUCache
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
 
-def get_processor(dottedpath):
+# Number of distinct SAML2IDP_REMOTES dicts to keep an index for.
+INDEX_CACHE_SIZE = 16
+
+_indexes = LRUCache(max_entries=INDEX_CACHE_SIZE)
+
+# Processor classes by dotted path. Only classes are cached: processors keep
+# per-request state, so get_processor() still returns a new instance.
+_processor_classes = {}
+
+
+class RemotesIndex(object):
     """
-    Get an instance of the processor with dottedpath.
+    Lookup tables over a SAML2IDP_REMOTES dict.
 
-    For example:
-    >>> x = get_processor('saml2idp.demo.Processor')
+    by_acs_url and by_issuer map an AssertionConsumerService URL or a
+    request Issuer to the list of (name, sp_config) pairs that declare it,
+    in SAML2IDP_REMOTES order. The issuer of a remote is its
+    'request_issuer' key or, failing that, the request_issuer attribute of
+    its processor class.
+    """
+    def __init__(self, remotes):
+        self.remotes = remotes
+        self.size = len(remotes)
+        self.by_acs_url = {}
+        self.by_issuer = {}
+
+        for name, sp_config in remotes.items():
+            entry = (name, sp_config)
+            self.by_acs_url.setdefault(sp_config['acs_url'], []).append(entry)
+
+            issuer = sp_config.get('request_issuer')
+            if issuer is None:
+                processor_class = get_processor_class(sp_config['processor'])
+                issuer = getattr(processor_class, 'request_issuer', None)
+            if issuer is not None:
+                self.by_issuer.setdefault(issuer, []).append(entry)
+
+    def find(self, request):
+        """
+        Returns the (name, sp_config) candidates for an AuthnRequest, or
+        None if the index cannot tell and every remote must be tried. An
+        unknown ACS URL is one of those: processors may accept URLs other
+        than their acs_url in _validate_request.
+        """
+        if request is None:
+            return None
+        if request.acs_url:
+            return self.by_acs_url.get(request.acs_url)
+        return self.by_issuer.get(request.issuer) or None
+
+
+def get_remotes_index(remotes):
+    """
+    Returns the RemotesIndex for a SAML2IDP_REMOTES dict.
+
+    Indexes are cached by the identity of the dict (and its size), so a
+    settings dict or a config function returning the same dict is only
+    indexed once. Build a new dict instead of mutating one in place.
+
+    Processors keep the sp_config dicts of the index, functions and all,
+    so an index is only ever used for the very dict it was built from:
+    equal-looking remotes of two tenants may close over different data.
+    """
+    key = (id(remotes), len(remotes))
+    index = _indexes.get(key)
+    if index is None or index.remotes is not remotes:
+        index = RemotesIndex(remotes)
+        _indexes.set(key, index)
+    return index
+
+
+def get_processor_class(dottedpath):
+    """
+    Returns the processor class with dottedpath.
     """
+    try:
+        return _processor_classes[dottedpath]
+    except KeyError:
+        pass
+
     try:
         dot = dottedpath.rindex('.')
     except ValueError:
@@ -42,6 +120,18 @@ def get_processor(dottedpath):
             'processors module "%s" does not define a "%s" class'
             % (sp_module, sp_classname))
 
+    _processor_classes[dottedpath] = sp_class
+    return sp_class
+
+
+def get_processor(dottedpath):
+    """
+    Get an instance of the processor with dottedpath.
+
+    For example:
+    >>> x = get_processor('saml2idp.demo.Processor')
+    """
+    sp_class = get_processor_class(dottedpath)
     instance = sp_class()
     return instance
 
@@ -49,11 +139,33 @@ def get_processor(dottedpath):
 def find_processor(request):
     """
     Returns the Processor instance that is willing to handle this request.
+
+    The AuthnRequest is decoded and parsed once up front, and only the
+    remotes matching its ACS URL (or Issuer) are tried. Every remote is
+    tried only if the request cannot be read that way.
     """
-    saml2idp_remotes = request.session['SAML2IDP']['SAML2IDP_REMOTES']
+    saml2idp_config, saml2idp_remotes = (
+        saml2idp_metadata.get_session_config(request))
+
+    try:
+        saml_request, relay_state = request_token.get_pending_request(request)
+        saml_request = authn_request.peek(request, saml_request)
+    except KeyError as e:
+        raise exceptions.CannotHandleAssertion(
+            'No pending SAML request: missing %s.' % e)
+    candidates = get_remotes_index(saml2idp_remotes).find(saml_request)
+    if candidates is None:
+        candidates = list(saml2idp_remotes.items())
+
+    tried = set()
+    for name, sp_config in candidates:
+        if sp_config['processor'] in tried:
+            # Same processor, same request, same outcome.
+            continue
+        tried.add(sp_config['processor'])
 
-    for name, sp_config in list(saml2idp_remotes.items()):
         proc = get_processor(sp_config['processor'])
+        metrics.inc('saml2idp_routing_attempts_total', remote=name)
 
         try:
             if proc.can_handle(request):
@@ -0,0 +1,92 @@
+"""
+Signed tokens carrying a pending AuthnRequest from login_begin to
+login_process.
+
+By default login_begin stores SAMLRequest and RelayState in the session,
+which creates a session row for every anonymous SP-initiated hit. With
+
+    SAML2IDP_REQUEST_TOKEN = {
+        'max_age': 600,  # seconds the user has to log in
+    }
+
+they travel instead in a 'token' query parameter of the login_process URL
+(and so through the 'next' parameter of the login page): the deflated
+request, signed with SECRET_KEY and timestamped. Nothing is written to the
+session before the user has authenticated.
+"""
+import json
+
+from django.conf import settings
+from django.core import signing
+
+from . import codex
+from .exceptions import CannotHandleAssertion
+
+DEFAULT_MAX_AGE = 600
+
+# Query parameter of login_process holding the token.
+TOKEN_PARAMETER = 'token'
+
+_SALT = 'saml2idp.request_token'
+
+
+def dumps(saml_request, relay_state):
+    """
+    Returns a signed token for saml_request and relay_state.
+    """
+    data = json.dumps([saml_request, relay_state])
+    payload = codex.deflate_and_base64_encode(data).decode('utf-8')
+    return signing.TimestampSigner(salt=_SALT).sign(
+        payload.replace('\n', ''))
+
+
+def get_pending_request(django_request):
+    """
+    Returns the pending (SAMLRequest, RelayState), as set by
+    set_pending_request() or load(), or else from the session.
+
+    Raises CannotHandleAssertion if there is no pending request.
+    """
+    try:
+        return django_request._saml2idp_pending
+    except AttributeError:
+        pass
+    try:
+        return (django_request.session['SAMLRequest'],
+                django_request.session['RelayState'])
+    except KeyError:
+        raise CannotHandleAssertion('No pending SAML request.')
+
+
+def is_enabled():
+    return bool(getattr(settings, 'SAML2IDP_REQUEST_TOKEN', None))
+
+
+def load(django_request, token):
+    """
+    Verifies token and makes its request the pending one of django_request.
+
+    Raises django.core.signing.BadSignature (or its SignatureExpired
+    sub-class) if the token was tampered with or is too old.
+    """
+    options = getattr(settings, 'SAML2IDP_REQUEST_TOKEN', None) or {}
+    payload = signing.TimestampSigner(salt=_SALT).unsign(
+        token, max_age=options.get('max_age', DEFAULT_MAX_AGE))
+
+    try:
+        data = codex.decode_base64_and_inflate(payload)
+        saml_request, relay_state = json.loads(data.decode('utf-8'))
+    except Exception:
+        # Properly signed but unreadable: treat it like a bad signature.
+        raise signing.BadSignature('Request token is malformed.')
+
+    set_pending_request(django_request, saml_request, relay_state)
+    return saml_request, relay_state
+
+
+def set_pending_request(django_request, saml_request, relay_state):
+    """
+    Makes saml_request and relay_state the pending request of
+    django_request, without storing them in the session.
+    """
+    django_request._saml2idp_pending = (saml_request, relay_state)
@@ -0,0 +1,90 @@
+"""
+Resolution of the functions configured as dotted paths.
+
+SAML2IDP_CONFIG_FUNCTION, the SAML2IDP_CONFIG_CACHE key_function and the
+subject_function, attributes_function, attribute_function and
+attribute_sources functions of remotes may be given as callables or as
+'package.module.function' strings. resolve() imports the latter once per
+process: successes are cached until evicted, failures are logged and
+cached for FAILURE_TTL seconds, so a broken path costs neither an import
+attempt nor a log line on every request.
+
+warm_up() resolves every path found in the settings; the app config calls
+it on start-up, so that the first logins don't pay for the imports and
+broken paths are reported straight away.
+"""
+import logging
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+RESOLVER_CACHE_SIZE = 256
+
+# Seconds before an import that failed is tried again.
+FAILURE_TTL = 60
+
+# Keys of a remote's config that may hold dotted paths.
+REMOTE_FUNCTIONS = ('attribute_function', 'attributes_function',
+                    'subject_function')
+
+_functions = LRUCache(max_entries=RESOLVER_CACHE_SIZE)
+_failures = LRUCache(max_entries=RESOLVER_CACHE_SIZE, ttl=FAILURE_TTL)
+
+
+def clear():
+    """
+    Forgets all resolved and failed paths.
+    """
+    _functions.clear()
+    _failures.clear()
+
+
+def resolve(func):
+    """
+    Returns the function func refers to.
+
+    :param func: a callable or None, returned as is, or a dotted path.
+    :return: the callable, or None if the path cannot be imported.
+    """
+    if not isinstance(func, str):
+        return func
+
+    function = _functions.get(func)
+    if function is not None or func in _failures:
+        return function
+
+    mod_str, _, func_str = func.rpartition('.')
+    try:
+        function = getattr(import_module(mod_str), func_str)
+    except Exception as e:
+        logger.warning('Cannot import function "%s": %s: %s',
+                       func, e.__class__.__name__, e)
+        _failures.set(func, True)
+        return None
+
+    _functions.set(func, function)
+    return function
+
+
+def warm_up(remotes=None):
+    """
+    Resolves the dotted paths in the settings, and in remotes (which
+    defaults to SAML2IDP_REMOTES). Returns the paths that failed.
+    """
+    if remotes is None:
+        remotes = getattr(settings, 'SAML2IDP_REMOTES', None) or {}
+
+    paths = [getattr(settings, 'SAML2IDP_CONFIG_FUNCTION', None),
+             (getattr(settings, 'SAML2IDP_CONFIG_CACHE', None) or {}).get(
+                 'key_function')]
+    for sp_config in remotes.values():
+        paths.extend(sp_config.get(key) for key in REMOTE_FUNCTIONS)
+        paths.extend(source.get('function') for source in
+                     sp_config.get('attribute_sources') or ())
+
+    return sorted(set(path for path in paths
+                      if isinstance(path, str) and resolve(path) is None))
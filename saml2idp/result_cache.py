@@ -0,0 +1,258 @@
+"""
+Per-user cache of subject_function and attribute(s)_function results.
+
+These functions often query a directory (LDAP, say) on every login, and a
+user signing in to several SPs in a row triggers the same lookups again
+and again. Caching is off unless configured in settings:
+
+    SAML2IDP_RESULT_CACHE = {
+        'cache': 'default',    # Django cache alias; omit for in-process
+        'ttl': 300,            # seconds
+        'max_entries': 10000,  # size of the in-process cache
+    }
+
+With 'cache', results are stored in that Django cache and so shared by
+all nodes using it; without it, in a bounded in-process LRUCache. A remote
+may override the TTL with 'result_cache_ttl' in its SP config, where 0
+disables caching for that remote.
+
+Results are keyed by user, remote and name (the subject, or the attribute)
+and a per-user generation; attributes are cached one by one, so a bulk
+attributes_function is only asked for those missing from the cache.
+Logging out (the user_logged_out signal) or invalidate() gives the user a
+new generation, so their cached results are never seen again, on any node
+sharing the cache.
+"""
+import collections
+import hashlib
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 10000
+
+# Names of the cached results: the subject, and each attribute.
+SUBJECT = 'subject'
+ATTRIBUTE = 'attribute:%s'
+
+KEY_PREFIX = 'saml2idp.result'
+
+_local_cache = None
+_local_cache_options = None
+_lock = threading.Lock()
+
+
+class _LocalCache(object):
+    """
+    The part of the Django cache API used here, on top of an LRUCache.
+    """
+    def __init__(self, max_entries):
+        self._cache = LRUCache(max_entries=max_entries)
+
+    def add(self, key, value, timeout=None):
+        with _lock:
+            if key in self._cache:
+                return False
+            self._cache.set(key, value, ttl=timeout)
+            return True
+
+    def get(self, key, default=None):
+        return self._cache.get(key, default)
+
+    def get_many(self, keys):
+        values = {}
+        for key in keys:
+            value = self._cache.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set(self, key, value, timeout=None):
+        self._cache.set(key, value, ttl=timeout)
+
+    def set_many(self, data, timeout=None):
+        for key, value in data.items():
+            self._cache.set(key, value, ttl=timeout)
+
+
+def clear():
+    """
+    Drops the in-process cache.
+    """
+    global _local_cache
+    with _lock:
+        _local_cache = None
+
+
+def get_cache():
+    """
+    Returns the cache to use, or None if the result cache is disabled.
+    """
+    global _local_cache, _local_cache_options
+
+    options = getattr(settings, 'SAML2IDP_RESULT_CACHE', None)
+    if not options:
+        return None
+
+    alias = options.get('cache')
+    if alias is not None:
+        return caches[alias]
+
+    with _lock:
+        if _local_cache is None or options != _local_cache_options:
+            _local_cache = _LocalCache(
+                options.get('max_entries', DEFAULT_MAX_ENTRIES))
+            _local_cache_options = options
+        return _local_cache
+
+
+def get_or_call(django_request, remote_name, sp_config, name, func, *args):
+    """
+    Returns func(*args), the name result (SUBJECT or ATTRIBUTE % attribute)
+    for the user of django_request and remote_name, from the cache if
+    possible.
+    """
+    cache, ttl = _get_cache_and_ttl(django_request, sp_config)
+    if cache is None:
+        return func(*args)
+
+    try:
+        key = _result_key(cache, django_request, remote_name, name)
+        value = cache.get(key)
+    except Exception as e:
+        logger.warning('Cannot read the result cache: %s', e)
+        return func(*args)
+
+    if value is not None:
+        return value[0]
+
+    result = func(*args)
+    try:
+        # Wrapped, so that None results are cached too.
+        cache.set(key, (result,), ttl)
+    except Exception as e:
+        logger.warning('Cannot write the result cache: %s', e)
+    return result
+
+
+def get_or_call_many(django_request, remote_name, sp_config, names, func):
+    """
+    Returns the {name: value} attributes of the user of django_request for
+    remote_name: those in the cache, plus what func(django_request,
+    missing_names) returns for the others.
+    """
+    cache, ttl = _get_cache_and_ttl(django_request, sp_config)
+    if cache is None:
+        return func(django_request, names)
+
+    try:
+        keys = collections.OrderedDict(
+            (name, _result_key(cache, django_request, remote_name,
+                               ATTRIBUTE % name))
+            for name in names)
+        cached = cache.get_many(list(keys.values()))
+    except Exception as e:
+        logger.warning('Cannot read the result cache: %s', e)
+        return func(django_request, names)
+
+    attributes = {}
+    missing = []
+    for name, key in keys.items():
+        if key in cached:
+            attributes[name] = cached[key][0]
+        else:
+            missing.append(name)
+    if not missing:
+        return attributes
+
+    found = func(django_request, missing)
+    attributes.update(found)
+    try:
+        cache.set_many({keys[name]: (found[name],) for name in missing
+                        if name in found}, ttl)
+    except Exception as e:
+        logger.warning('Cannot write the result cache: %s', e)
+    return attributes
+
+
+def invalidate(user):
+    """
+    Drops the cached results of user.
+    """
+    cache = get_cache()
+    if cache is None or user is None or user.pk is None:
+        return
+    try:
+        cache.set(_generation_key(user), uuid.uuid4().hex, None)
+    except Exception as e:
+        logger.warning('Cannot invalidate the result cache: %s', e)
+
+
+def user_logged_out(sender, request, user, **kwargs):
+    """
+    Receiver for django.contrib.auth.signals.user_logged_out.
+    """
+    invalidate(user)
+    if request is not None:
+        request.__dict__.pop('_saml2idp_result_generation', None)
+
+
+def _get_cache_and_ttl(django_request, sp_config):
+    """
+    Returns (cache, ttl) for django_request and sp_config, or (None, None)
+    if its results are not to be cached.
+    """
+    cache = get_cache()
+    user = getattr(django_request, 'user', None)
+    if cache is None or user is None or user.pk is None:
+        return None, None
+
+    options = settings.SAML2IDP_RESULT_CACHE
+    ttl = (sp_config or {}).get('result_cache_ttl',
+                                options.get('ttl', DEFAULT_TTL))
+    if not ttl:
+        return None, None
+    return cache, ttl
+
+
+def _generation_key(user):
+    return '%s.generation.%s' % (KEY_PREFIX, user.pk)
+
+
+def _get_generation(cache, django_request, user):
+    """
+    Returns the current generation of user, memoized on django_request.
+    """
+    try:
+        return django_request._saml2idp_result_generation
+    except AttributeError:
+        pass
+
+    key = _generation_key(user)
+    generation = cache.get(key)
+    if generation is None:
+        # A random generation, rather than a counter, so that an evicted
+        # generation can never bring stale results back.
+        generation = uuid.uuid4().hex
+        cache.add(key, generation, None)
+        generation = cache.get(key) or generation
+
+    django_request._saml2idp_result_generation = generation
+    return generation
+
+
+def _result_key(cache, django_request, remote_name, name):
+    user = django_request.user
+    generation = _get_generation(cache, django_request, user)
+    digest = hashlib.sha1('\n'.join(
+        (str(user.pk), generation, remote_name or '', name)
+    ).encode('utf-8')).hexdigest()
+    return '%s.%s' % (KEY_PREFIX, digest)
@@ -2,10 +2,56 @@
 Django Settings that more closely resemble SAML Metadata.
 
 Detailed discussion is in doc/SETTINGS_AND_METADATA.txt.
+
+Results of SAML2IDP_CONFIG_FUNCTION can be cached in-process by adding:
+
+    SAML2IDP_CONFIG_CACHE = {
+        'key_function': 'myapp.saml.get_tenant',  # default: request host
+        'ttl': 300,                                # seconds
+        'max_entries': 1000,
+    }
+
+The key function maps a request to the cache key (a tenant, say); the
+config function is called at most once per key and TTL, also when several
+requests miss at the same time. invalidate_config_cache() drops entries
+early, e.g. after a tenant's SAML settings were edited.
+
+The session only holds a reference to the configuration used at login,
+{'key': ..., 'version': ...}, where version is a hash of its contents.
+get_session_config() resolves it through an in-process snapshot cache,
+reloading the configuration if this process has not seen it yet.
 """
+import hashlib
+import json
+import logging
+import threading
+
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.utils.importlib import import_module
+
+from . import resolver
+from .cache import LRUCache
+
+DEFAULT_CONFIG_CACHE_TTL = 300
+DEFAULT_CONFIG_CACHE_SIZE = 1000
+
+# Number of (key, version) configurations kept for get_session_config().
+SNAPSHOT_CACHE_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+_config_cache = None
+_config_cache_options = None
+
+# Keys being loaded, each with an Event set once the load is over.
+_loading = {}
+_lock = threading.Lock()
+
+# Configurations by (key, version).
+_snapshots = LRUCache(max_entries=SNAPSHOT_CACHE_SIZE)
+
+# Versions of recently seen configurations, by identity of the dicts.
+_versions = LRUCache(max_entries=SNAPSHOT_CACHE_SIZE)
 
 
 def get_metadata_config(request):
@@ -28,8 +74,12 @@ def get_metadata_config(request):
             raise ImproperlyConfigured(
                 'Cannot import SAML2IDP_CONFIG_FUNCTION')
 
-        # Return SAML2IDP_CONFIG & SAML2IDP_REMOTES
-        return config_func(request)
+        cache = _get_config_cache()
+        if cache is None:
+            # Return SAML2IDP_CONFIG & SAML2IDP_REMOTES
+            return config_func(request)
+
+        return _get_cached_config(cache, config_func, request)
     elif (hasattr(settings, 'SAML2IDP_CONFIG') and
             hasattr(settings, 'SAML2IDP_REMOTES')):
         # We have static configuration!
@@ -38,19 +88,162 @@ def get_metadata_config(request):
     raise ImproperlyConfigured('Cannot load SAML2IDP configuration!')
 
 
+def get_config_key(request):
+    """
+    Returns the key identifying the configuration of request: the
+    SAML2IDP_CONFIG_CACHE key_function result, or the request host.
+    """
+    options = getattr(settings, 'SAML2IDP_CONFIG_CACHE', None) or {}
+    key_function = options.get('key_function')
+    if key_function is None:
+        return request.get_host()
+
+    key_function = import_function_from_str(key_function)
+    if not key_function:
+        raise ImproperlyConfigured(
+            'Cannot import SAML2IDP_CONFIG_CACHE key_function')
+    return key_function(request)
+
+
+def get_config_version(config, remotes):
+    """
+    Returns a stable hash of config and remotes.
+
+    Callables (subject_function and the like) are hashed by their dotted
+    name, so equal settings give equal versions in every process.
+    """
+    key = (id(config), id(remotes))
+    cached = _versions.get(key)
+    if cached is not None and cached[0] is config and cached[1] is remotes:
+        return cached[2]
+
+    data = json.dumps([config, remotes], sort_keys=True,
+                      default=_json_default)
+    version = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    # Keep references to the dicts so their ids stay valid.
+    _versions.set(key, (config, remotes, version))
+    return version
+
+
+def get_session_config(request):
+    """
+    Returns (SAML2IDP_CONFIG, SAML2IDP_REMOTES) for the configuration
+    referenced by the session, as stored by set_session_config().
+
+    Raises KeyError if the session does not reference one.
+    """
+    try:
+        return request._saml2idp_config
+    except AttributeError:
+        pass
+
+    reference = request.session['SAML2IDP']
+    if 'SAML2IDP_CONFIG' in reference:
+        # Sessions written before the configuration was stored by reference.
+        config = (reference['SAML2IDP_CONFIG'],
+                  reference['SAML2IDP_REMOTES'])
+    else:
+        snapshot = (reference['key'], reference['version'])
+        config = _snapshots.get(snapshot)
+        if config is None:
+            config = get_metadata_config(request)
+            version = get_config_version(*config)
+            if version != reference['version']:
+                logger.debug('SAML2IDP configuration %s changed since login.'
+                             % reference['key'])
+            _snapshots.set((reference['key'], version), config)
+
+    request._saml2idp_config = config
+    return config
+
+
+def set_session_config(request, config, remotes):
+    """
+    Stores a reference to config and remotes in the session.
+    """
+    key = get_config_key(request)
+    version = get_config_version(config, remotes)
+
+    _snapshots.set((key, version), (config, remotes))
+    request._saml2idp_config = (config, remotes)
+    request.session['SAML2IDP'] = {'key': key, 'version': version}
+
+
 def import_function_from_str(func):
     """
     Import function from string.
 
     :param func: Can be a string or a function
+    :return: The function, or None if the string cannot be imported.
+    """
+    return resolver.resolve(func)
+
+
+def invalidate_config_cache(key=None):
+    """
+    Drops the cached configuration for key, or all of it if key is None.
     """
-    if isinstance(func, str):
-        # function supplied as a string
-        mod_str, _, func_str = func.rpartition('.')
-        try:
-            mod = import_module(mod_str)
-            return getattr(mod, func_str)
-        except:
-            return None
+    cache = _config_cache
+    if cache is None:
+        return
+    if key is None:
+        cache.clear()
+    else:
+        cache.pop(key)
+
+
+def _get_cached_config(cache, config_func, request):
+    key = get_config_key(request)
+
+    while True:
+        config = cache.get(key)
+        if config is not None:
+            return config
+
+        with _lock:
+            loaded = _loading.get(key)
+            if loaded is None:
+                loaded = _loading[key] = threading.Event()
+                break
+
+        # Somebody else is loading this key; use their result, or take
+        # over if they failed.
+        loaded.wait()
+
+    try:
+        config = cache.get(key, count=False)
+        if config is None:
+            config = config_func(request)
+            cache.set(key, config)
+        return config
+    finally:
+        with _lock:
+            del _loading[key]
+        loaded.set()
+
+
+def _get_config_cache():
+    """
+    Returns the LRUCache for SAML2IDP_CONFIG_CACHE, or None if disabled.
+    """
+    global _config_cache, _config_cache_options
+
+    options = getattr(settings, 'SAML2IDP_CONFIG_CACHE', None)
+    if not options:
+        return None
+
+    with _lock:
+        if _config_cache is None or options != _config_cache_options:
+            _config_cache = LRUCache(
+                max_entries=options.get('max_entries',
+                                        DEFAULT_CONFIG_CACHE_SIZE),
+                ttl=options.get('ttl', DEFAULT_CONFIG_CACHE_TTL))
+            _config_cache_options = options
+        return _config_cache
+
 
-    return func
+def _json_default(value):
+    if callable(value):
+        return '%s.%s' % (getattr(value, '__module__', ''),
+                          getattr(value, '__qualname__', repr(value)))
+    return repr(value)
@@ -0,0 +1,183 @@
+"""
+Signature backends for XML signing.
+
+The backend is selected by the 'signing_algorithm' key of SAML2IDP_CONFIG
+(or of an SP config in SAML2IDP_REMOTES, which takes precedence):
+
+    SAML2IDP_CONFIG = {
+        ...
+        'signing_algorithm': 'rsa-sha256',
+    }
+
+Built-in algorithms are listed in SIGNERS; a dotted path to a Signer
+sub-class can be used for anything else.
+"""
+import hashlib
+
+import OpenSSL
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding
+from cryptography.hazmat.primitives.asymmetric.utils import (
+    decode_dss_signature)
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+
+DEFAULT_SIGNING_ALGORITHM = 'rsa-sha1'
+
+XMLDSIG_NS = 'http://www.w3.org/2000/09/xmldsig#'
+XMLDSIG_MORE_NS = 'http://www.w3.org/2001/04/xmldsig-more#'
+XMLENC_NS = 'http://www.w3.org/2001/04/xmlenc#'
+
+
+class Signer(object):
+    """
+    Base signature backend.
+
+    Sub-classes provide the algorithm URIs used in SignedInfo, the hashlib
+    name of the digest, and know how to parse and use a PEM private key.
+    Signers are stateless: one instance is shared by all requests.
+    """
+    signature_method = None
+    digest_method = None
+    digest_name = None
+
+    # Distinguishes parsed keys of different backends in the key cache.
+    key_kind = 'private key'
+
+    def digest(self, data):
+        """
+        Returns the digest of data (bytes) used for the DigestValue.
+        """
+        return hashlib.new(self.digest_name, data).digest()
+
+    def parse_private_key(self, private_key_str):
+        """
+        Returns a key object suitable for sign() from a PEM string.
+        """
+        raise NotImplementedError()
+
+    def sign(self, private_key, data):
+        """
+        Returns the raw SignatureValue bytes for data (bytes).
+        """
+        raise NotImplementedError()
+
+
+class PyOpenSSLSigner(Signer):
+    """
+    RSA-SHA1 using pyOpenSSL. This is the historical default.
+    """
+    signature_method = XMLDSIG_NS + 'rsa-sha1'
+    digest_method = XMLDSIG_NS + 'sha1'
+    digest_name = 'sha1'
+
+    def parse_private_key(self, private_key_str):
+        return OpenSSL.crypto.load_privatekey(
+            OpenSSL.crypto.FILETYPE_PEM, private_key_str)
+
+    def sign(self, private_key, data):
+        return OpenSSL.crypto.sign(private_key, data, self.digest_name)
+
+
+class CryptographySigner(Signer):
+    """
+    Base for backends using the cryptography package directly.
+    """
+    key_kind = 'cryptography private key'
+    hash_class = None
+
+    def parse_private_key(self, private_key_str):
+        return serialization.load_pem_private_key(
+            private_key_str.encode('utf-8'), password=None,
+            backend=default_backend())
+
+
+class RSASHA256Signer(CryptographySigner):
+    """
+    RSA PKCS#1 v1.5 with SHA-256.
+    """
+    signature_method = XMLDSIG_MORE_NS + 'rsa-sha256'
+    digest_method = XMLENC_NS + 'sha256'
+    digest_name = 'sha256'
+    hash_class = hashes.SHA256
+
+    def sign(self, private_key, data):
+        return private_key.sign(data, padding.PKCS1v15(), self.hash_class())
+
+
+class RSASHA512Signer(RSASHA256Signer):
+    """
+    RSA PKCS#1 v1.5 with SHA-512.
+    """
+    signature_method = XMLDSIG_MORE_NS + 'rsa-sha512'
+    digest_method = XMLENC_NS + 'sha512'
+    digest_name = 'sha512'
+    hash_class = hashes.SHA512
+
+
+class ECDSASHA256Signer(CryptographySigner):
+    """
+    ECDSA with SHA-256, intended for P-256 keys.
+
+    XML Signature wants the raw r || s concatenation rather than the DER
+    structure returned by cryptography.
+    """
+    signature_method = XMLDSIG_MORE_NS + 'ecdsa-sha256'
+    digest_method = XMLENC_NS + 'sha256'
+    digest_name = 'sha256'
+    hash_class = hashes.SHA256
+
+    def sign(self, private_key, data):
+        der = private_key.sign(data, ec.ECDSA(self.hash_class()))
+        r, s = decode_dss_signature(der)
+        size = (private_key.curve.key_size + 7) // 8
+        return _int_to_bytes(r, size) + _int_to_bytes(s, size)
+
+
+def _int_to_bytes(value, size):
+    return value.to_bytes(size, 'big')
+
+
+SIGNERS = {
+    'rsa-sha1': PyOpenSSLSigner,
+    'rsa-sha256': RSASHA256Signer,
+    'rsa-sha512': RSASHA512Signer,
+    'ecdsa-sha256': ECDSASHA256Signer,
+}
+
+_signers = {}
+
+
+def get_signer(config):
+    """
+    Returns the (shared) Signer instance for config['signing_algorithm'].
+    """
+    name = config.get('signing_algorithm') or DEFAULT_SIGNING_ALGORITHM
+
+    try:
+        return _signers[name]
+    except KeyError:
+        pass
+
+    signer_class = SIGNERS.get(name)
+    if signer_class is None:
+        signer_class = _import_signer_class(name)
+
+    signer = signer_class()
+    _signers[name] = signer
+    return signer
+
+
+def _import_signer_class(dottedpath):
+    mod_str, _, class_str = dottedpath.rpartition('.')
+    if not mod_str:
+        raise ImproperlyConfigured(
+            'Unknown signing_algorithm "%s"; use one of %s or a dotted path '
+            'to a Signer class.' % (dottedpath, ', '.join(sorted(SIGNERS))))
+
+    try:
+        return getattr(import_module(mod_str), class_str)
+    except (ImportError, AttributeError) as e:
+        raise ImproperlyConfigured(
+            'Error importing signer "%s": %s' % (dottedpath, e))
@@ -0,0 +1,150 @@
+"""
+Optional thread pool for the private-key operations of XML signing.
+
+OpenSSL releases the GIL while signing, so a few dedicated threads can
+take the RSA work off the request threads and bound how many signatures
+run at once. The pool is disabled unless configured in settings:
+
+    SAML2IDP_SIGNING_POOL = {
+        'workers': 4,       # signing threads
+        'max_pending': 32,  # queued + running signatures before failing fast
+        'timeout': 10,      # seconds a request waits for its signature
+    }
+
+When max_pending signatures are outstanding, new ones fail immediately
+with TemporarilyUnavailable instead of piling up behind the queue; so do
+signatures that time out. The login views answer those with a 503.
+"""
+import threading
+import time
+from concurrent import futures
+
+from django.conf import settings
+
+from .exceptions import TemporarilyUnavailable
+
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 10
+
+
+class SigningPool(object):
+    """
+    Bounded thread pool running Signer.sign() calls.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=None,
+                 timeout=DEFAULT_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending or workers * 8
+        self.timeout = timeout
+        self._executor = futures.ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+            'sign_time_total': 0.0,
+            'sign_time_max': 0.0,
+        }
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, signer, private_key, data, submitted):
+        started = time.time()
+        try:
+            return signer.sign(private_key, data)
+        finally:
+            finished = time.time()
+            queue_wait = started - submitted
+            sign_time = finished - started
+            with self._lock:
+                stats = self._stats
+                stats['completed'] += 1
+                stats['queue_wait_total'] += queue_wait
+                stats['queue_wait_max'] = max(stats['queue_wait_max'],
+                                              queue_wait)
+                stats['sign_time_total'] += sign_time
+                stats['sign_time_max'] = max(stats['sign_time_max'],
+                                             sign_time)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def sign(self, signer, private_key, data):
+        """
+        Returns signer.sign(private_key, data), computed on the pool.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                raise TemporarilyUnavailable(
+                    'Signing pool is overloaded (%d signatures pending).'
+                    % self._pending)
+            self._pending += 1
+            self._stats['submitted'] += 1
+
+        future = self._executor.submit(
+            self._run, signer, private_key, data, time.time())
+        future.add_done_callback(self._done)
+
+        try:
+            return future.result(self.timeout)
+        except futures.TimeoutError:
+            future.cancel()
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise TemporarilyUnavailable(
+                'Timed out after %ss waiting for a signature.' % self.timeout)
+
+    def stats(self):
+        """
+        Returns a dict of counters, including the pending count and the
+        total/max seconds spent queued and signing.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = self._pending
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the process-wide SigningPool, or None if it is not configured.
+    """
+    global _pool
+
+    if _pool is not None:
+        return _pool
+
+    options = getattr(settings, 'SAML2IDP_SIGNING_POOL', None)
+    if not options:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = SigningPool(
+                workers=options.get('workers', DEFAULT_WORKERS),
+                max_pending=options.get('max_pending'),
+                timeout=options.get('timeout', DEFAULT_TIMEOUT))
+    return _pool
+
+
+def reset_pool():
+    """
+    Shuts down the current pool; the next get_pool() re-reads settings.
+    """
+    global _pool
+
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
@@ -0,0 +1,86 @@
+"""
+Precompiled string.Template replacement for the XML templates.
+
+string.Template.substitute() runs its regular expression over the whole
+template on every call. The templates in xml_templates never change, so
+they are compiled once into a list of literal chunks with slots, and a
+render is just filling the slots and one ''.join().
+"""
+import string
+
+
+class CompiledTemplate(object):
+    """
+    Compiled form of a string.Template source.
+
+    substitute() gives the same output as string.Template.substitute()
+    and, like it, raises KeyError for a missing placeholder.
+    """
+    def __init__(self, source):
+        self.source = source
+        self._parts = []
+        self._slots = []
+
+        literal = []
+        position = 0
+        for match in string.Template.pattern.finditer(source):
+            literal.append(source[position:match.start()])
+            position = match.end()
+
+            if match.group('escaped') is not None:
+                literal.append('$')
+                continue
+
+            name = match.group('named') or match.group('braced')
+            if name is None:
+                raise ValueError(
+                    'Invalid placeholder in template at index %d'
+                    % match.start('invalid'))
+
+            self._parts.append(''.join(literal))
+            literal = []
+            self._slots.append((len(self._parts), name))
+            self._parts.append(None)
+
+        literal.append(source[position:])
+        self._parts.append(''.join(literal))
+
+    def __repr__(self):
+        return '<CompiledTemplate %r>' % self.source[:40]
+
+    @property
+    def names(self):
+        """
+        Returns the placeholder names, in order of appearance.
+        """
+        return [name for index, name in self._slots]
+
+    def split(self, placeholder):
+        """
+        Returns (head, tail) CompiledTemplates for the source before and
+        after placeholder, which must occur exactly once ($name or
+        ${name}; an escaped $${name} is text).
+        """
+        matches = [match for match in
+                   string.Template.pattern.finditer(self.source)
+                   if placeholder in (match.group('named'),
+                                      match.group('braced'))]
+        if len(matches) != 1:
+            raise ValueError('Placeholder %s occurs %d times in template'
+                             % (placeholder, len(matches)))
+
+        match = matches[0]
+        return (CompiledTemplate(self.source[:match.start()]),
+                CompiledTemplate(self.source[match.end():]))
+
+    def fill(self, mapping):
+        """
+        Returns the list of chunks substitute() joins.
+        """
+        parts = list(self._parts)
+        for index, name in self._slots:
+            parts[index] = str(mapping[name])
+        return parts
+
+    def substitute(self, mapping):
+        return ''.join(self.fill(mapping))
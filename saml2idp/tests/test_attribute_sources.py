@@ -0,0 +1,165 @@
+"""
+Tests for concurrent attribute sources.
+"""
+import threading
+import time
+
+from django.test import RequestFactory, TestCase, override_settings
+
+from . import base, override_settings_file
+from .test_salesforce import REQUEST_DATA, SALESFORCE_ACS
+
+from saml2idp import attribute_sources
+from saml2idp.exceptions import CannotHandleAssertion
+
+threads = []
+
+
+def get_ldap(django_request, names):
+    threads.append(threading.current_thread())
+    time.sleep(0.1)
+    return {name: 'ldap %s' % name for name in names}
+
+
+def get_hr(django_request, names):
+    threads.append(threading.current_thread())
+    time.sleep(0.1)
+    return {name: 'hr %s' % name for name in names}
+
+
+def get_profile(django_request, names):
+    return {name: 'profile %s' % name for name in names}
+
+
+def get_slow(django_request, names):
+    time.sleep(0.5)
+    return {name: 'slow %s' % name for name in names}
+
+
+def get_broken(django_request, names):
+    raise IOError('backend down')
+
+
+def source(function, attributes=None, timeout=1, required=True):
+    config = {
+        'function': 'saml2idp.tests.test_attribute_sources.' + function,
+        'timeout': timeout,
+        'required': required,
+    }
+    if attributes is not None:
+        config['attributes'] = attributes
+    return config
+
+
+@override_settings(SAML2IDP_ATTRIBUTE_SOURCES={'workers': 4})
+class TestAttributeSources(TestCase):
+
+    def setUp(self):
+        attribute_sources.reset_executor()
+        del threads[:]
+        self.request = RequestFactory().get('/')
+
+    def tearDown(self):
+        attribute_sources.reset_executor()
+
+    def get_attributes(self, names, *sources):
+        return attribute_sources.AttributeSources(sources)(
+            self.request, names)
+
+    def test_concurrent(self):
+        start = time.monotonic()
+        attributes = self.get_attributes(
+            ['givenName', 'department'],
+            source('get_ldap', ['givenName']),
+            source('get_hr', ['department']))
+
+        self.assertEqual(attributes, {'givenName': 'ldap givenName',
+                                      'department': 'hr department'})
+        self.assertLess(time.monotonic() - start, 0.18)
+        self.assertEqual(len(set(threads)), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_only_asked_names(self):
+        attributes = self.get_attributes(
+            ['sn'], source('get_ldap'), source('get_hr', ['department']))
+        self.assertEqual(attributes, {'sn': 'ldap sn'})
+        self.assertEqual(len(threads), 1)
+
+    def test_later_source_wins(self):
+        attributes = self.get_attributes(
+            ['sn'], source('get_ldap'), source('get_hr'))
+        self.assertEqual(attributes, {'sn': 'hr sn'})
+
+    def test_required_timeout(self):
+        with self.assertRaises(CannotHandleAssertion):
+            self.get_attributes(['sn'], source('get_slow', timeout=0.1))
+
+    def test_required_error(self):
+        with self.assertRaises(CannotHandleAssertion):
+            self.get_attributes(['sn'], source('get_broken'))
+
+    @override_settings(SAML2IDP_ATTRIBUTE_SOURCES={'workers': 1})
+    def test_required_failure_cancels_queued(self):
+        attribute_sources.reset_executor()
+        with self.assertRaises(CannotHandleAssertion):
+            self.get_attributes(['sn', 'department'],
+                                source('get_slow', ['sn'], timeout=0.1),
+                                source('get_ldap', ['department']))
+        # get_ldap was queued behind get_slow, and never ran.
+        time.sleep(0.5)
+        self.assertEqual(threads, [])
+
+    def test_required_import_error(self):
+        with self.assertLogs('saml2idp.resolver', 'WARNING'), \
+                self.assertRaises(CannotHandleAssertion):
+            self.get_attributes(['sn'], source('does_not_exist'))
+
+    def test_optional_left_out(self):
+        with self.assertLogs('saml2idp.attribute_sources', 'WARNING'):
+            attributes = self.get_attributes(
+                ['sn', 'department'],
+                source('get_ldap', ['sn']),
+                source('get_broken', ['department'], required=False))
+        self.assertEqual(attributes, {'sn': 'ldap sn'})
+
+    def test_optional_bounded_by_required(self):
+        start = time.monotonic()
+        with self.assertLogs('saml2idp.attribute_sources', 'WARNING'):
+            attributes = self.get_attributes(
+                ['sn', 'department'],
+                source('get_ldap', ['sn']),
+                source('get_slow', ['department'], timeout=5,
+                       required=False))
+        self.assertEqual(attributes, {'sn': 'ldap sn'})
+        self.assertLess(time.monotonic() - start, 0.4)
+
+    def test_optional_only(self):
+        start = time.monotonic()
+        with self.assertLogs('saml2idp.attribute_sources', 'WARNING'):
+            attributes = self.get_attributes(
+                ['sn', 'department'],
+                source('get_hr', ['sn'], required=False),
+                source('get_slow', ['department'], timeout=0.2,
+                       required=False))
+        self.assertEqual(attributes, {'sn': 'hr sn'})
+        self.assertLess(time.monotonic() - start, 0.45)
+
+
+@override_settings_file
+class TestProcessorAttributeSources(base.SamlTestCase):
+    SP_CONFIG = {
+        'acs_url': SALESFORCE_ACS,
+        'processor': 'saml2idp.salesforce.Processor',
+        'attributes': ['givenName', 'department'],
+        'attribute_sources': [
+            source('get_ldap', ['givenName']),
+            source('get_profile', ['department'], required=False),
+        ],
+    }
+
+    def test_login(self):
+        self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+        self.assertIn('<saml:AttributeValue>ldap givenName'
+                      '</saml:AttributeValue>', self._saml)
+        self.assertIn('<saml:AttributeValue>profile department'
+                      '</saml:AttributeValue>', self._saml)
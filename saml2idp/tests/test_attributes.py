@@ -0,0 +1,76 @@
+"""
+Tests for fetching assertion attributes.
+"""
+from django.test import TestCase
+
+from . import base, override_settings_file
+from .test_salesforce import REQUEST_DATA, SALESFORCE_ACS
+
+from saml2idp.base import bulk_attribute_function
+
+calls = []
+
+
+def get_attributes(django_request, names):
+    calls.append(list(names))
+    return {name: '%s of %s' % (name, django_request.user.username)
+            for name in names if name != 'missing'}
+
+
+def get_attribute(django_request, attribute):
+    calls.append(attribute)
+    return attribute.upper()
+
+
+@override_settings_file
+class TestAttributes(base.SamlTestCase):
+    SP_CONFIG = {
+        'acs_url': SALESFORCE_ACS,
+        'processor': 'saml2idp.salesforce.Processor',
+        'attributes': ['givenName', 'missing', 'sn'],
+    }
+
+    def setUp(self):
+        super(TestAttributes, self).setUp()
+        del calls[:]
+
+    def tearDown(self):
+        for key in ('attributes_function', 'attribute_function'):
+            self.SP_CONFIG.pop(key, None)
+        super(TestAttributes, self).tearDown()
+
+    def test_bulk(self):
+        self.SP_CONFIG['attributes_function'] = (
+            'saml2idp.tests.test_attributes.get_attributes')
+        self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+
+        self.assertEqual(calls, [['givenName', 'missing', 'sn']])
+        self.assertIn('<saml:Attribute Name="givenName"><saml:AttributeValue>'
+                      'givenName of fred</saml:AttributeValue>', self._saml)
+        self.assertIn('<saml:Attribute Name="sn">', self._saml)
+        self.assertNotIn('<saml:Attribute Name="missing">', self._saml)
+
+    def test_per_attribute_adapter(self):
+        self.SP_CONFIG['attribute_function'] = get_attribute
+        self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+
+        self.assertEqual(calls, ['givenName', 'missing', 'sn'])
+        self.assertIn('<saml:AttributeValue>GIVENNAME</saml:AttributeValue>',
+                      self._saml)
+
+    def test_bulk_preferred(self):
+        self.SP_CONFIG['attributes_function'] = get_attributes
+        self.SP_CONFIG['attribute_function'] = get_attribute
+        self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+        self.assertEqual(len(calls), 1)
+
+    def test_no_function(self):
+        self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+        self.assertNotIn('<saml:AttributeStatement>', self._saml)
+
+
+class TestBulkAttributeFunction(TestCase):
+
+    def test_adapter(self):
+        function = bulk_attribute_function(get_attribute)
+        self.assertEqual(function(None, ['a', 'b']), {'a': 'A', 'b': 'B'})
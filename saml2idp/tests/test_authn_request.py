@@ -0,0 +1,92 @@
+"""
+Tests for the streaming AuthnRequest parser.
+"""
+import codecs
+
+from django.test import TestCase
+
+from saml2idp import authn_request, codex
+
+from . import test_azure, test_google_apps, test_salesforce
+
+
+class TestParse(TestCase):
+
+    def test_google_apps(self):
+        request = authn_request.parse(
+            codex.decode_base64_and_inflate(test_google_apps.SAML_REQUEST))
+
+        self.assertEqual(request.tag, 'samlp:AuthnRequest')
+        self.assertEqual(request.acs_url,
+                         'https://www.google.com/a/example.com/acs')
+        self.assertEqual(request.request_id,
+                         'doljiidhacjcjifebimhedigpeejhpifpdmlbjai')
+        self.assertEqual(request.destination, '')
+        self.assertEqual(request.provider_name, 'google.com')
+        self.assertEqual(request.issuer, 'google.com')
+
+    def test_salesforce(self):
+        request = authn_request.parse(codecs.decode(
+            test_salesforce.SAML_REQUEST, 'base64').decode('utf-8'))
+
+        self.assertEqual(request.acs_url, 'https://login.salesforce.com')
+        self.assertEqual(request.destination, 'http://127.0.0.1:8000/+saml')
+        self.assertEqual(request.issuer, 'https://saml.salesforce.com')
+
+    def test_azure(self):
+        request = authn_request.parse(
+            codecs.decode(test_azure.SAML_REQUEST, 'base64'))
+
+        self.assertIsNone(request.acs_url)
+        self.assertEqual(request.issuer, 'urn:federation:MicrosoftOnline')
+
+    def test_stops_after_issuer(self):
+        # Anything after the Issuer is never looked at.
+        request = authn_request.parse(
+            '<AuthnRequest ID="x"><Issuer>sp</Issuer><broken')
+
+        self.assertEqual(request.request_id, 'x')
+        self.assertEqual(request.issuer, 'sp')
+
+    def test_no_issuer(self):
+        request = authn_request.parse(
+            '<AuthnRequest ID="x"><NameIDPolicy/><Issuer>sp</Issuer>'
+            '</AuthnRequest>')
+
+        self.assertIsNone(request.issuer)
+
+    def test_leading_whitespace(self):
+        request = authn_request.parse(
+            '\n  <?xml version="1.0" encoding="UTF-8"?>'
+            '<samlp:AuthnRequest ID="x"><saml:Issuer>sp</saml:Issuer>'
+            '</samlp:AuthnRequest>')
+
+        self.assertEqual(request.request_id, 'x')
+        self.assertEqual(request.issuer, 'sp')
+
+    def test_declared_encoding(self):
+        request_xml = (
+            '<?xml version="1.0" encoding="ISO-8859-1"?>'
+            '<samlp:AuthnRequest ID="x"><saml:Issuer>caf\xe9</saml:Issuer>'
+            '</samlp:AuthnRequest>')
+
+        # Text is taken as it is; bytes are decoded as declared.
+        self.assertEqual(authn_request.parse(request_xml).issuer,
+                         'caf\xe9')
+        self.assertEqual(
+            authn_request.parse(request_xml.encode('iso-8859-1')).issuer,
+            'caf\xe9')
+
+    def test_not_xml(self):
+        with self.assertRaises(ValueError):
+            authn_request.parse(b'x\x9c\x01\x02')
+
+    def test_too_big(self):
+        with self.assertRaises(ValueError):
+            authn_request.parse(
+                '<a>%s</a>' % ('x' * authn_request.MAX_REQUEST_SIZE))
+
+    def test_dtd_rejected(self):
+        with self.assertRaises(ValueError):
+            authn_request.parse(
+                '<!DOCTYPE a [<!ENTITY e "x">]><a ID="&e;"></a>')
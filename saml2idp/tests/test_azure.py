@@ -12,7 +12,6 @@ from . import base, override_settings_file, override_settings_str
 
 from saml2idp import saml2idp_metadata
 from saml2idp.azure import AZURE_ACS_URL
-from saml2idp.exceptions import CannotHandleAssertion
 from saml2idp.codex import convert_guid_to_immutable_id
 
 SAML_REQUEST = codecs.encode(
@@ -50,6 +49,11 @@ def get_user_idp_email(django_request, attribute):
     return 'freddy@example.com'
 
 
+def get_user_attributes(django_request, names):
+    return {name: {'IDPEmail': 'freddy@example.com',
+                   'givenName': 'Freddy'}[name] for name in names}
+
+
 class TestAzureProcessor:
     SP_CONFIG = {
         'acs_url': AZURE_ACS_URL,
@@ -61,6 +65,8 @@ class TestAzureProcessor:
 
     def tearDown(self):
         self.SP_CONFIG.pop('attribute_function', None)
+        self.SP_CONFIG.pop('attributes_function', None)
+        self.SP_CONFIG.pop('attributes', None)
         self.SP_CONFIG['subject_function'] = USER_SUBJECT_FUNCTION
         super(TestAzureProcessor, self).tearDown()
 
@@ -86,8 +92,11 @@ class TestAzureProcessor:
         """
         self.SP_CONFIG.pop('subject_function')
 
-        with self.assertRaises(CannotHandleAssertion):
-                super(TestAzureProcessor, self).test_user_logged_in()
+        self.client.login(username=self.USERNAME, password=self.PASSWORD)
+        with self.assertLogs('saml2idp', 'ERROR'):
+            response = self.client.get(self.login_url,
+                                       data=self.REQUEST_DATA, follow=True)
+        self.assertEqual(response.status_code, 403)
 
     def test_subject_function_str_invalid(self):
         """
@@ -132,6 +141,19 @@ class TestAzureProcessor:
         super(TestAzureProcessor, self).test_user_logged_in()
         self.assertFalse(get_user_idp_email(None, None) in self._saml)
 
+    def test_extra_attributes(self):
+        """
+        'attributes' adds to IDPEmail, which still comes from the function.
+        """
+        self.SP_CONFIG['attributes_function'] = get_user_attributes
+        self.SP_CONFIG['attributes'] = ['givenName']
+
+        self.EMAIL = 'freddy@example.com'
+
+        super(TestAzureProcessor, self).test_user_logged_in()
+        self.assertIn('<saml:AttributeValue>Freddy</saml:AttributeValue>',
+                      self._saml)
+
     def test_convert_guid_str(self):
         """
         Test convert_guid_to_immutable_id
@@ -0,0 +1,344 @@
+"""
+Tests for the circuit breakers around subject and attribute functions.
+"""
+import time
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, TestCase, override_settings
+
+from . import base, override_settings_file
+from .test_metrics import MetricsTestCase
+from .test_salesforce import REQUEST_DATA, SALESFORCE_ACS
+
+from saml2idp import attribute_sources, circuit_breaker, result_cache
+from saml2idp.exceptions import CannotHandleAssertion, UserNotAuthorized
+
+OPTIONS = {'failure_rate': 0.5, 'min_calls': 4, 'window': 4, 'cooldown': 30}
+
+directory = {'up': True}
+
+
+def get_slow(django_request):
+    time.sleep(0.5)
+    return 'slow'
+
+
+def get_subject(django_request):
+    if not directory['up']:
+        raise IOError('directory down')
+    return 'subject-%s' % django_request.user.username
+
+
+def get_attributes(django_request, names):
+    if not directory['up']:
+        raise IOError('directory down')
+    return {name: '%s of %s' % (name, django_request.user.username)
+            for name in names}
+
+
+def get_broken_attributes(django_request, names):
+    raise IOError('directory down')
+
+
+class TestCircuitBreaker(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('saml2idp.circuit_breaker.time.monotonic',
+                             return_value=1000.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = circuit_breaker.CircuitBreaker(
+            'sp', circuit_breaker.SUBJECT,
+            dict(circuit_breaker.DEFAULTS, **OPTIONS))
+
+    def record(self, *outcomes):
+        with self.assertLogs('saml2idp.circuit_breaker', 'WARNING') as logs:
+            for outcome in outcomes:
+                self.breaker.record(outcome)
+        return logs
+
+    def test_opens_at_failure_rate(self):
+        self.breaker.record('success')
+        self.breaker.record('error')
+        self.breaker.record('success')
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+        self.record('timeout')
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_below_failure_rate(self):
+        for outcome in ('success', 'success', 'error', 'success', 'success',
+                        'success', 'error'):
+            self.breaker.record(outcome)
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+
+    def test_half_open_after_cooldown(self):
+        self.record('error', 'error', 'error', 'error')
+        self.clock.return_value += 29
+        self.assertFalse(self.breaker.allow())
+
+        self.clock.return_value += 1
+        with self.assertLogs('saml2idp.circuit_breaker', 'WARNING'):
+            self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, circuit_breaker.HALF_OPEN)
+        # A single trial call.
+        self.assertFalse(self.breaker.allow())
+
+        self.record('success')
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_opens(self):
+        self.record('error', 'error', 'error', 'error')
+        self.clock.return_value += 30
+        with self.assertLogs('saml2idp.circuit_breaker', 'WARNING'):
+            self.breaker.allow()
+        self.record('error')
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_late_calls_ignored_while_open(self):
+        self.record('error', 'error', 'error', 'error')
+        self.breaker.record('success')
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+
+
+@override_settings(SAML2IDP_CIRCUIT_BREAKER=OPTIONS)
+class TestGuard(TestCase):
+
+    def setUp(self):
+        circuit_breaker.clear()
+        attribute_sources.reset_executor()
+        self.addCleanup(attribute_sources.reset_executor)
+        self.request = RequestFactory().get('/')
+        self.request.user = mock.Mock(pk=1)
+        self.func = mock.Mock(return_value='value')
+
+    def guard(self, func=None, sp_config=None,
+              kind=circuit_breaker.SUBJECT):
+        return circuit_breaker.guard('sp', sp_config or {}, kind,
+                                     func or self.func)
+
+    def fallback(self, sp_config, kind=circuit_breaker.SUBJECT):
+        return circuit_breaker.fallback(self.request, 'sp', sp_config, kind,
+                                        'default')
+
+    @override_settings(SAML2IDP_CIRCUIT_BREAKER=None)
+    def test_not_configured(self):
+        self.assertIs(self.guard(), self.func)
+
+    def test_remote_disabled(self):
+        self.assertIs(self.guard(sp_config={'circuit_breaker': False}),
+                      self.func)
+
+    def test_remote_options(self):
+        options = circuit_breaker.get_options(
+            {'circuit_breaker': {'timeout': 1}})
+        self.assertEqual(options['timeout'], 1)
+        self.assertEqual(options['min_calls'], 4)
+        self.assertEqual(options['fallback'], 'omit')
+
+    def test_invalid_fallback(self):
+        with self.assertRaises(ImproperlyConfigured):
+            circuit_breaker.get_options({'circuit_breaker': {
+                'fallback': 'retry'}})
+
+    def test_success(self):
+        self.assertEqual(self.guard()(self.request), 'value')
+        self.func.assert_called_once_with(self.request)
+
+    def test_timeout(self):
+        guarded = self.guard(get_slow,
+                             {'circuit_breaker': {'timeout': 0.1}})
+        start = time.monotonic()
+        with self.assertLogs('saml2idp.circuit_breaker', 'WARNING'), \
+                self.assertRaises(circuit_breaker.Unavailable):
+            guarded(self.request)
+        self.assertLess(time.monotonic() - start, 0.4)
+
+    def test_rejected_while_open(self):
+        self.func.side_effect = IOError('down')
+        guarded = self.guard()
+        with self.assertLogs('saml2idp.circuit_breaker', 'WARNING'):
+            for i in range(4):
+                with self.assertRaises(circuit_breaker.Unavailable):
+                    guarded(self.request)
+        self.assertEqual(self.func.call_count, 4)
+
+        with self.assertRaises(circuit_breaker.Unavailable):
+            guarded(self.request)
+        self.assertEqual(self.func.call_count, 4)
+
+    def test_required_source_fails_login(self):
+        # Not Unavailable: no fallback may leave out a required source.
+        sources = attribute_sources.AttributeSources([{
+            'function': get_broken_attributes, 'required': True}])
+        guarded = self.guard(sources, kind=circuit_breaker.ATTRIBUTES)
+        with self.assertRaises(CannotHandleAssertion):
+            guarded(self.request, ['sn'])
+
+        breaker = circuit_breaker.get_breaker(
+            'sp', circuit_breaker.ATTRIBUTES, circuit_breaker.get_options({}))
+        self.assertEqual(list(breaker._calls), [False])
+
+    @override_settings(
+        SAML2IDP_CONFIG_FUNCTION='saml2idp.tests.test_metadata.get_config')
+    def test_per_tenant(self):
+        tenant_a = RequestFactory().get('/', HTTP_HOST='a.example.com')
+        tenant_b = RequestFactory().get('/', HTTP_HOST='b.example.com')
+        for request in (tenant_a, tenant_b):
+            request.user = self.request.user
+        sp_config = {'circuit_breaker': {'fallback': 'cache'}}
+        guarded = self.guard(sp_config=sp_config)
+        guarded(tenant_a)
+
+        # An outage of tenant A's directory leaves tenant B alone.
+        self.func.side_effect = IOError('down')
+        with self.assertLogs('saml2idp.circuit_breaker', 'WARNING'):
+            for i in range(4):
+                with self.assertRaises(circuit_breaker.Unavailable):
+                    guarded(tenant_a)
+        self.func.side_effect = None
+        self.assertEqual(guarded(tenant_b), 'value')
+
+        # Nor does tenant B get tenant A's cached subject.
+        circuit_breaker.clear()
+        self.func.return_value = 'subject of A'
+        guarded(tenant_a)
+        with self.assertRaises(UserNotAuthorized):
+            circuit_breaker.fallback(tenant_b, 'sp', sp_config,
+                                     circuit_breaker.SUBJECT)
+
+    def test_fallback_omit(self):
+        self.assertEqual(self.fallback({}, circuit_breaker.ATTRIBUTES),
+                         'default')
+
+    def test_fallback_omit_subject(self):
+        with self.assertRaises(UserNotAuthorized):
+            self.fallback({})
+
+    def test_fallback_cache(self):
+        sp_config = {'circuit_breaker': {'fallback': 'cache'}}
+        self.assertEqual(
+            self.fallback(sp_config, circuit_breaker.ATTRIBUTES), 'default')
+        self.func.return_value = {'sn': 'value'}
+        self.guard(sp_config=sp_config,
+                   kind=circuit_breaker.ATTRIBUTES)(self.request, ['sn'])
+        self.assertEqual(
+            self.fallback(sp_config, circuit_breaker.ATTRIBUTES),
+            {'sn': 'value'})
+
+    def test_fallback_cache_subject(self):
+        sp_config = {'circuit_breaker': {'fallback': 'cache'}}
+        with self.assertRaises(UserNotAuthorized):
+            self.fallback(sp_config)
+        self.guard(sp_config=sp_config)(self.request)
+        self.assertEqual(self.fallback(sp_config), 'value')
+
+    def test_fallback_cache_merges_attributes(self):
+        sp_config = {'circuit_breaker': {'fallback': 'cache'}}
+        guarded = self.guard(get_attributes, sp_config,
+                             circuit_breaker.ATTRIBUTES)
+        self.request.user.username = 'fred'
+        guarded(self.request, ['sn'])
+        guarded(self.request, ['mail'])
+        self.assertEqual(
+            self.fallback(sp_config, circuit_breaker.ATTRIBUTES),
+            {'sn': 'sn of fred', 'mail': 'mail of fred'})
+
+    def test_fallback_deny(self):
+        with self.assertRaises(UserNotAuthorized):
+            self.fallback({'circuit_breaker': {'fallback': 'deny'}})
+
+
+@override_settings_file
+@override_settings(SAML2IDP_CIRCUIT_BREAKER=OPTIONS)
+class TestProcessorCircuitBreaker(base.SamlTestCase):
+    SP_CONFIG = {
+        'acs_url': SALESFORCE_ACS,
+        'processor': 'saml2idp.salesforce.Processor',
+        'attributes': ['givenName'],
+        'subject_function': get_subject,
+        'attributes_function': get_attributes,
+    }
+
+    def setUp(self):
+        super(TestProcessorCircuitBreaker, self).setUp()
+        circuit_breaker.clear()
+        result_cache.clear()
+        directory['up'] = True
+
+    def tearDown(self):
+        self.SP_CONFIG.pop('circuit_breaker', None)
+        self.SP_CONFIG['attributes_function'] = get_attributes
+        super(TestProcessorCircuitBreaker, self).tearDown()
+
+    def get_denied(self):
+        self.client.login(username=self.USERNAME, password=self.PASSWORD)
+        with self.assertLogs('saml2idp.circuit_breaker', 'WARNING'):
+            response = self.client.get(self.login_url, data=REQUEST_DATA,
+                                       follow=True)
+        self.assertTemplateUsed(response, 'saml2idp/invalid_user.html')
+        self.assertNotIn(b'SAMLResponse', response.content)
+
+    def test_omit_attributes(self):
+        self.SP_CONFIG['attributes_function'] = get_broken_attributes
+        with self.assertLogs('saml2idp.circuit_breaker', 'WARNING'):
+            self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+        self.assertIn('>subject-fred</saml:NameID>', self._saml)
+        self.assertNotIn('<saml:AttributeStatement>', self._saml)
+
+    def test_omit_denies_subject(self):
+        # Never the email instead of an opaque subject.
+        directory['up'] = False
+        self.get_denied()
+
+    def test_cache_without_subject_denies(self):
+        self.SP_CONFIG['circuit_breaker'] = {'fallback': 'cache'}
+        directory['up'] = False
+        self.get_denied()
+
+    def test_cache(self):
+        self.SP_CONFIG['circuit_breaker'] = {'fallback': 'cache'}
+        self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+
+        directory['up'] = False
+        with self.assertLogs('saml2idp.circuit_breaker', 'WARNING'):
+            self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+        self.assertIn('>subject-fred</saml:NameID>', self._saml)
+        self.assertIn('<saml:AttributeValue>givenName of fred'
+                      '</saml:AttributeValue>', self._saml)
+
+    def test_deny(self):
+        self.SP_CONFIG['circuit_breaker'] = {'fallback': 'deny'}
+        self.SP_CONFIG['attributes_function'] = get_broken_attributes
+        self.get_denied()
+
+
+@override_settings(SAML2IDP_CIRCUIT_BREAKER=OPTIONS)
+class TestCircuitBreakerMetrics(MetricsTestCase):
+
+    def setUp(self):
+        super(TestCircuitBreakerMetrics, self).setUp()
+        circuit_breaker.clear()
+
+    def test_state_and_calls(self):
+        guarded = circuit_breaker.guard(
+            'sp', {}, circuit_breaker.SUBJECT,
+            mock.Mock(side_effect=IOError('down')))
+        request = RequestFactory().get('/')
+        with self.assertLogs('saml2idp.circuit_breaker', 'WARNING'):
+            for i in range(5):
+                with self.assertRaises(circuit_breaker.Unavailable):
+                    guarded(request)
+
+        lines = self.get_metrics()
+        self.assertIn('saml2idp_breaker_state{function="subject",remote="sp"}'
+                      ' 2', lines)
+        self.assertIn('saml2idp_breaker_calls_total'
+                      '{function="subject",outcome="error",remote="sp"} 4',
+                      lines)
+        self.assertIn('saml2idp_breaker_calls_total'
+                      '{function="subject",outcome="rejected",remote="sp"} 1',
+                      lines)
@@ -4,11 +4,24 @@ Tests for the dj AttributeProcessor and IdP-initiated deep-linking.
 
 # local imports:
 import os
-from . import base
+from unittest import mock
+from . import base, override_settings_file
 
 # Django imports:
 from django.utils.unittest import skip
 from django.core.urlresolvers import reverse
+from django.conf import settings
+from django.test import override_settings
+
+from saml2idp import result_cache
+
+
+def get_subject_one(django_request):
+    return 'one-%s' % django_request.user.username
+
+
+def get_subject_two(django_request):
+    return 'two-%s' % django_request.user.username
 
 
 class TestDeepLink(base.SamlTestCase):
@@ -69,3 +82,46 @@ class TestDeepLinkWithAttributes(TestDeepLink):
         self.assertEqual(attributes[0]['name'], 'foo')
         value = attributes[0].findAll('saml:attributevalue')[0]
         self.assertEqual(value.text, 'bar')
+
+
+@override_settings_file
+@override_settings(SAML2IDP_RESULT_CACHE={'ttl': 60})
+class TestDeepLinkRemotes(base.SamlTestCase):
+    """
+    Per-remote state (the result cache) of two deep-linked remotes.
+    """
+    SP_CONFIG = {
+        'acs_url': 'http://127.0.0.1:9000/sp/acs/',
+        'processor': 'saml2idp.dj.Processor',
+        'subject_function': get_subject_one,
+        'links': {
+            'one': 'http://127.0.0.1:9000/sp/%s/',
+        },
+    }
+    OTHER_SP_CONFIG = {
+        'acs_url': 'http://127.0.0.1:9001/sp/acs/',
+        'processor': 'saml2idp.dj.Processor',
+        'subject_function': get_subject_two,
+        'links': {
+            'two': 'http://127.0.0.1:9001/sp/%s/',
+        },
+    }
+
+    def setUp(self):
+        super(TestDeepLinkRemotes, self).setUp()
+        self._p_config.stop()
+        self._p_config = mock.patch(
+            'saml2idp.saml2idp_metadata.get_metadata_config',
+            return_value=(settings.SAML2IDP_CONFIG, {
+                'one': self.SP_CONFIG,
+                'two': self.OTHER_SP_CONFIG,
+            }))
+        self._p_config.start()
+        result_cache.clear()
+
+    def test_subjects_not_shared(self):
+        self._hit_saml_view(reverse('idp_login_init', args=['one', 'x']))
+        self.assertIn('>one-fred</saml:NameID>', self._saml)
+
+        self._hit_saml_view(reverse('idp_login_init', args=['two', 'x']))
+        self.assertIn('>two-fred</saml:NameID>', self._saml)
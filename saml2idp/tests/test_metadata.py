@@ -0,0 +1,169 @@
+"""
+Tests for loading SAML2IDP_CONFIG and SAML2IDP_REMOTES.
+"""
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.test import RequestFactory, TestCase, override_settings
+
+from saml2idp import saml2idp_metadata
+
+CONFIG_FUNCTION = 'saml2idp.tests.test_metadata.get_config'
+
+calls = []
+
+
+def get_config(request):
+    calls.append(request.get_host())
+    return settings.SAML2IDP_CONFIG, settings.SAML2IDP_REMOTES
+
+
+def get_slow_config(request):
+    time.sleep(0.1)
+    return get_config(request)
+
+
+def get_tenant(request):
+    return request.GET.get('tenant')
+
+
+@override_settings(SAML2IDP_CONFIG_FUNCTION=CONFIG_FUNCTION)
+class TestConfigCache(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        saml2idp_metadata.invalidate_config_cache()
+
+    def get_config(self, host='idp.example.com', path='/'):
+        request = RequestFactory().get(path, HTTP_HOST=host)
+        return saml2idp_metadata.get_metadata_config(request)
+
+    def test_disabled(self):
+        self.get_config()
+        self.get_config()
+        self.assertEqual(calls, ['idp.example.com', 'idp.example.com'])
+
+    @override_settings(SAML2IDP_CONFIG_CACHE={'ttl': 60})
+    def test_cached_per_host(self):
+        first = self.get_config()
+        second = self.get_config()
+        self.get_config('other.example.com')
+
+        self.assertIs(first, second)
+        self.assertEqual(calls, ['idp.example.com', 'other.example.com'])
+
+    @override_settings(SAML2IDP_CONFIG_CACHE={
+        'key_function': 'saml2idp.tests.test_metadata.get_tenant'})
+    def test_key_function(self):
+        self.get_config('a.example.com', '/?tenant=1')
+        self.get_config('b.example.com', '/?tenant=1')
+        self.get_config('a.example.com', '/?tenant=2')
+
+        self.assertEqual(calls, ['a.example.com', 'a.example.com'])
+
+    @override_settings(SAML2IDP_CONFIG_CACHE={'ttl': 60})
+    def test_invalidate(self):
+        self.get_config()
+        self.get_config('other.example.com')
+
+        saml2idp_metadata.invalidate_config_cache('idp.example.com')
+        self.get_config()
+        self.get_config('other.example.com')
+
+        self.assertEqual(calls, [
+            'idp.example.com', 'other.example.com', 'idp.example.com'])
+
+    @override_settings(SAML2IDP_CONFIG_CACHE={'ttl': 60})
+    def test_ttl(self):
+        self.get_config()
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.get_config()
+        self.assertEqual(len(calls), 2)
+
+    @override_settings(
+        SAML2IDP_CONFIG_FUNCTION='saml2idp.tests.test_metadata.'
+                                 'get_slow_config',
+        SAML2IDP_CONFIG_CACHE={'ttl': 60})
+    def test_single_flight(self):
+        threads = [threading.Thread(target=self.get_config)
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, ['idp.example.com'])
+
+
+class TestSessionConfig(TestCase):
+
+    def setUp(self):
+        saml2idp_metadata._snapshots.clear()
+
+    def make_request(self, session=None):
+        request = RequestFactory().get('/', HTTP_HOST='idp.example.com')
+        request.session = {} if session is None else session
+        return request
+
+    def test_session_holds_reference(self):
+        request = self.make_request()
+        saml2idp_metadata.set_session_config(
+            request, settings.SAML2IDP_CONFIG, settings.SAML2IDP_REMOTES)
+
+        self.assertEqual(request.session['SAML2IDP'], {
+            'key': 'idp.example.com',
+            'version': saml2idp_metadata.get_config_version(
+                settings.SAML2IDP_CONFIG, settings.SAML2IDP_REMOTES),
+        })
+
+        # Another request of the same session, in the same process.
+        config, remotes = saml2idp_metadata.get_session_config(
+            self.make_request(request.session))
+        self.assertIs(config, settings.SAML2IDP_CONFIG)
+        self.assertIs(remotes, settings.SAML2IDP_REMOTES)
+
+    def test_reload_without_snapshot(self):
+        request = self.make_request()
+        saml2idp_metadata.set_session_config(
+            request, settings.SAML2IDP_CONFIG, settings.SAML2IDP_REMOTES)
+        saml2idp_metadata._snapshots.clear()
+
+        with mock.patch.object(saml2idp_metadata, 'get_metadata_config',
+                               wraps=saml2idp_metadata.get_metadata_config
+                               ) as get_metadata_config:
+            for i in range(2):
+                config, remotes = saml2idp_metadata.get_session_config(
+                    self.make_request(request.session))
+
+        self.assertEqual(get_metadata_config.call_count, 1)
+        self.assertIs(remotes, settings.SAML2IDP_REMOTES)
+
+    def test_legacy_session(self):
+        remotes = {'sp': {'acs_url': 'https://sp.example.com/acs'}}
+        request = self.make_request({'SAML2IDP': {
+            'SAML2IDP_CONFIG': settings.SAML2IDP_CONFIG,
+            'SAML2IDP_REMOTES': remotes,
+        }})
+
+        self.assertEqual(saml2idp_metadata.get_session_config(request),
+                         (settings.SAML2IDP_CONFIG, remotes))
+
+    def test_no_reference(self):
+        with self.assertRaises(KeyError):
+            saml2idp_metadata.get_session_config(self.make_request())
+
+    def test_version(self):
+        version = saml2idp_metadata.get_config_version
+        remotes = {'sp': {'acs_url': 'https://sp.example.com/acs',
+                          'subject_function': get_tenant}}
+
+        self.assertEqual(version({'a': 1}, remotes),
+                         version({'a': 1}, dict(remotes)))
+        self.assertNotEqual(version({'a': 1}, remotes),
+                            version({'a': 2}, remotes))
+        self.assertNotEqual(
+            version({'a': 1}, remotes),
+            version({'a': 1}, {'sp': dict(remotes['sp'],
+                                          subject_function=get_config)}))
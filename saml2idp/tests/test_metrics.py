@@ -0,0 +1,221 @@
+"""
+Tests for the multi-process Prometheus metrics.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+
+from saml2idp import metrics
+
+from . import config_with_file, test_salesforce
+
+
+class MetricsTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        # No flush timers left behind to write to a removed directory.
+        overrides = override_settings(SAML2IDP_METRICS={
+            'directory': self.directory, 'flush_interval': 0})
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def get_metrics(self):
+        response = self.client.get(reverse('idp_metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode('utf-8').splitlines()
+
+
+class TestMetricsView(MetricsTestCase):
+
+    def setUp(self):
+        super(TestMetricsView, self).setUp()
+        User.objects.create_user('fred', email='fred@example.com',
+                                 password='secret')
+        self.client.login(username='fred', password='secret')
+
+        remotes = {'salesforce': {
+            'acs_url': test_salesforce.SALESFORCE_ACS,
+            'processor': 'saml2idp.salesforce.Processor',
+        }}
+        patcher = mock.patch(
+            'saml2idp.saml2idp_metadata.get_metadata_config',
+            return_value=(config_with_file, remotes))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disabled(self):
+        with override_settings(SAML2IDP_METRICS=None):
+            response = self.client.get(reverse('idp_metrics'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_login(self):
+        response = self.client.get(reverse('idp_login_begin'),
+                                   data=test_salesforce.REQUEST_DATA)
+        self.assertContains(response, 'SAMLResponse')
+
+        lines = self.get_metrics()
+        self.assertIn('saml2idp_logins_total{remote="salesforce"} 1', lines)
+        self.assertIn(
+            'saml2idp_routing_attempts_total{remote="salesforce"} 1', lines)
+        # Assertion and Response are both signed by default.
+        self.assertIn('saml2idp_signatures_total{remote="salesforce"} 2',
+                      lines)
+        self.assertIn('saml2idp_signing_seconds_count{algorithm="rsa-sha1"} 2',
+                      lines)
+        self.assertIn(
+            'saml2idp_attributes_seconds_count{remote="salesforce"} 1', lines)
+        self.assertIn('saml2idp_login_seconds_count 1', lines)
+        self.assertIn('saml2idp_login_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn('# TYPE saml2idp_routing_seconds histogram', lines)
+
+    def test_failure(self):
+        data = dict(test_salesforce.REQUEST_DATA, SAMLRequest='bogus')
+        response = self.client.get(reverse('idp_login_begin'), data=data)
+        self.assertEqual(response.status_code, 403)
+
+        self.assertIn(
+            'saml2idp_failures_total'
+            '{exception="CannotHandleAssertion",remote=""} 1',
+            self.get_metrics())
+
+
+    def test_config_failure(self):
+        with mock.patch('saml2idp.saml2idp_metadata.get_metadata_config',
+                        side_effect=ImproperlyConfigured('no config')), \
+                self.assertLogs('saml2idp', 'ERROR'):
+            response = self.client.get(reverse('idp_login_begin'),
+                                       data=test_salesforce.REQUEST_DATA)
+        self.assertEqual(response.status_code, 403)
+
+        lines = self.get_metrics()
+        self.assertIn(
+            'saml2idp_failures_total'
+            '{exception="ImproperlyConfigured",remote=""} 1', lines)
+        self.assertIn('saml2idp_login_seconds_count 1', lines)
+
+    def test_routing_excludes_config_loading(self):
+        def get_slow_config(request):
+            time.sleep(0.3)
+            return config_with_file, {'salesforce': {
+                'acs_url': test_salesforce.SALESFORCE_ACS,
+                'processor': 'saml2idp.salesforce.Processor',
+            }}
+
+        with mock.patch('saml2idp.saml2idp_metadata.get_metadata_config',
+                        get_slow_config):
+            self.client.get(reverse('idp_login_begin'),
+                            data=test_salesforce.REQUEST_DATA)
+
+        lines = self.get_metrics()
+        self.assertIn('saml2idp_routing_seconds_bucket{le="0.25"} 1', lines)
+        self.assertNotIn('saml2idp_login_seconds_bucket{le="0.25"} 1', lines)
+
+
+class TestAggregation(MetricsTestCase):
+
+    def test_sums_processes(self):
+        other = {
+            'counters': [
+                ['saml2idp_logins_total', [['remote', 'sp']], 2]],
+            'histograms': [
+                ['saml2idp_login_seconds', [],
+                 [1] + [0] * len(metrics.BUCKETS) + [0.001]]],
+        }
+        with open(os.path.join(self.directory,
+                               'saml2idp-999999.json'), 'w') as f:
+            json.dump(other, f)
+
+        metrics.inc('saml2idp_logins_total', remote='sp')
+        metrics.observe('saml2idp_login_seconds', 0.2)
+
+        lines = self.get_metrics()
+        self.assertIn('saml2idp_logins_total{remote="sp"} 3', lines)
+        self.assertIn('saml2idp_login_seconds_bucket{le="0.001"} 1', lines)
+        self.assertIn('saml2idp_login_seconds_bucket{le="0.25"} 2', lines)
+        self.assertIn('saml2idp_login_seconds_count 2', lines)
+
+    def test_forked_worker_starts_empty(self):
+        metrics.inc('saml2idp_logins_total', remote='sp')
+        parent = metrics.get_registry()
+
+        with mock.patch('os.getpid', return_value=parent.pid + 1):
+            child = metrics.get_registry()
+            metrics.inc('saml2idp_logins_total', remote='sp')
+            child.flush(force=True)
+
+        self.assertIsNot(child, parent)
+        with open(child.path) as f:
+            self.assertEqual(json.load(f)['counters'], [
+                ['saml2idp_logins_total', [['remote', 'sp']], 1]])
+
+    def test_last_changes_written(self):
+        registry = metrics.Registry(self.directory, flush_interval=0.2)
+
+        def get_logins():
+            with open(registry.path) as f:
+                return json.load(f)['counters'][0][2]
+
+        registry.inc('saml2idp_logins_total', (), 1)
+        registry.inc('saml2idp_logins_total', (), 1)
+        self.assertEqual(get_logins(), 1)
+
+        # Nothing else is recorded, yet the second one shows.
+        time.sleep(0.4)
+        self.assertEqual(get_logins(), 2)
+
+        registry.inc('saml2idp_logins_total', (), 1)
+        registry.close()
+        self.assertEqual(get_logins(), 3)
+
+    def test_closed_at_exit(self):
+        with mock.patch('atexit.register') as register:
+            registry = metrics.get_registry()
+        register.assert_called_once_with(registry.close)
+
+    def test_reused_pid(self):
+        exited = metrics.Registry(self.directory, flush_interval=0)
+        exited.inc('saml2idp_logins_total', (('remote', 'sp'),), 5)
+
+        # A later worker that was given the same pid.
+        metrics.inc('saml2idp_logins_total', remote='sp')
+
+        self.assertEqual(metrics.get_registry().pid, exited.pid)
+        self.assertIn('saml2idp_logins_total{remote="sp"} 6',
+                      self.get_metrics())
+
+    def test_label_escaping(self):
+        metrics.inc('saml2idp_logins_total', remote='a"b\\c\nd')
+        self.assertIn(
+            'saml2idp_logins_total{remote="a\\"b\\\\c\\nd"} 1',
+            self.get_metrics())
+
+    def test_gauges_of_running_processes(self):
+        exited = {
+            'counters': [],
+            'gauges': [
+                ['saml2idp_breaker_state', [['function', 'subject'],
+                                            ['remote', 'sp']], 2]],
+            'histograms': [],
+        }
+        with open(os.path.join(self.directory,
+                               'saml2idp-999999.json'), 'w') as f:
+            json.dump(exited, f)
+
+        metrics.set_gauge('saml2idp_breaker_state', 1, remote='sp',
+                          function='subject')
+
+        lines = self.get_metrics()
+        self.assertIn('# TYPE saml2idp_breaker_state gauge', lines)
+        self.assertIn(
+            'saml2idp_breaker_state{function="subject",remote="sp"} 1', lines)
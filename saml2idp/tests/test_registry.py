@@ -0,0 +1,222 @@
+"""
+Tests for processor lookup and request routing.
+"""
+from unittest import mock
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, TestCase
+
+from saml2idp import (
+    authn_request, azure, codex, exceptions, registry, salesforce)
+
+from . import test_google_apps, test_salesforce
+
+GOOGLE_APPS_CONFIG = {
+    'acs_url': test_google_apps.GOOGLE_APPS_ACS,
+    'processor': 'saml2idp.google_apps.Processor',
+}
+
+SALESFORCE_CONFIG = {
+    'acs_url': test_salesforce.SALESFORCE_ACS,
+    'processor': 'saml2idp.salesforce.Processor',
+}
+
+
+def make_remotes(count, filler, last):
+    """
+    Returns count copies of filler with other ACS URLs, followed by last.
+    """
+    remotes = {}
+    for i in range(count):
+        remotes['remote%d' % i] = dict(
+            filler, acs_url='https://sp%d.example.com/acs' % i)
+    remotes['last'] = last
+    return remotes
+
+
+def make_tenant_remotes(tenant):
+    """
+    Returns the remotes of tenant, with a subject_function closing over it,
+    as a config function building them per tenant would.
+    """
+    def get_subject(django_request):
+        return 'subject-of-%s' % tenant
+
+    return {'salesforce': dict(SALESFORCE_CONFIG,
+                               subject_function=get_subject)}
+
+
+class AnyAcsUrlProcessor(salesforce.Processor):
+    """
+    Accepts requests for any ACS URL, on behalf of the first remote.
+    """
+    def _validate_request(self):
+        self._remote_name, self._sp_config = next(
+            iter(self._saml2idp_remotes.items()))
+
+
+class RoutingTestCase(TestCase):
+
+    def make_request(self, remotes, request_data):
+        request = RequestFactory().get('/')
+        request.session = {
+            'SAMLRequest': request_data['SAMLRequest'],
+            'RelayState': request_data['RelayState'],
+            'SAML2IDP': {
+                'SAML2IDP_CONFIG': settings.SAML2IDP_CONFIG,
+                'SAML2IDP_REMOTES': remotes,
+            },
+        }
+        return request
+
+
+class TestGetProcessor(TestCase):
+
+    def test_class_is_cached(self):
+        registry._processor_classes.clear()
+
+        with mock.patch.object(registry, 'import_module',
+                               wraps=registry.import_module) as import_module:
+            first = registry.get_processor('saml2idp.salesforce.Processor')
+            second = registry.get_processor('saml2idp.salesforce.Processor')
+
+        self.assertEqual(import_module.call_count, 1)
+        self.assertIs(type(first), type(second))
+        # Processors are stateful; instances must not be shared.
+        self.assertIsNot(first, second)
+
+    def test_errors_are_not_cached(self):
+        with self.assertRaises(ImproperlyConfigured):
+            registry.get_processor('saml2idp.salesforce.NoSuchProcessor')
+        self.assertNotIn('saml2idp.salesforce.NoSuchProcessor',
+                         registry._processor_classes)
+
+
+class TestFindProcessor(RoutingTestCase):
+
+    def _count_calls(self, remotes, request_data):
+        request = self.make_request(remotes, request_data)
+        parse = mock.Mock(wraps=authn_request.parse)
+        decoders = {name: mock.Mock(wraps=decode)
+                    for name, decode in codex.DECODERS.items()}
+
+        with mock.patch.object(authn_request, 'parse', parse), \
+                mock.patch.dict(codex.DECODERS, decoders):
+            proc = registry.find_processor(request)
+
+        return proc, parse.call_count, {
+            name: decode.call_count for name, decode in decoders.items()}
+
+    def test_google_apps(self):
+        remotes = make_remotes(20, SALESFORCE_CONFIG, GOOGLE_APPS_CONFIG)
+
+        proc, parses, decodes = self._count_calls(
+            remotes, test_google_apps.REQUEST_DATA)
+
+        self.assertIs(proc._sp_config, GOOGLE_APPS_CONFIG)
+        # One decode per codec; the base64-only result fails to parse once.
+        self.assertEqual(decodes, {'base64': 1, 'deflate': 1})
+        self.assertEqual(parses, 2)
+
+    def test_salesforce(self):
+        remotes = make_remotes(20, GOOGLE_APPS_CONFIG, SALESFORCE_CONFIG)
+
+        proc, parses, decodes = self._count_calls(
+            remotes, test_salesforce.REQUEST_DATA)
+
+        self.assertIs(proc._sp_config, SALESFORCE_CONFIG)
+        # base64 is tried first and parses, so nothing is inflated.
+        self.assertEqual(decodes, {'base64': 1, 'deflate': 0})
+        self.assertEqual(parses, 1)
+
+    def test_only_candidates_are_tried(self):
+        remotes = make_remotes(20, SALESFORCE_CONFIG, GOOGLE_APPS_CONFIG)
+        request = self.make_request(remotes, test_google_apps.REQUEST_DATA)
+
+        with mock.patch.object(registry, 'get_processor',
+                               wraps=registry.get_processor) as get_processor:
+            registry.find_processor(request)
+
+        get_processor.assert_called_once_with('saml2idp.google_apps.Processor')
+
+    def test_tenants_from_one_factory(self):
+        # Equal but for their closures: neither may get the other's config.
+        for tenant in ('A', 'B'):
+            remotes = make_tenant_remotes(tenant)
+            request = self.make_request(remotes,
+                                        test_salesforce.REQUEST_DATA)
+
+            proc = registry.find_processor(request)
+            self.assertIs(proc._sp_config, remotes['salesforce'])
+            self.assertEqual(proc._sp_config['subject_function'](request),
+                             'subject-of-%s' % tenant)
+
+    def test_unknown_acs_url(self):
+        remotes = make_remotes(5, SALESFORCE_CONFIG, dict(
+            GOOGLE_APPS_CONFIG, acs_url='https://other.example.com/acs'))
+        request = self.make_request(remotes, test_google_apps.REQUEST_DATA)
+
+        with mock.patch.object(registry, 'get_processor',
+                               wraps=registry.get_processor) as get_processor:
+            with self.assertRaises(exceptions.CannotHandleAssertion):
+                registry.find_processor(request)
+        # Any processor may accept it; once per distinct processor.
+        self.assertEqual(get_processor.call_count, 2)
+
+    def test_unknown_acs_url_accepted(self):
+        remotes = {'other': dict(
+            SALESFORCE_CONFIG, acs_url='https://other.example.com/acs',
+            processor='saml2idp.tests.test_registry.AnyAcsUrlProcessor')}
+        request = self.make_request(remotes, test_salesforce.REQUEST_DATA)
+
+        proc = registry.find_processor(request)
+        self.assertIsInstance(proc, AnyAcsUrlProcessor)
+        self.assertIs(proc._sp_config, remotes['other'])
+
+    def test_unreadable_request_tries_everything(self):
+        remotes = make_remotes(3, SALESFORCE_CONFIG, GOOGLE_APPS_CONFIG)
+        request = self.make_request(remotes, {
+            'SAMLRequest': 'not a request', 'RelayState': ''})
+
+        with mock.patch.object(registry, 'get_processor',
+                               wraps=registry.get_processor) as get_processor:
+            with self.assertRaises(exceptions.CannotHandleAssertion):
+                registry.find_processor(request)
+        # Once per distinct processor.
+        self.assertEqual(get_processor.call_count, 2)
+
+
+class TestRemotesIndex(TestCase):
+
+    def test_by_acs_url(self):
+        remotes = make_remotes(3, SALESFORCE_CONFIG, GOOGLE_APPS_CONFIG)
+        index = registry.get_remotes_index(remotes)
+
+        self.assertEqual(index.by_acs_url[test_google_apps.GOOGLE_APPS_ACS],
+                         [('last', GOOGLE_APPS_CONFIG)])
+        self.assertEqual(index.by_acs_url['https://sp1.example.com/acs'],
+                         [('remote1', remotes['remote1'])])
+
+    def test_by_issuer(self):
+        remotes = {
+            'azure': {
+                'acs_url': azure.AZURE_ACS_URL,
+                'processor': 'saml2idp.azure.Processor',
+            },
+            'custom': dict(SALESFORCE_CONFIG,
+                           request_issuer='https://sp.example.com'),
+        }
+        index = registry.get_remotes_index(remotes)
+
+        self.assertEqual(index.by_issuer, {
+            azure.AZURE_REQUEST_ISSUER: [('azure', remotes['azure'])],
+            'https://sp.example.com': [('custom', remotes['custom'])],
+        })
+
+    def test_cached_per_dict(self):
+        remotes = make_remotes(3, SALESFORCE_CONFIG, GOOGLE_APPS_CONFIG)
+
+        index = registry.get_remotes_index(remotes)
+        self.assertIs(registry.get_remotes_index(remotes), index)
+        self.assertIsNot(registry.get_remotes_index(dict(remotes)), index)
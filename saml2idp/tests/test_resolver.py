@@ -0,0 +1,84 @@
+"""
+Tests for resolving dotted paths to functions.
+"""
+from unittest import mock
+
+from django.apps import apps
+from django.test import TestCase, override_settings
+
+from saml2idp import resolver, saml2idp_metadata
+from saml2idp.base import Processor
+
+FUNCTION = 'saml2idp.tests.test_resolver.get_subject'
+MISSING = 'saml2idp.tests.test_resolver.does_not_exist'
+
+
+def get_subject(django_request):
+    return 'subject'
+
+
+class TestResolve(TestCase):
+
+    def setUp(self):
+        resolver.clear()
+        self.import_module = mock.patch.object(
+            resolver, 'import_module', wraps=resolver.import_module).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        resolver.clear()
+
+    def test_callable(self):
+        self.assertIs(resolver.resolve(get_subject), get_subject)
+        self.assertIsNone(resolver.resolve(None))
+        self.assertFalse(self.import_module.called)
+
+    def test_dotted_path_cached(self):
+        self.assertIs(resolver.resolve(FUNCTION), get_subject)
+        self.assertIs(resolver.resolve(FUNCTION), get_subject)
+        self.assertEqual(self.import_module.call_count, 1)
+
+    def test_failure_cached(self):
+        with self.assertLogs('saml2idp.resolver', 'WARNING') as logs:
+            self.assertIsNone(resolver.resolve(MISSING))
+            self.assertIsNone(resolver.resolve(MISSING))
+        self.assertEqual(self.import_module.call_count, 1)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('AttributeError', logs.output[0])
+
+    def test_failure_retried(self):
+        with self.assertLogs('saml2idp.resolver', 'WARNING'):
+            resolver.resolve('saml2idp.no_such_module.function')
+        with mock.patch('saml2idp.cache.time.time',
+                        return_value=2 ** 40), \
+                self.assertLogs('saml2idp.resolver', 'WARNING'):
+            resolver.resolve('saml2idp.no_such_module.function')
+        self.assertEqual(self.import_module.call_count, 2)
+
+    def test_shared(self):
+        self.assertIs(Processor()._import_function_from_str(FUNCTION),
+                      get_subject)
+        self.assertIs(saml2idp_metadata.import_function_from_str(FUNCTION),
+                      get_subject)
+        self.assertEqual(self.import_module.call_count, 1)
+
+    def test_warm_up(self):
+        remotes = {
+            'ok': {'subject_function': FUNCTION},
+            'broken': {'attribute_function': MISSING,
+                       'subject_function': get_subject},
+            'bulk': {'attributes_function': MISSING + '_bulk'},
+            'sources': {'attribute_sources': [
+                {'function': FUNCTION}, {'function': MISSING + '_source'}]},
+        }
+        with self.assertLogs('saml2idp.resolver', 'WARNING'):
+            self.assertEqual(resolver.warm_up(remotes), [
+                MISSING, MISSING + '_bulk', MISSING + '_source'])
+        resolver.resolve(FUNCTION)
+        resolver.resolve(MISSING)
+        self.assertEqual(self.import_module.call_count, 4)
+
+    @override_settings(SAML2IDP_REMOTES={'ok': {'subject_function': FUNCTION}})
+    def test_app_ready(self):
+        apps.get_app_config('saml2idp').ready()
+        self.assertIn(FUNCTION, resolver._functions)
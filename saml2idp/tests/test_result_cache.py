@@ -0,0 +1,156 @@
+"""
+Tests for the per-user subject and attribute result cache.
+"""
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.test import RequestFactory, TestCase, override_settings
+
+from . import base, override_settings_file
+from .test_azure import REQUEST_DATA, get_user_subject
+
+from saml2idp import result_cache
+from saml2idp.azure import AZURE_ACS_URL
+
+LOCAL = {'ttl': 60, 'max_entries': 100}
+DJANGO_CACHE = {'cache': 'result_cache', 'ttl': 60}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'result_cache': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'saml2idp-result-cache-tests',
+    },
+}
+
+subject_calls = []
+
+
+def get_counted_subject(django_request):
+    subject_calls.append(django_request.user.pk)
+    return get_user_subject(django_request)
+
+
+@override_settings(SAML2IDP_RESULT_CACHE=LOCAL)
+class TestGetOrCall(TestCase):
+
+    def setUp(self):
+        result_cache.clear()
+        self.user = User.objects.create_user('fred', 'fred@example.com')
+        self.func = mock.Mock(return_value='value')
+
+    def get_result(self, remote_name='sp', sp_config=None, user=None,
+                   name=result_cache.SUBJECT):
+        request = RequestFactory().get('/')
+        request.user = user or self.user
+        return result_cache.get_or_call(
+            request, remote_name, sp_config, name, self.func, 'argument')
+
+    def test_cached(self):
+        self.assertEqual(self.get_result(), 'value')
+        self.assertEqual(self.get_result(), 'value')
+        self.func.assert_called_once_with('argument')
+
+    def test_keyed_by_user_remote_and_name(self):
+        other = User.objects.create_user('barney', 'barney@example.com')
+        self.get_result()
+        self.get_result(user=other)
+        self.get_result(remote_name='other')
+        self.get_result(name=result_cache.ATTRIBUTE % 'IDPEmail')
+        self.assertEqual(self.func.call_count, 4)
+
+    def test_none_cached(self):
+        self.func.return_value = None
+        self.assertIsNone(self.get_result())
+        self.assertIsNone(self.get_result())
+        self.assertEqual(self.func.call_count, 1)
+
+    def test_anonymous_not_cached(self):
+        self.get_result(user=AnonymousUser())
+        self.get_result(user=AnonymousUser())
+        self.assertEqual(self.func.call_count, 2)
+
+    def test_remote_ttl(self):
+        self.get_result(sp_config={'result_cache_ttl': 0})
+        self.get_result(sp_config={'result_cache_ttl': 0})
+        self.assertEqual(self.func.call_count, 2)
+
+        self.get_result(sp_config={'result_cache_ttl': 10})
+        with mock.patch('saml2idp.cache.time.time', return_value=2 ** 40):
+            self.get_result(sp_config={'result_cache_ttl': 10})
+        self.assertEqual(self.func.call_count, 4)
+
+    def test_invalidate(self):
+        self.get_result()
+        result_cache.invalidate(self.user)
+        self.get_result()
+        self.assertEqual(self.func.call_count, 2)
+
+    def test_many(self):
+        bulk = mock.Mock(side_effect=lambda request, names: {
+            name: name.upper() for name in names if name != 'missing'})
+        request = RequestFactory().get('/')
+        request.user = self.user
+
+        self.assertEqual(
+            result_cache.get_or_call_many(request, 'sp', None, ['a'], bulk),
+            {'a': 'A'})
+        self.assertEqual(
+            result_cache.get_or_call_many(
+                request, 'sp', None, ['a', 'b', 'missing'], bulk),
+            {'a': 'A', 'b': 'B'})
+        self.assertEqual(
+            result_cache.get_or_call_many(request, 'sp', None, ['a', 'b'],
+                                          bulk),
+            {'a': 'A', 'b': 'B'})
+        self.assertEqual([call[0][1] for call in bulk.call_args_list],
+                         [['a'], ['b', 'missing']])
+
+    @override_settings(SAML2IDP_RESULT_CACHE=None)
+    def test_disabled(self):
+        self.get_result()
+        self.get_result()
+        self.assertEqual(self.func.call_count, 2)
+
+    @override_settings(CACHES=CACHES, SAML2IDP_RESULT_CACHE=DJANGO_CACHE)
+    def test_django_cache(self):
+        caches['result_cache'].clear()
+        self.get_result()
+        self.get_result()
+        result_cache.invalidate(self.user)
+        self.get_result()
+        self.assertEqual(self.func.call_count, 2)
+
+    @override_settings(CACHES=CACHES, SAML2IDP_RESULT_CACHE=DJANGO_CACHE)
+    def test_cache_errors(self):
+        with mock.patch('django.core.cache.backends.locmem.LocMemCache.get',
+                        side_effect=IOError('down')), \
+                self.assertLogs('saml2idp.result_cache', 'WARNING'):
+            self.assertEqual(self.get_result(), 'value')
+
+
+@override_settings_file
+@override_settings(SAML2IDP_RESULT_CACHE=LOCAL)
+class TestAzureResultCache(base.SamlTestCase):
+    SP_CONFIG = {
+        'acs_url': AZURE_ACS_URL,
+        'processor': 'saml2idp.azure.Processor',
+        'subject_function': get_counted_subject,
+    }
+
+    def setUp(self):
+        super(TestAzureResultCache, self).setUp()
+        result_cache.clear()
+        del subject_calls[:]
+
+    def test_subject_cached_until_logout(self):
+        self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+        self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+        self.assertEqual(subject_calls, [self.fred.pk])
+        self.assertIn(get_user_subject(None), self._saml)
+
+        self.client.get(self.logout_url)
+        self._hit_saml_view(self.login_url, data=REQUEST_DATA)
+        self.assertEqual(subject_calls, [self.fred.pk, self.fred.pk])
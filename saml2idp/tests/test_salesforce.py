@@ -86,6 +86,30 @@ class TestSalesForceProcessor:
     }
     REQUEST_DATA = REQUEST_DATA
 
+    def tearDown(self):
+        self.SP_CONFIG.pop('sign', None)
+        super(TestSalesForceProcessor, self).tearDown()
+
+    def _count_signatures(self, sign):
+        self.SP_CONFIG['sign'] = sign
+        self._hit_saml_view(self.login_url, data=self.REQUEST_DATA)
+        assertion = self._saml[self._saml.index('<saml:Assertion'):]
+        return (self._saml.count('<ds:Signature '),
+                assertion.count('<ds:Signature '))
+
+    def test_sign_default(self):
+        # SAML2IDP_CONFIG['signing'] is on in the test settings.
+        self.assertEqual(self._count_signatures(None), (2, 1))
+
+    def test_sign_assertion(self):
+        self.assertEqual(self._count_signatures('assertion'), (1, 1))
+
+    def test_sign_response(self):
+        self.assertEqual(self._count_signatures('response'), (1, 0))
+
+    def test_sign_none(self):
+        self.assertEqual(self._count_signatures('none'), (0, 0))
+
 
 @override_settings_file
 class TestSalesForceProcessorWithFile(
@@ -1,11 +1,26 @@
+import codecs
+import os
+import re
+import shutil
 import string
-
+import tempfile
+from unittest import mock
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding
+from cryptography.hazmat.primitives.asymmetric.utils import (
+    encode_dss_signature)
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 
-from . import override_settings_file, override_settings_str
+from . import (
+    config_with_file, config_with_str, private_key_file,
+    override_settings_file, override_settings_str)
 
-from saml2idp import xml_render
+from saml2idp import base, signers, xml_render, xml_signing
 from saml2idp.xml_signing import get_signature_xml
 from saml2idp.xml_templates import ASSERTION_SALESFORCE, RESPONSE
 
@@ -178,3 +193,192 @@ class TestResponseWithFile(TestSigning, XmlTest):
 @override_settings_str
 class TestResponseWithStr(TestSigning, XmlTest):
     pass
+
+
+class TestKeyCache(TestCase):
+
+    def setUp(self):
+        xml_signing.clear_key_cache()
+
+    def tearDown(self):
+        xml_signing.clear_key_cache()
+
+    def test_private_key_str_cached(self):
+        key = xml_signing.load_private_key(config_with_str)
+
+        self.assertIs(key, xml_signing.load_private_key(config_with_str))
+        stats = xml_signing.get_key_cache_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_certificate_file_cached(self):
+        cert = xml_signing.load_certificate_data(config_with_file)
+
+        self.assertEqual(
+            cert, xml_signing.load_certificate_data(config_with_file))
+        self.assertEqual(
+            cert, xml_signing.load_certificate_data(config_with_str))
+        stats = xml_signing.get_key_cache_stats()
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_file_change_invalidates(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        key_file = os.path.join(tmp_dir, 'private-key.pem')
+        shutil.copy(private_key_file, key_file)
+        config = {'private_key_file': key_file}
+
+        first = xml_signing.load_private_key(config)
+        self.assertIs(first, xml_signing.load_private_key(config))
+
+        # Replace the file, as a key rotation would.
+        os.remove(key_file)
+        shutil.copy(private_key_file, key_file)
+        stat = os.stat(key_file)
+        os.utime(key_file, (stat.st_atime, stat.st_mtime + 10))
+
+        self.assertIsNot(first, xml_signing.load_private_key(config))
+        self.assertEqual(xml_signing.get_key_cache_stats()['misses'], 2)
+
+    def test_bounded(self):
+        cache = xml_signing.key_cache
+        for i in range(cache.max_entries + 5):
+            xml_signing.load_certificate_data(
+                {'certificate_str': '-----\n%d\n-----\n' % i})
+
+        stats = xml_signing.get_key_cache_stats()
+        self.assertEqual(stats['size'], cache.max_entries)
+        self.assertEqual(stats['evictions'], 5)
+
+
+class TestRenderSignable(TestCase):
+    """
+    The signature is spliced in where the placeholder is, wherever it is.
+    """
+    SIGNATURE = '<ds:Signature>$$</ds:Signature>'
+
+    TEMPLATES = (
+        '${SIG}<a ID="${ID}">${X}</a>',
+        '<a ID="${ID}">${X}</a>${SIG}',
+        '<a ID="${ID}">${X}${SIG}${X}</a>',
+        '<a ID="${ID}">$SIG<b>${X}</b></a>',
+        '<a ID="${ID}" c="$${SIG}">$$${SIG}${X}</a>',
+    )
+
+    def test_placeholder_positions(self):
+        # Parameter values holding placeholders are not expanded.
+        params = {'ID': 'id1', 'X': '${SIG}', 'SIG': ''}
+        for source in self.TEMPLATES:
+            expected_unsigned = string.Template(source).substitute(params)
+            expected = string.Template(source).substitute(
+                params, SIG=self.SIGNATURE)
+
+            with mock.patch('saml2idp.xml_render.get_signature_xml',
+                            return_value=self.SIGNATURE) as sign:
+                got = xml_render._render_signable(
+                    config_with_str, source, dict(params), 'SIG', 'id1',
+                    True)
+            self.assertEqual(got, expected, source)
+            sign.assert_called_once_with(config_with_str, expected_unsigned,
+                                         'id1')
+
+            self.assertEqual(
+                xml_render._render_signable(config_with_str, source,
+                                            dict(params), 'SIG', 'id1',
+                                            False),
+                expected_unsigned, source)
+
+    def test_placeholder_once(self):
+        for source in ('<a/>', '${SIG}${SIG}', '$${SIG}'):
+            with self.assertRaises(ValueError):
+                xml_render._render_signable(config_with_str, source, {},
+                                            'SIG', 'id1', True)
+
+
+class TestSigners(TestCase):
+
+    def _parse_signature(self, signature_xml):
+        signed_info = re.search(
+            '<ds:SignedInfo>.*</ds:SignedInfo>', signature_xml).group(0)
+        # The signature is computed over SignedInfo with its namespace.
+        signed_info = signed_info.replace(
+            '<ds:SignedInfo>',
+            '<ds:SignedInfo xmlns:ds="http://www.w3.org/2000/09/xmldsig#">')
+        value = re.search('<ds:SignatureValue>(.*)</ds:SignatureValue>',
+                          signature_xml).group(1)
+        return signed_info.encode(), codecs.decode(value.encode(), 'base64')
+
+    def test_default_is_rsa_sha1(self):
+        signer = signers.get_signer(config_with_str)
+
+        self.assertIsInstance(signer, signers.PyOpenSSLSigner)
+
+    def test_rsa_sha256(self):
+        config = dict(config_with_str, signing_algorithm='rsa-sha256')
+
+        signature_xml = get_signature_xml(config, 'this is a test', 'abcd')
+
+        self.assertIn(
+            'Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"',
+            signature_xml)
+        self.assertIn(
+            'Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"',
+            signature_xml)
+        signed_info, value = self._parse_signature(signature_xml)
+        certificate = x509.load_pem_x509_certificate(
+            config['certificate_str'].encode(), default_backend())
+        # Raises InvalidSignature on failure.
+        certificate.public_key().verify(
+            value, signed_info, padding.PKCS1v15(), hashes.SHA256())
+
+    def test_ecdsa_sha256(self):
+        private_key = ec.generate_private_key(ec.SECP256R1(),
+                                              default_backend())
+        config = dict(config_with_str, signing_algorithm='ecdsa-sha256')
+        config['private_key_str'] = private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()).decode()
+
+        signature_xml = get_signature_xml(config, 'this is a test', 'abcd')
+
+        self.assertIn(
+            'Algorithm="http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha256"',
+            signature_xml)
+        signed_info, value = self._parse_signature(signature_xml)
+        self.assertEqual(len(value), 64)
+        der = encode_dss_signature(int.from_bytes(value[:32], 'big'),
+                                   int.from_bytes(value[32:], 'big'))
+        private_key.public_key().verify(
+            der, signed_info, ec.ECDSA(hashes.SHA256()))
+
+    def test_unknown_algorithm(self):
+        config = dict(config_with_str, signing_algorithm='rot13')
+
+        with self.assertRaises(ImproperlyConfigured):
+            signers.get_signer(config)
+
+    def test_sp_config_overrides(self):
+        proc = base.Processor()
+        proc._saml2idp_config = config_with_str
+        proc._sp_config = {
+            'signing_algorithm': 'rsa-sha512',
+            'private_key_file': private_key_file,
+        }
+
+        config = proc._get_signing_config()
+
+        self.assertEqual(config['signing_algorithm'], 'rsa-sha512')
+        self.assertEqual(config['private_key_file'], private_key_file)
+        self.assertNotIn('private_key_str', config)
+        self.assertEqual(config['certificate_str'],
+                         config_with_str['certificate_str'])
+        self.assertNotIn('signing_algorithm', config_with_str)
+
+    def test_no_sp_overrides(self):
+        proc = base.Processor()
+        proc._saml2idp_config = config_with_str
+        proc._sp_config = {'acs_url': 'https://example.com/acs'}
+
+        self.assertIs(proc._get_signing_config(), config_with_str)
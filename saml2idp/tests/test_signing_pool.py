@@ -0,0 +1,78 @@
+"""
+Tests for the optional signing thread pool.
+"""
+import threading
+
+from django.test import TestCase, override_settings
+
+from . import config_with_str
+
+from saml2idp import signing_pool, xml_signing
+from saml2idp.exceptions import CannotHandleAssertion
+
+
+class BlockingSigner(object):
+    """
+    Signer stand-in that blocks until released.
+    """
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def sign(self, private_key, data):
+        self.started.set()
+        self.release.wait(5)
+        return b'signature'
+
+
+class TestSigningPool(TestCase):
+
+    def tearDown(self):
+        signing_pool.reset_pool()
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(signing_pool.get_pool())
+
+    def test_signature_unchanged(self):
+        expected = xml_signing.get_signature_xml(
+            config_with_str, 'this is a test', 'abcd')
+
+        with override_settings(SAML2IDP_SIGNING_POOL={'workers': 2}):
+            self.assertEqual(
+                expected, xml_signing.get_signature_xml(
+                    config_with_str, 'this is a test', 'abcd'))
+
+        stats = signing_pool.get_pool().stats()
+        self.assertEqual(stats['submitted'], 1)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_overloaded(self):
+        pool = signing_pool.SigningPool(workers=1, max_pending=1)
+        self.addCleanup(pool.shutdown)
+        signer = BlockingSigner()
+
+        thread = threading.Thread(target=pool.sign,
+                                  args=(signer, None, b'data'))
+        thread.start()
+        signer.started.wait(5)
+
+        with self.assertRaises(CannotHandleAssertion):
+            pool.sign(signer, None, b'data')
+
+        signer.release.set()
+        thread.join(5)
+        stats = pool.stats()
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['completed'], 1)
+
+    def test_timeout(self):
+        pool = signing_pool.SigningPool(workers=1, timeout=0.01)
+        self.addCleanup(pool.shutdown)
+        signer = BlockingSigner()
+        self.addCleanup(signer.release.set)
+
+        with self.assertRaises(CannotHandleAssertion):
+            pool.sign(signer, None, b'data')
+
+        self.assertEqual(pool.stats()['timeouts'], 1)
@@ -0,0 +1,124 @@
+"""
+Tests for the precompiled XML templates.
+"""
+import string
+
+from django.test import TestCase
+
+from . import config_with_str
+from .test_signing import (
+    ASSERTION_SALESFORCE_PARAMS, IDP_PARAMS, REQUEST_PARAMS, RESPONSE_PARAMS)
+
+from saml2idp import xml_render, xml_templates
+from saml2idp.templating import CompiledTemplate
+from saml2idp.xml_signing import get_signature_xml
+
+ASSERTIONS = {
+    'ASSERTION_AZURE': xml_render.get_assertion_azure_xml,
+    'ASSERTION_GOOGLE_APPS': xml_render.get_assertion_googleapps_xml,
+    'ASSERTION_SALESFORCE': xml_render.get_assertion_salesforce_xml,
+    'ASSERTION_ZENDESK': xml_render.get_assertion_zendesk_xml,
+}
+
+
+def render_reference(template, params, placeholder, reference_uri, signed):
+    """
+    The string.Template based renderer the compiled templates replace.
+    """
+    template = string.Template(template)
+    params[placeholder] = ''
+    unsigned = template.substitute(params)
+    if not signed:
+        return unsigned
+    params[placeholder] = get_signature_xml(
+        config_with_str, unsigned, reference_uri)
+    return template.substitute(params)
+
+
+def get_assertion_params():
+    params = {}
+    params.update(IDP_PARAMS)
+    params.update(REQUEST_PARAMS)
+    params.update(ASSERTION_SALESFORCE_PARAMS)
+    params['ATTRIBUTES'] = {
+        'attr%d' % i: 'value %d' % i for i in range(5)}
+    return params
+
+
+class TestCompiledTemplate(TestCase):
+
+    def test_all_templates_identical(self):
+        for name in dir(xml_templates):
+            source = getattr(xml_templates, name)
+            if not name.isupper() or not isinstance(source, str):
+                continue
+            compiled = CompiledTemplate(source)
+            params = {key: '<%s>' % key.lower() for key in compiled.names}
+
+            self.assertEqual(
+                string.Template(source).substitute(params),
+                compiled.substitute(params), name)
+
+    def test_escape_and_identifiers(self):
+        source = '$$a ${b}c $d_e $$$f'
+        params = {'b': 1, 'd_e': 'x', 'f': None}
+
+        self.assertEqual(string.Template(source).substitute(params),
+                         CompiledTemplate(source).substitute(params))
+
+    def test_missing_key(self):
+        with self.assertRaises(KeyError):
+            CompiledTemplate('${a}${b}').substitute({'a': 1})
+
+    def test_invalid_placeholder(self):
+        with self.assertRaises(ValueError):
+            CompiledTemplate('a $ b')
+
+    def test_split(self):
+        head, tail = CompiledTemplate('<a>${X}${SIG}${Y}</a>').split('SIG')
+
+        self.assertEqual(head.substitute({'X': 1}), '<a>1')
+        self.assertEqual(tail.substitute({'Y': 2}), '2</a>')
+
+    def test_split_placeholder_once(self):
+        for source in ('<a/>', '${SIG}${SIG}', '$${SIG}'):
+            with self.assertRaises(ValueError):
+                CompiledTemplate(source).split('SIG')
+
+
+class TestRenderIdentical(TestCase):
+    """
+    xml_render output must stay byte-identical to string.Template output.
+    """
+    def _reference_assertion(self, name, signed):
+        params = get_assertion_params()
+        xml_render._get_in_response_to(params)
+        xml_render._get_subject(params)
+        xml_render._get_attribute_statement(params)
+        return render_reference(
+            getattr(xml_templates, name), params, 'ASSERTION_SIGNATURE',
+            params['ASSERTION_ID'], signed)
+
+    def test_assertions(self):
+        for name, render in sorted(ASSERTIONS.items()):
+            for signed in (False, True):
+                got = render(config_with_str, get_assertion_params(), signed)
+                self.assertEqual(
+                    self._reference_assertion(name, signed), got, name)
+
+    def test_response(self):
+        assertion = self._reference_assertion('ASSERTION_SALESFORCE', True)
+        for signed in (False, True):
+            params = {}
+            params.update(IDP_PARAMS)
+            params.update(REQUEST_PARAMS)
+            params.update(RESPONSE_PARAMS)
+            params['ASSERTION'] = assertion
+
+            got = xml_render.get_response_xml(
+                config_with_str, dict(params), signed)
+            xml_render._get_in_response_to(params)
+            exp = render_reference(
+                xml_templates.RESPONSE, params, 'RESPONSE_SIGNATURE',
+                params['RESPONSE_ID'], signed)
+            self.assertEqual(exp, got)
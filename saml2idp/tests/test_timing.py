@@ -0,0 +1,98 @@
+"""
+Tests for the Processor stage timers.
+"""
+import logging
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+
+from saml2idp import timing
+from saml2idp.salesforce import Processor
+
+from . import config_with_file, test_salesforce
+
+sink = mock.Mock()
+
+
+class TestStageTimings(TestCase):
+
+    def setUp(self):
+        sink.reset_mock()
+        User.objects.create_user('fred', email='fred@example.com',
+                                 password='secret')
+        self.client.login(username='fred', password='secret')
+
+        remotes = {'salesforce': {
+            'acs_url': test_salesforce.SALESFORCE_ACS,
+            'processor': 'saml2idp.salesforce.Processor',
+        }}
+        patcher = mock.patch(
+            'saml2idp.saml2idp_metadata.get_metadata_config',
+            return_value=(config_with_file, remotes))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self):
+        response = self.client.get(reverse('idp_login_begin'),
+                                   data=test_salesforce.REQUEST_DATA)
+        self.assertContains(response, 'SAMLResponse')
+
+    def test_null_sink(self):
+        self.assertIsNone(timing.get_sink())
+        with mock.patch.object(Processor, '_flush_timings',
+                               autospec=True) as flush:
+            self.login()
+        processor = flush.call_args[0][0]
+        # Nothing was recorded.
+        self.assertIsNone(processor._timings)
+
+    @override_settings(SAML2IDP_TIMING_SINK='saml2idp.tests.test_timing.sink')
+    def test_sink(self):
+        self.login()
+
+        sink.assert_called_once_with('salesforce', mock.ANY)
+        remote_name, timings = sink.call_args[0]
+        self.assertEqual([stage for stage, seconds in timings], [
+            'decode_request', 'parse_request', 'validate_request',
+            'validate_user', 'determine_subject', 'get_attributes',
+            'format_assertion', 'format_response', 'encode_response'])
+        self.assertTrue(all(seconds >= 0 for stage, seconds in timings))
+
+    @override_settings(SAML2IDP_TIMING_SINK='stats')
+    def test_stats(self):
+        timing.stats.reset()
+        self.login()
+        self.login()
+
+        stats = timing.stats.snapshot()
+        self.assertEqual(stats[('salesforce', 'format_assertion')]['count'],
+                         2)
+        entry = stats[('salesforce', 'decode_request')]
+        self.assertGreaterEqual(entry['total'], entry['max'])
+
+    @override_settings(SAML2IDP_TIMING_SINK='logging')
+    def test_logging(self):
+        with self.assertLogs('saml2idp.timing', logging.INFO) as logs:
+            self.login()
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('salesforce decode_request=', logs.output[0])
+
+    @override_settings(SAML2IDP_TIMING_SINK='signal')
+    def test_signal(self):
+        receiver = mock.Mock()
+        timing.stage_timings.connect(receiver)
+        self.addCleanup(timing.stage_timings.disconnect, receiver)
+
+        self.login()
+
+        self.assertEqual(receiver.call_count, 1)
+        self.assertEqual(receiver.call_args[1]['remote_name'], 'salesforce')
+
+    @override_settings(SAML2IDP_TIMING_SINK='no.such.sink')
+    def test_bad_sink(self):
+        with self.assertRaises(ImproperlyConfigured):
+            timing.get_sink()
@@ -5,13 +5,20 @@ NOTE: These classes do not test anything SAML-related.
 Testing actual SAML functionality requires implementation-specific details,
 which should be put in another test module.
 """
+import time
+from unittest import mock
+
 from django.contrib.auth.models import User
 from django.http import HttpResponseRedirect
 from django.core.urlresolvers import reverse
 
 from django.conf import settings
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
+
+from saml2idp import exceptions, request_token, views
+
+from . import config_with_file, test_salesforce
 
 
 SAML_REQUEST = 'this is not a real SAML Request'
@@ -119,6 +126,128 @@ class TestLoginProcessView(ViewTestCase):
         response = self.client.get(self.login_process_url)
         self.assertEqual(response.status_code, 403)
 
+    def test_process_no_pending_request(self):
+        """
+        Logged in, but without a pending request: forbidden, not an error.
+        """
+        User.objects.create_user('fred',
+                                 email='fred@example.com',
+                                 password='secret')
+        self.client.login(username='fred', password='secret')
+
+        with self.assertLogs('saml2idp', 'ERROR'):
+            response = self.client.get(self.login_process_url)
+        self.assertEqual(response.status_code, 403)
+
+    def _process_failing(self, exception):
+        User.objects.create_user('fred',
+                                 email='fred@example.com',
+                                 password='secret')
+        self.client.login(username='fred', password='secret')
+        proc = mock.Mock()
+        proc.generate_response.side_effect = exception
+        with mock.patch('saml2idp.registry.find_processor',
+                        return_value=proc), \
+                self.assertLogs('saml2idp', 'ERROR'):
+            return self.client.get(self.login_process_url)
+
+    def test_process_temporarily_unavailable(self):
+        response = self._process_failing(
+            exceptions.TemporarilyUnavailable('Signing pool is overloaded.'))
+        self.assertEqual(response.status_code, 503)
+
+    def test_process_cannot_handle(self):
+        response = self._process_failing(
+            exceptions.CannotHandleAssertion('Attribute source failed.'))
+        self.assertEqual(response.status_code, 403)
+
+
+class TestExpressLogin(ViewTestCase):
+
+    def setUp(self):
+        User.objects.create_user('fred',
+                                 email='fred@example.com',
+                                 password='secret')
+        self.client.login(username='fred', password='secret')
+
+        remotes = {'salesforce': {
+            'acs_url': test_salesforce.SALESFORCE_ACS,
+            'processor': 'saml2idp.salesforce.Processor',
+        }}
+        patcher = mock.patch(
+            'saml2idp.saml2idp_metadata.get_metadata_config',
+            return_value=(config_with_file, remotes))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_authenticated(self):
+        response = self.client.get(
+            self.login_url, data=test_salesforce.REQUEST_DATA)
+
+        self.assertContains(response, 'SAMLResponse')
+        self.assertNotIn('SAMLRequest', self.client.session)
+
+    @override_settings(SAML2IDP_EXPRESS_LOGIN=False)
+    def test_disabled(self):
+        response = self.client.get(
+            self.login_url, data=test_salesforce.REQUEST_DATA)
+
+        self.assertEqual(
+            response.status_code, HttpResponseRedirect.status_code)
+        self.assertIn('SAMLRequest', self.client.session)
+
+
+@override_settings(SAML2IDP_REQUEST_TOKEN={'max_age': 60})
+class TestRequestToken(ViewTestCase):
+
+    def login(self):
+        User.objects.create_user('fred',
+                                 email='fred@example.com',
+                                 password='secret')
+        self.client.login(username='fred', password='secret')
+
+    def test_begin_does_not_use_session(self):
+        response = self.client.get(self.login_url, data=REQUEST_DATA)
+
+        self.assertEqual(
+            response.status_code, HttpResponseRedirect.status_code)
+        self.assertIn(self.login_process_url + '?token=',
+                      response['location'])
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+
+    def test_round_trip(self):
+        remotes = {'salesforce': {
+            'acs_url': test_salesforce.SALESFORCE_ACS,
+            'processor': 'saml2idp.salesforce.Processor',
+        }}
+        response = self.client.get(
+            self.login_url, data=test_salesforce.REQUEST_DATA)
+        self.login()
+
+        with mock.patch('saml2idp.saml2idp_metadata.get_metadata_config',
+                        return_value=(config_with_file, remotes)):
+            response = self.client.get(response['location'])
+
+        self.assertContains(response, 'SAMLResponse')
+        self.assertNotIn('SAMLRequest', self.client.session)
+
+    def test_tampered_token(self):
+        self.login()
+        token = request_token.dumps(SAML_REQUEST, RELAY_STATE)
+
+        response = self.client.get(self.login_process_url,
+                                   data={'token': token + 'x'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_expired_token(self):
+        self.login()
+        with mock.patch('time.time', return_value=time.time() - 61):
+            token = request_token.dumps(SAML_REQUEST, RELAY_STATE)
+
+        response = self.client.get(self.login_process_url,
+                                   data={'token': token})
+        self.assertEqual(response.status_code, 403)
+
 
 class TestLogoutView(ViewTestCase):
     def test_logout(self):
@@ -157,3 +286,78 @@ class TestLogoutView(ViewTestCase):
             response.charset))
 
         self.assertEqual(response.status_code, 302)
+
+
+@override_settings(SAML2IDP_CONFIG=config_with_file)
+class TestDescriptorView(ViewTestCase):
+
+    def setUp(self):
+        views._descriptors.clear()
+
+    @property
+    def metadata_url(self):
+        return reverse('idp_metadata')
+
+    def test_descriptor(self):
+        response = self.client.get(self.metadata_url)
+
+        self.assertContains(response, 'entityID="%s"'
+                            % config_with_file['issuer'])
+        self.assertContains(response, 'http://testserver' + self.login_url)
+        self.assertContains(response, 'http://testserver' + self.logout_url)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+
+    def test_cached(self):
+        self.client.get(self.metadata_url)
+        with mock.patch.object(views, 'render_to_string') as render:
+            response = self.client.get(self.metadata_url)
+
+        self.assertFalse(render.called)
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_none_match(self):
+        etag = self.client.get(self.metadata_url)['ETag']
+
+        response = self.client.get(self.metadata_url,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(self.metadata_url,
+                                   HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get(self.metadata_url)['Last-Modified']
+
+        response = self.client.get(self.metadata_url,
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_config_change(self):
+        etag = self.client.get(self.metadata_url)['ETag']
+
+        config = dict(config_with_file, issuer='http://other.example.com')
+        with override_settings(SAML2IDP_CONFIG=config):
+            response = self.client.get(self.metadata_url,
+                                       HTTP_IF_NONE_MATCH=etag)
+
+        self.assertContains(response, 'entityID="http://other.example.com"')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_remotes_change(self):
+        response = self.client.get(self.metadata_url)
+
+        remotes = {'salesforce': {
+            'acs_url': test_salesforce.SALESFORCE_ACS,
+            'processor': 'saml2idp.salesforce.Processor',
+        }}
+        with override_settings(SAML2IDP_REMOTES=remotes), \
+                mock.patch.object(views, 'render_to_string') as render:
+            cached = self.client.get(self.metadata_url)
+
+        self.assertFalse(render.called)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(cached['Last-Modified'], response['Last-Modified'])
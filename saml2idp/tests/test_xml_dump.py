@@ -0,0 +1,36 @@
+"""
+Tests for the sampled XML dump logger.
+"""
+import logging
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from saml2idp import xml_dump, xml_signing
+
+from . import config_with_file
+
+
+class TestXMLDump(TestCase):
+
+    def test_disabled_by_default(self):
+        with mock.patch.object(xml_dump.logger, 'debug') as debug:
+            xml_signing.get_signature_xml(config_with_file, '<x/>', 'id')
+        self.assertFalse(debug.called)
+
+    def test_dump(self):
+        with self.assertLogs('saml2idp.xml', logging.DEBUG) as logs:
+            xml_signing.get_signature_xml(config_with_file, '<x/>', 'id')
+
+        self.assertEqual(len(logs.records), 3)
+        self.assertIn('<x/>', logs.output[0])
+
+    @override_settings(SAML2IDP_XML_DUMP_SAMPLE_RATE=0.5)
+    def test_sample_rate(self):
+        with self.assertLogs('saml2idp.xml', logging.DEBUG) as logs, \
+                mock.patch('random.random', side_effect=[0.7, 0.2]):
+            xml_dump.dump('Skipped', '<a/>')
+            xml_dump.dump('Sampled', '<b/>')
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('<b/>', logs.output[0])
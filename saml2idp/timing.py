@@ -0,0 +1,112 @@
+"""
+Stage timers for Processor.can_handle() and generate_response().
+
+Each processor records how long its stages took (decode_request,
+parse_request, determine_subject, get_attributes, format_assertion, ...)
+and hands them, with the name of the remote in SAML2IDP_REMOTES, to the
+sink selected by SAML2IDP_TIMING_SINK:
+
+    None or 'null'  nothing is recorded at all (default)
+    'logging'       one line per request on the 'saml2idp.timing' logger
+    'signal'        sends the stage_timings signal
+    'stats'         accumulates per remote and stage into timing.stats
+    dotted path     any callable sink(remote_name, timings)
+
+timings is a list of (stage, seconds) tuples, in the order the stages ran.
+The format_* stages include signing.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.dispatch import Signal
+from django.utils.importlib import import_module
+
+logger = logging.getLogger('saml2idp.timing')
+
+stage_timings = Signal(providing_args=['remote_name', 'timings'])
+
+
+class StageStats(object):
+    """
+    Thread-safe count, total and maximum duration per remote and stage.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, remote_name, timings):
+        with self._lock:
+            for stage, seconds in timings:
+                entry = self._stats.get((remote_name, stage))
+                if entry is None:
+                    entry = self._stats[(remote_name, stage)] = [0, 0.0, 0.0]
+                entry[0] += 1
+                entry[1] += seconds
+                if seconds > entry[2]:
+                    entry[2] = seconds
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self):
+        """
+        Returns {(remote_name, stage): {'count', 'total', 'max'}}.
+        """
+        with self._lock:
+            return {
+                key: {'count': count, 'total': total, 'max': maximum}
+                for key, (count, total, maximum) in self._stats.items()}
+
+
+stats = StageStats()
+
+
+def log_sink(remote_name, timings):
+    logger.info('%s %s', remote_name, ' '.join(
+        '%s=%.2fms' % (stage, seconds * 1000) for stage, seconds in timings))
+
+
+def signal_sink(remote_name, timings):
+    stage_timings.send(sender=None, remote_name=remote_name, timings=timings)
+
+
+SINKS = {
+    'null': None,
+    'logging': log_sink,
+    'signal': signal_sink,
+    'stats': stats,
+}
+
+_sinks = {}
+
+
+def get_sink():
+    """
+    Returns the SAML2IDP_TIMING_SINK callable, or None if timing is off.
+    """
+    name = getattr(settings, 'SAML2IDP_TIMING_SINK', None)
+    if name is None:
+        return None
+    if callable(name):
+        return name
+
+    try:
+        return _sinks[name]
+    except KeyError:
+        pass
+
+    if name in SINKS:
+        sink = SINKS[name]
+    else:
+        mod_str, _, func_str = name.rpartition('.')
+        try:
+            sink = getattr(import_module(mod_str), func_str)
+        except (ImportError, AttributeError, ValueError) as e:
+            raise ImproperlyConfigured(
+                'Error importing SAML2IDP_TIMING_SINK "%s": %s' % (name, e))
+
+    _sinks[name] = sink
+    return sink
@@ -1,7 +1,7 @@
 from django.conf.urls import url, patterns
 
 from saml2idp.views import descriptor, login_begin, login_init, login_process,\
-    logout
+    logout, metrics_view
 
 
 urlpatterns = patterns(
@@ -9,7 +9,9 @@ urlpatterns = patterns(
     url(r'^login/?$', login_begin, name="idp_login_begin"),
     url(r'^login/process/$', login_process, name='idp_login_process'),
     url(r'^logout/?$', logout, name="idp_logout"),
-    (r'^metadata/xml/$', descriptor),
+    url(r'^metadata/xml/$', descriptor, name='idp_metadata'),
+    # Only answers when SAML2IDP_METRICS is set:
+    url(r'^metrics/$', metrics_view, name='idp_metrics'),
     # For "simple" deeplinks:
     url(r'^init/(?P<resource>\w+)/(?P<target>\w+)/$', login_init,
         name="idp_login_init"),
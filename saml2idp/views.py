@@ -1,5 +1,10 @@
+# Python imports:
+import hashlib
+import time
+
 # Django/other library imports:
 from django.utils.log import logging
+from django.conf import settings
 from django.contrib import auth
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ImproperlyConfigured
@@ -7,37 +12,104 @@ from django.core.urlresolvers import reverse
 from django.shortcuts import render_to_response, redirect
 from django.template import RequestContext
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponseForbidden
+from django.http import (Http404, HttpResponse, HttpResponseForbidden,
+                         HttpResponseNotModified)
+from django.template.loader import render_to_string
+from django.utils.http import (http_date, parse_etags, parse_http_date_safe,
+                               quote_etag, urlencode)
+from django.core import signing
 
 # saml2idp app imports:
 from . import saml2idp_metadata
 from . import exceptions
 from . import metadata
+from . import metrics
 from . import registry
+from . import request_token
 from . import xml_signing
+from .cache import LRUCache
 
 
 logger = logging.getLogger('saml2idp')
 
+# Seconds metadata clients may cache the descriptor for.
+DESCRIPTOR_MAX_AGE = 3600
+
+# Rendered descriptors by issuer, scheme, host and certificate.
+DESCRIPTOR_CACHE_SIZE = 64
+
+_descriptors = LRUCache(max_entries=DESCRIPTOR_CACHE_SIZE)
+
 
 def _generate_response(request, processor):
     """
     Generate a SAML response using processor and return it in the proper Django
-    response.
+    response: 503 if a resource it needs is temporarily unavailable, 403 if
+    it cannot be handled at all.
     """
+    remote_name = processor._remote_name or ''
     try:
         tv = processor.generate_response()
     except exceptions.UserNotAuthorized:
+        metrics.inc('saml2idp_failures_total', remote=remote_name,
+                    exception='UserNotAuthorized')
         return render_to_response('saml2idp/invalid_user.html',
                                   context_instance=RequestContext(request))
+    except exceptions.TemporarilyUnavailable:
+        logger.exception('Cannot answer the request now!')
+        metrics.inc('saml2idp_failures_total', remote=remote_name,
+                    exception='TemporarilyUnavailable')
+        return HttpResponse(status=503)
+    except exceptions.CannotHandleAssertion:
+        logger.exception('Cannot handle the request!')
+        metrics.inc('saml2idp_failures_total', remote=remote_name,
+                    exception='CannotHandleAssertion')
+        return HttpResponseForbidden()
+
+    metrics.inc('saml2idp_logins_total', remote=remote_name)
 
     return render_to_response('saml2idp/login.html', tv,
                               context_instance=RequestContext(request))
 
 
+def _process_login(request):
+    """
+    Loads the SAML2IDP configuration, finds the processor for the pending
+    AuthnRequest and returns its response.
+    """
+    start = time.perf_counter()
+    try:
+        # Set metadata config in request session!
+        try:
+            config, remotes = saml2idp_metadata.get_metadata_config(request)
+            saml2idp_metadata.set_session_config(request, config, remotes)
+        except Exception as e:
+            logger.exception('Failed to load SAML2IDP configuration!')
+            metrics.inc('saml2idp_failures_total', remote='',
+                        exception=e.__class__.__name__)
+            return HttpResponseForbidden()
+
+        routing_start = time.perf_counter()
+        try:
+            proc = registry.find_processor(request)
+        except exceptions.CannotHandleAssertion:
+            logger.exception('No processor to handle request!')
+            metrics.inc('saml2idp_failures_total', remote='',
+                        exception='CannotHandleAssertion')
+            return HttpResponseForbidden()
+        finally:
+            metrics.observe('saml2idp_routing_seconds',
+                            time.perf_counter() - routing_start)
+
+        return _generate_response(request, proc)
+    finally:
+        metrics.observe('saml2idp_login_seconds',
+                        time.perf_counter() - start)
+
+
 def xml_response(request, template, tv, context_instance=None):
     return render_to_response(template, tv, context_instance=context_instance,
-                              mimetype="application/xml")
+                              content_type="application/xml")
 
 
 @csrf_exempt
@@ -45,6 +117,9 @@ def login_begin(request, *args, **kwargs):
     """
     Receives a SAML 2.0 AuthnRequest from a Service Provider and
     stores it in the session prior to enforcing login.
+
+    Users who are already logged in get their response right away, unless
+    SAML2IDP_EXPRESS_LOGIN is False.
     """
     if request.method == 'POST':
         source = request.POST
@@ -57,6 +132,19 @@ def login_begin(request, *args, **kwargs):
     if not saml_req or not relay_state:
         return HttpResponseForbidden()
 
+    if (request.user.is_authenticated() and
+            getattr(settings, 'SAML2IDP_EXPRESS_LOGIN', True)):
+        # No need for the redirect to login_process.
+        request_token.set_pending_request(request, saml_req, relay_state)
+        return _process_login(request)
+
+    if request_token.is_enabled():
+        # Carry the request in the URL; don't touch the session.
+        token = request_token.dumps(saml_req, relay_state)
+        return redirect('%s?%s' % (
+            reverse('idp_login_process'),
+            urlencode({request_token.TOKEN_PARAMETER: token})))
+
     request.session['SAMLRequest'] = saml_req
     request.session['RelayState'] = relay_state
 
@@ -68,7 +156,14 @@ def login_init(request, resource, **kwargs):
     """
     Initiates an IdP-initiated link to a simple SP resource/target URL.
     """
-    sp_config = metadata.get_config_for_resource(resource)
+    try:
+        config, remotes = saml2idp_metadata.get_metadata_config(request)
+        saml2idp_metadata.set_session_config(request, config, remotes)
+    except:
+        logger.exception('Failed to load SAML2IDP configuration!')
+        return HttpResponseForbidden()
+
+    sp_config = metadata.get_config_for_resource(request, resource)
     proc_path = sp_config['processor']
     proc = registry.get_processor(proc_path)
     try:
@@ -98,24 +193,15 @@ def login_process(request):
     # reg = registry.ProcessorRegistry()
     logger.debug("Request: %s" % request)
 
-    # Set metadata config in request session!
-    try:
-        config, remotes = saml2idp_metadata.get_metadata_config(request)
-        request.session['SAML2IDP'] = {
-            'SAML2IDP_CONFIG': config,
-            'SAML2IDP_REMOTES': remotes,
-        }
-    except:
-        logger.exception('Failed to load SAML2IDP configuration!')
-        return HttpResponseForbidden()
-
-    try:
-        proc = registry.find_processor(request)
-    except exceptions.CannotHandleAssertion:
-        logger.exception('No processor to handle request!')
-        return HttpResponseForbidden()
+    token = request.GET.get(request_token.TOKEN_PARAMETER)
+    if token:
+        try:
+            request_token.load(request, token)
+        except signing.BadSignature as e:
+            logger.warning('Rejected request token: %s' % e)
+            return HttpResponseForbidden()
 
-    return _generate_response(request, proc)
+    return _process_login(request)
 
 
 @csrf_exempt
@@ -126,7 +212,8 @@ def logout(request):
     though it's technically not SAML 2.0).
     """
     try:
-        saml2idp_config = request.session['SAML2IDP']['SAML2IDP_CONFIG']
+        saml2idp_config, saml2idp_remotes = (
+            saml2idp_metadata.get_session_config(request))
 
         # First, check if we are required to bypass logout.
         logout_disabled = saml2idp_config.get('logout_disabled', False)
@@ -168,7 +255,8 @@ def slo_logout(request):
     # XXX: For now, simply log out without validating the request.
 
     # check if we are required to bypass logout
-    saml2idp_config = request.session['SAML2IDP']['SAML2IDP_CONFIG']
+    saml2idp_config, saml2idp_remotes = (
+        saml2idp_metadata.get_session_config(request))
 
     logout_disabled = saml2idp_config.get('logout_disabled', False)
 
@@ -181,18 +269,71 @@ def slo_logout(request):
                               context_instance=RequestContext(request))
 
 
+def _get_descriptor(request):
+    """
+    Returns (body, etag, last_modified) of the IdP metadata for request,
+    rendering it only when the issuer, host or certificate changed. The
+    remotes are not part of the descriptor, so they are not looked at.
+    """
+    try:
+        config = saml2idp_metadata.get_session_config(request)[0]
+    except KeyError:
+        # Metadata pollers have no IdP session.
+        config = saml2idp_metadata.get_metadata_config(request)[0]
+
+    cert_public_key = xml_signing.load_certificate_data(config)
+    key = (config['issuer'], request.scheme, request.get_host(),
+           hashlib.sha1(cert_public_key.encode('utf-8')).hexdigest())
+
+    descriptor = _descriptors.get(key)
+    if descriptor is None:
+        tv = {
+            'cert_public_key': cert_public_key,
+            'entity_id': config['issuer'],
+            'slo_url': request.build_absolute_uri(reverse('idp_logout')),
+            'sso_url': request.build_absolute_uri(
+                reverse('idp_login_begin')),
+        }
+        body = render_to_string('saml2idp/idpssodescriptor.xml', tv)
+        etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        descriptor = (body, etag, int(time.time()))
+        _descriptors.set(key, descriptor)
+    return descriptor
+
+
 def descriptor(request):
     """Replies with the XML Metadata IDSSODescriptor."""
+    body, etag, last_modified = _get_descriptor(request)
 
-    config = request.session['SAML2IDP']['SAML2IDP_CONFIG']
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        not_modified = etag in parse_etags(if_none_match) or \
+            if_none_match.strip() == '*'
+    else:
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        not_modified = (if_modified_since is not None and
+                        last_modified <= if_modified_since)
 
-    tv = {
-        'cert_public_key': xml_signing.load_certificate_data(config),
-        'entity_id': config['issuer'],
-        'slo_url': request.build_absolute_uri(reverse('logout')),
-        'sso_url': request.build_absolute_uri(reverse('login_begin')),
-    }
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/xml')
+
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'public, max-age=%d' % getattr(
+        settings, 'SAML2IDP_METADATA_MAX_AGE', DESCRIPTOR_MAX_AGE)
+    return response
+
+
+def metrics_view(request):
+    """
+    Serves the SAML2IDP_METRICS of all workers in the Prometheus text
+    exposition format.
+    """
+    if not metrics.is_enabled():
+        raise Http404('SAML2IDP_METRICS is not configured.')
 
-    return xml_response(
-        request, 'saml2idp/idpssodescriptor.xml', tv,
-        context_instance=RequestContext(request))
+    return HttpResponse(metrics.collect(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,37 @@
+"""
+Optional dumps of the XML documents built while answering a request.
+
+Full documents go to the 'saml2idp.xml' logger at DEBUG level, so they can
+be switched on independently of the rest of the debug output:
+
+    LOGGING = {
+        ...
+        'loggers': {
+            'saml2idp.xml': {'level': 'DEBUG', 'handlers': [...]},
+        },
+    }
+
+On a busy IdP, SAML2IDP_XML_DUMP_SAMPLE_RATE = 0.01 dumps only about one
+document in a hundred.
+"""
+import logging
+import random
+
+from django.conf import settings
+
+logger = logging.getLogger('saml2idp.xml')
+
+
+def dump(label, xml):
+    """
+    Logs xml under label, if the 'saml2idp.xml' logger is enabled for
+    DEBUG and the document is sampled. Costs one level check otherwise.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+
+    rate = getattr(settings, 'SAML2IDP_XML_DUMP_SAMPLE_RATE', 1.0)
+    if rate < 1.0 and random.random() >= rate:
+        return
+
+    logger.debug('%s:\n%s', label, xml)
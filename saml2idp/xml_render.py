@@ -1,15 +1,18 @@
 """
 Functions for creating XML output.
 """
-import logging
-import string
-
+from . import xml_dump
+from .templating import CompiledTemplate
 from .xml_signing import get_signature_xml
 from .xml_templates import (
     ATTRIBUTE, ATTRIBUTE_STATEMENT,
     ASSERTION_GOOGLE_APPS, ASSERTION_SALESFORCE, ASSERTION_ZENDESK,
     ASSERTION_AZURE, RESPONSE, SUBJECT)
 
+_ATTRIBUTE = CompiledTemplate(ATTRIBUTE)
+_ATTRIBUTE_STATEMENT = CompiledTemplate(ATTRIBUTE_STATEMENT)
+_SUBJECT = CompiledTemplate(SUBJECT)
+
 
 def _get_attribute_statement(params):
     """
@@ -23,16 +26,14 @@ def _get_attribute_statement(params):
         params['ATTRIBUTE_STATEMENT'] = ''
         return
     # Build individual attribute list.
-    template = string.Template(ATTRIBUTE)
     attr_list = []
     for name, value in list(attributes.items()):
         subs = {'ATTRIBUTE_NAME': name, 'ATTRIBUTE_VALUE': value}
-        one = template.substitute(subs)
+        one = _ATTRIBUTE.substitute(subs)
         attr_list.append(one)
     params['ATTRIBUTES'] = ''.join(attr_list)
     # Build complete AttributeStatement.
-    stmt_template = string.Template(ATTRIBUTE_STATEMENT)
-    statement = stmt_template.substitute(params)
+    statement = _ATTRIBUTE_STATEMENT.substitute(params)
     params['ATTRIBUTE_STATEMENT'] = statement
 
 
@@ -52,13 +53,66 @@ def _get_in_response_to(params):
         params['IN_RESPONSE_TO'] = ''
 
 
+def _split_template(template, placeholder):
+    """
+    Returns the (head, tail) CompiledTemplates around placeholder.
+    """
+    key = (template, placeholder)
+    try:
+        return _split_templates[key]
+    except KeyError:
+        pass
+
+    split = CompiledTemplate(template).split(placeholder)
+    _split_templates[key] = split
+    return split
+
+
+_split_templates = {}
+
+# Compile the built-in templates at import time.
+for _template in (ASSERTION_GOOGLE_APPS, ASSERTION_SALESFORCE,
+                  ASSERTION_ZENDESK, ASSERTION_AZURE):
+    _split_template(_template, 'ASSERTION_SIGNATURE')
+_split_template(RESPONSE, 'RESPONSE_SIGNATURE')
+
+
+def _render_signable(saml2idp_config, template, params, placeholder,
+                     reference_uri, signed):
+    """
+    Renders template with an (optional) enveloped signature at placeholder.
+
+    The chunks before and after the signature are filled in once; the
+    unsigned and the signed document are each joined from them in a single
+    copy, the signed one with the signature spliced in between.
+    """
+    head_template, tail_template = _split_template(template, placeholder)
+    head = head_template.fill(params)
+    tail = tail_template.fill(params)
+
+    unsigned = ''.join(head + tail)
+    xml_dump.dump('Unsigned', unsigned)
+    if not signed:
+        return unsigned
+
+    # Sign it. The unsigned copy is dropped first, so that it is not held
+    # alongside the signed one.
+    signature_xml = get_signature_xml(saml2idp_config, unsigned,
+                                      reference_uri)
+    del unsigned
+    head.append(signature_xml)
+    signed = ''.join(head + tail)
+
+    xml_dump.dump('Signed', signed)
+    return signed
+
+
 def _get_subject(params):
     """
     Insert Subject.
     Modifies the params dict.
     """
-    template = string.Template(SUBJECT)
-    params['SUBJECT_STATEMENT'] = template.substitute(params)
+    params['SUBJECT_STATEMENT'] = _SUBJECT.substitute(params)
 
 
 def _get_assertion_xml(saml2idp_config, template, parameters, signed=False):
@@ -66,27 +120,14 @@ def _get_assertion_xml(saml2idp_config, template, parameters, signed=False):
     params = {}
     params.update(parameters)
     params['ASSERTION_SIGNATURE'] = ''
-    template = string.Template(template)
 
     _get_in_response_to(params)
     _get_subject(params)  # must come before _get_attribute_statement()
     _get_attribute_statement(params)
 
-    unsigned = template.substitute(params)
-    logging.debug('Unsigned:')
-    logging.debug(unsigned)
-    if not signed:
-        return unsigned
-
-    # Sign it.
-    signature_xml = get_signature_xml(saml2idp_config, unsigned,
-                                      params['ASSERTION_ID'])
-    params['ASSERTION_SIGNATURE'] = signature_xml
-    signed = template.substitute(params)
-
-    logging.debug('Signed:')
-    logging.debug(signed)
-    return signed
+    return _render_signable(saml2idp_config, template, params,
+                            'ASSERTION_SIGNATURE', params['ASSERTION_ID'],
+                            signed)
 
 
 def get_assertion_googleapps_xml(saml2idp_config, parameters, signed=False):
@@ -119,20 +160,6 @@ def get_response_xml(saml2idp_config, parameters, signed=False):
     params['RESPONSE_SIGNATURE'] = ''
     _get_in_response_to(params)
 
-    template = string.Template(RESPONSE)
-    unsigned = template.substitute(params)
-
-    logging.debug('Unsigned:')
-    logging.debug(unsigned)
-    if not signed:
-        return unsigned
-
-    # Sign it.
-    signature_xml = get_signature_xml(saml2idp_config, unsigned,
-                                      params['RESPONSE_ID'])
-    params['RESPONSE_SIGNATURE'] = signature_xml
-    signed = template.substitute(params)
-
-    logging.debug('Signed:')
-    logging.debug(signed)
-    return signed
+    return _render_signable(saml2idp_config, RESPONSE, params,
+                            'RESPONSE_SIGNATURE', params['RESPONSE_ID'],
+                            signed)
@@ -1,83 +1,146 @@
 import hashlib
 import logging
-import string
-
-import OpenSSL
+import os
+import time
 
+from . import metrics
+from . import xml_dump
+from .cache import LRUCache
 from .codex import nice64
+from .signers import get_signer
+from .signing_pool import get_pool
+from .templating import CompiledTemplate
 from .xml_templates import SIGNED_INFO, SIGNATURE
 
+logger = logging.getLogger('saml2idp')
 
-def load_certificate_data(config):
-    certificate_str = config.get('certificate_str')
+_SIGNED_INFO = CompiledTemplate(SIGNED_INFO)
+_SIGNATURE = CompiledTemplate(SIGNATURE)
+
+# Parsed key material, shared by all requests in this process. Entries are
+# keyed by file identity (path, inode, mtime, size) or by a hash of the PEM
+# string, so a replaced key or certificate file is picked up automatically.
+KEY_CACHE_SIZE = 64
+
+key_cache = LRUCache(max_entries=KEY_CACHE_SIZE)
+
+
+def _get_cached(config, str_key, file_key, kind, parse):
+    """
+    Returns parse(pem_data) for the PEM found in config[str_key] or in the
+    file at config[file_key], caching the result in key_cache.
+    """
+    pem_str = config.get(str_key)
+
+    if pem_str is None:
+        pem_file = config[file_key]
+        stat = os.stat(pem_file)
+        cache_key = (kind, 'file', pem_file, stat.st_ino, stat.st_mtime,
+                     stat.st_size)
+    else:
+        cache_key = (kind, 'str', hashlib.sha1(pem_str.encode()).digest())
+
+    value = key_cache.get(cache_key)
+    if value is not None:
+        return value
 
-    if certificate_str is None:
-        certificate_file = config.get('certificate_file')
+    if pem_str is None:
+        logger.debug('Using %s file: %s', kind, pem_file)
 
-        logging.debug('Using certificate file: '.format(certificate_file))
+        with open(pem_file) as file:
+            pem_str = file.read()
+    else:
+        logger.debug('Using %s string', kind)
+
+    value = parse(pem_str)
+    key_cache.set(cache_key, value)
+    return value
 
-        with open(certificate_file) as file:
-            certificate_str = file.read()
 
+def _parse_certificate_data(certificate_str):
     return ''.join(certificate_str.split('\n')[1:-2])
 
 
-def load_private_key(config):
-    private_key_str = config.get('private_key_str')
+def clear_key_cache():
+    """
+    Forgets all parsed keys and certificates.
+    """
+    key_cache.clear()
 
-    if private_key_str is None:
-        private_key_file = config['private_key_file']
 
-        logging.debug('Using private key file: ' + private_key_file)
+def get_key_cache_stats():
+    """
+    Returns the hit/miss counters of the key material cache.
+    """
+    return key_cache.stats()
 
-        with open(private_key_file) as file:
-            private_key_str = file.read()
-    else:
-        logging.debug('Using private key string')
 
-    return OpenSSL.crypto.load_privatekey(
-            OpenSSL.crypto.FILETYPE_PEM, private_key_str)
+def load_certificate_data(config):
+    return _get_cached(config, 'certificate_str', 'certificate_file',
+                       'certificate', _parse_certificate_data)
+
+
+def load_private_key(config, signer=None):
+    """
+    Returns the private key, parsed for signer (default: the config's).
+    """
+    if signer is None:
+        signer = get_signer(config)
+
+    return _get_cached(config, 'private_key_str', 'private_key_file',
+                       signer.key_kind, signer.parse_private_key)
 
 
 def get_signature_xml(config, subject, reference_uri):
     """Returns XML Signature for subject."""
 
-    logging.debug('Subject: {}'.format(subject))
+    xml_dump.dump('Subject', subject)
+
+    signer = get_signer(config)
 
     # Hash the subject.
-    subject_hash = hashlib.sha1()
-    subject_hash.update(subject.encode())
-    subject_digest = nice64(subject_hash.digest())
+    subject_digest = nice64(signer.digest(subject.encode()))
 
-    logging.debug('Subject digest: {}'.format(subject_digest))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Subject digest: %s', subject_digest)
 
     # Create signed_info.
-    signed_info = string.Template(SIGNED_INFO).substitute({
+    signed_info = _SIGNED_INFO.substitute({
+        'DIGEST_METHOD': signer.digest_method,
         'REFERENCE_URI': reference_uri,
+        'SIGNATURE_METHOD': signer.signature_method,
         'SUBJECT_DIGEST': subject_digest,
     })
 
-    logging.debug('SignedInfo XML: {}'.format(signed_info))
+    xml_dump.dump('SignedInfo XML', signed_info)
 
-    # RSA-sign the signed_info.
-    private_key = load_private_key(config)
-    signed_private_key = OpenSSL.crypto.sign(private_key, signed_info, 'sha1')
-    rsa_signature = nice64(signed_private_key)
+    # Sign the signed_info.
+    private_key = load_private_key(config, signer)
+    pool = get_pool()
+    start = time.perf_counter()
+    if pool is None:
+        raw_signature = signer.sign(private_key, signed_info.encode())
+    else:
+        raw_signature = pool.sign(signer, private_key, signed_info.encode())
+    metrics.observe('saml2idp_signing_seconds', time.perf_counter() - start,
+                    algorithm=signer.signature_method.rpartition('#')[2])
+    signature_value = nice64(raw_signature)
 
-    logging.debug('RSA Signature: {}'.format(rsa_signature))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Signature value: %s', signature_value)
 
     # Load the certificate.
     certificate = load_certificate_data(config)
 
-    # Put the signed_info and rsa_signature into the XML signature.
+    # Put the signed_info and signature_value into the XML signature.
     signed_info_short = signed_info.replace(
         ' xmlns:ds="http://www.w3.org/2000/09/xmldsig#"', '')
-    signature_xml = string.Template(SIGNATURE).substitute({
+    signature_xml = _SIGNATURE.substitute({
         'CERTIFICATE': certificate,
-        'RSA_SIGNATURE': rsa_signature,
+        'SIGNATURE_VALUE': signature_value,
         'SIGNED_INFO': signed_info_short,
     })
 
-    logging.debug('Signature XML: {}'.format(signature_xml))
+    xml_dump.dump('Signature XML', signature_xml)
 
     return signature_xml
@@ -19,13 +19,13 @@ NOTE #3: I'm now leaning towards using lxml's E factory to do some of this.
 SIGNED_INFO = (
     '<ds:SignedInfo xmlns:ds="http://www.w3.org/2000/09/xmldsig#">'
         '<ds:CanonicalizationMethod Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"></ds:CanonicalizationMethod>'  # noqa
-        '<ds:SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"></ds:SignatureMethod>'  # noqa
+        '<ds:SignatureMethod Algorithm="${SIGNATURE_METHOD}"></ds:SignatureMethod>'  # noqa
         '<ds:Reference URI="#${REFERENCE_URI}">'
             '<ds:Transforms>'
                 '<ds:Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"></ds:Transform>'  # noqa
                 '<ds:Transform Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"></ds:Transform>'  # noqa
             '</ds:Transforms>'
-            '<ds:DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"></ds:DigestMethod>'  # noqa
+            '<ds:DigestMethod Algorithm="${DIGEST_METHOD}"></ds:DigestMethod>'  # noqa
             '<ds:DigestValue>${SUBJECT_DIGEST}</ds:DigestValue>'
         '</ds:Reference>'
     '</ds:SignedInfo>'
@@ -34,7 +34,7 @@ SIGNED_INFO = (
 SIGNATURE = (
     '<ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#">'
         '${SIGNED_INFO}'  # noqa
-    '<ds:SignatureValue>${RSA_SIGNATURE}</ds:SignatureValue>'
+    '<ds:SignatureValue>${SIGNATURE_VALUE}</ds:SignatureValue>'
     '<ds:KeyInfo>'
         '<ds:X509Data>'
             '<ds:X509Certificate>${CERTIFICATE}</ds:X509Certificate>'  # noqa
@@ -31,7 +31,7 @@ setup(
     name='django-saml2-idp',
     include_package_data=True,
     install_requires=[
-        'beautifulsoup4==4.4.1',
+        'cryptography>=1.5',
         'pyOpenSSL==0.15.1',
     ],
     license='BSD',